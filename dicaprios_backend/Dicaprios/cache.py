@@ -0,0 +1,105 @@
+# dicaprios_backend/Dicaprios/cache.py
+"""
+Caché de lectura de los listados del catálogo (categorías, proveedores, productos).
+
+Cada modelo tiene un contador de versión en la caché. La clave de un listado incluye
+las versiones de los modelos de los que depende y la URL completa (parámetros
+incluidos), así que invalidar es solo incrementar el contador: las entradas
+antiguas dejan de usarse y caducan solas.
+
+El ETag se deriva de esa misma clave, por lo que un `If-None-Match` que coincide se
+responde con 304 sin consultar la base de datos ni serializar nada.
+
+Con varios procesos (gunicorn, uvicorn...) la caché debe ser compartida (Redis):
+con LocMemCache cada proceso tendría sus propios contadores.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from rest_framework.renderers import JSONRenderer
+
+VERSION_KEY = 'catalogo:version:{label}'
+LIST_KEY = 'catalogo:lista:{digest}'
+
+
+def _cache():
+    return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def _version_key(model):
+    return VERSION_KEY.format(label=model._meta.label_lower)
+
+
+def model_versions(models):
+    """Versión actual de cada modelo (en el mismo orden)."""
+    cache = _cache()
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            # Valor inicial basado en el reloj: si el contador se pierde (desalojo, reinicio
+            # de Redis) no se reutiliza una versión que ya tenga entradas en la caché.
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def _bump(models):
+    cache = _cache()
+    for model in models:
+        key = _version_key(model)
+        try:
+            cache.incr(key)
+        except ValueError: # El contador no existe todavía
+            cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_versions(*models):
+    """
+    Invalida los listados que dependen de `models`. Se incrementa la versión ahora y
+    otra vez al confirmar la transacción: una lectura concurrente que guarde datos aún
+    sin confirmar bajo la versión nueva queda descartada por el segundo incremento.
+    """
+    _bump(models)
+    transaction.on_commit(lambda: _bump(models))
+
+
+class CachedListMixin:
+    """
+    Cachea la respuesta JSON de `list` de un viewset. `cache_dependencies` indica los
+    modelos cuyas escrituras cambian el listado (p. ej. los de los campos *_nombre).
+    """
+    cache_dependencies = ()
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != 'json': # La API navegable no se cachea
+            return super().list(request, *args, **kwargs)
+
+        versions = model_versions(self.cache_dependencies)
+        digest = hashlib.sha1(
+            f'{type(self).__name__}|{versions}|{request.build_absolute_uri()}'.encode()
+        ).hexdigest()
+        etag = f'"{digest}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        cache = _cache()
+        key = LIST_KEY.format(digest=digest)
+        content = cache.get(key)
+        if content is None:
+            response = super().list(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            content = JSONRenderer().render(response.data)
+            cache.set(key, content)
+
+        response = HttpResponse(content, content_type='application/json')
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache' # El navegador revalida siempre con el ETag
+        return response
@@ -0,0 +1,42 @@
+# dicaprios_backend/Dicaprios/db_hooks.py
+"""
+Envoltorios de ejecución SQL fijos en todas las conexiones.
+
+`connection.execute_wrapper()` solo afecta a las conexiones del hilo que lo llama. En
+las vistas asíncronas el ORM se ejecuta en otro hilo (sync_to_async), así que las
+métricas y el perfilador de consultas registran aquí un envoltorio permanente, que se
+añade a cada conexión al abrirse. El envoltorio busca en una ContextVar si hay algo
+que medir; asgiref copia el contexto al hilo del ORM, así que encuentra la petición
+correcta. Sin nada que medir, cuesta una lectura de la ContextVar por consulta.
+"""
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+_wrappers = []
+
+
+def _install(connection):
+    for wrapper in _wrappers:
+        if wrapper not in connection.execute_wrappers:
+            # Al principio: connection.execute_wrapper() quita el último de la lista al salir del bloque
+            connection.execute_wrappers.insert(0, wrapper)
+
+
+def install_in_current_thread():
+    """Instala los envoltorios en las conexiones ya abiertas del hilo actual."""
+    for connection in connections.all():
+        _install(connection)
+
+
+def register_execute_wrapper(wrapper):
+    """Añade `wrapper` a todas las conexiones que se abran a partir de ahora y a las del hilo actual."""
+    if wrapper not in _wrappers:
+        _wrappers.append(wrapper)
+    install_in_current_thread()
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _install(connection)
+
+
+connection_created.connect(_on_connection_created, dispatch_uid='dicaprios_db_hooks')
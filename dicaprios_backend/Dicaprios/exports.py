@@ -0,0 +1,108 @@
+# dicaprios_backend/Dicaprios/exports.py
+"""
+Exportaciones en streaming (CSV o NDJSON).
+
+Las filas se leen con `values_list(...).iterator(chunk_size=...)`, sin instanciar
+modelos ni serializadores, y se envían por bloques con StreamingHttpResponse: la
+memoria no crece con el número de filas y el primer byte sale en cuanto llega el
+primer bloque de la base de datos (en PostgreSQL con un cursor de servidor).
+"""
+import csv
+import io
+import json
+from datetime import date, datetime, time, timedelta
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+EXPORT_CHUNK_SIZE = 2000 # Filas por lectura de la base de datos y por bloque enviado
+
+FORMATO_CSV = 'csv'
+FORMATO_NDJSON = 'ndjson'
+FORMATOS = {
+    FORMATO_CSV: 'text/csv; charset=utf-8',
+    FORMATO_NDJSON: 'application/x-ndjson',
+}
+
+
+def export_format(request):
+    """Formato pedido con ?formato= (no ?format=, reservado por DRF). Por defecto CSV."""
+    formato = request.query_params.get('formato', FORMATO_CSV).lower()
+    if formato not in FORMATOS:
+        raise ValidationError({"formato": f"Formato no soportado. Opciones: {', '.join(FORMATOS)}."})
+    return formato
+
+
+def date_param(request, nombre):
+    """Fecha AAAA-MM-DD del parámetro `nombre`, o None si no se indicó."""
+    valor = request.query_params.get(nombre)
+    if not valor:
+        return None
+    try:
+        return date.fromisoformat(valor)
+    except ValueError:
+        raise ValidationError({nombre: "Formato de fecha inválido, se espera AAAA-MM-DD."})
+
+
+def date_range_filter(request, campo, es_datetime=False):
+    """
+    Filtro {campo__gte, campo__lt} a partir de ?desde= y ?hasta= (incluidos). En campos
+    DateTimeField se usan los límites del día en la zona horaria actual, de modo que
+    la consulta puede usar el índice de la columna.
+    """
+    desde, hasta = date_param(request, 'desde'), date_param(request, 'hasta')
+    if desde and hasta and desde > hasta:
+        raise ValidationError({"desde": "'desde' no puede ser posterior a 'hasta'."})
+    filtro = {}
+    if desde:
+        filtro[f'{campo}__gte'] = timezone.make_aware(datetime.combine(desde, time.min)) if es_datetime else desde
+    if hasta:
+        siguiente = hasta + timedelta(days=1)
+        filtro[f'{campo}__lt'] = timezone.make_aware(datetime.combine(siguiente, time.min)) if es_datetime else siguiente
+    return filtro
+
+
+def _valor(valor):
+    if isinstance(valor, (date, datetime)):
+        return valor.isoformat()
+    return valor
+
+
+def _bloques_csv(columnas, filas):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff') # BOM: Excel abre el archivo como UTF-8
+    writer.writerow(columnas)
+    for i, fila in enumerate(filas, 1):
+        writer.writerow([_valor(valor) for valor in fila])
+        if i % EXPORT_CHUNK_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _bloques_ndjson(columnas, filas):
+    lineas = []
+    for fila in filas:
+        lineas.append(json.dumps(
+            {columna: _valor(valor) for columna, valor in zip(columnas, fila)}, default=str, ensure_ascii=False
+        ))
+        if len(lineas) == EXPORT_CHUNK_SIZE:
+            yield '\n'.join(lineas) + '\n'
+            lineas = []
+    if lineas:
+        yield '\n'.join(lineas) + '\n'
+
+
+def streaming_export(queryset, columnas, campos, formato, nombre):
+    """
+    Respuesta en streaming con `campos` de `queryset` (values_list) bajo las cabeceras
+    `columnas`. `nombre` es el nombre del archivo sin extensión.
+    """
+    filas = queryset.values_list(*campos).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    bloques = _bloques_csv(columnas, filas) if formato == FORMATO_CSV else _bloques_ndjson(columnas, filas)
+    response = StreamingHttpResponse(bloques, content_type=FORMATOS[formato])
+    response['Content-Disposition'] = f'attachment; filename="{nombre}.{formato}"'
+    return response
@@ -0,0 +1,226 @@
+# dicaprios_backend/Dicaprios/metrics.py
+"""
+Métricas de rendimiento por petición, expuestas en formato de texto de Prometheus.
+
+Por cada petición, etiquetada por ruta (nombre de la vista de Django), se registran:
+- La latencia total, por método y código de respuesta.
+- El número de consultas SQL y el tiempo pasado en la base de datos.
+- Las etapas marcadas con `stage()`: serialización, renderizado y, en el buscador
+  visual, decodificación, preprocesado, inferencia y búsqueda de similitud.
+
+Los histogramas viven en memoria del proceso, sin dependencias externas. Observar un
+valor es una búsqueda binaria y una suma bajo un lock, así que se pueden dejar activos
+en producción. Con varios procesos (gunicorn), cada uno expone sus propios
+contadores: Prometheus debe consultar cada proceso por separado, o usar un solo
+proceso con hilos.
+
+Uso en el código:
+
+    from Dicaprios.metrics import stage
+
+    with stage('inference'):
+        embedding = model.predict_batch(batch)
+
+Fuera de una petición (comandos, tests sin middleware) `stage()` no hace nada.
+"""
+import bisect
+import contextvars
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+
+PREFIX = 'dicaprios_'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0) # Segundos
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_ALLOWED_IPS = ('127.0.0.1', '::1') # Sin METRICS_TOKEN y con DEBUG = False, solo desde la propia máquina
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """Histograma con etiquetas. Guarda el recuento por cubeta y la suma de cada serie."""
+
+    def __init__(self, name, documentation, labelnames, buckets):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {} # {valores de las etiquetas: [recuentos por cubeta (+Inf al final), suma]}
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value) # Primera cubeta con le >= value
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def expose(self):
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        for labels, counts, total in snapshot:
+            pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labels)]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(bound)
+                bucket_labels = ','.join(pairs + [f'le="{le}"'])
+                lines.append(f'{self.name}_bucket{{{bucket_labels}}} {cumulative}')
+            label_text = '{' + ','.join(pairs) + '}' if pairs else ''
+            lines.append(f'{self.name}_sum{label_text} {_number(total)}')
+            lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return '\n'.join(lines)
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latencia de las peticiones HTTP.', ('route', 'method', 'status'), LATENCY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'Consultas SQL por petición.', ('route', 'method'), QUERY_COUNT_BUCKETS,
+)
+DB_DURATION = Histogram(
+    'http_request_db_duration_seconds', 'Tiempo en la base de datos por petición.', ('route', 'method'), LATENCY_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    'http_request_stage_duration_seconds', 'Tiempo por etapa de la petición (serialización, inferencia...).',
+    ('route', 'stage'), STAGE_BUCKETS,
+)
+HISTOGRAMS = (REQUEST_DURATION, DB_QUERIES, DB_DURATION, STAGE_DURATION)
+
+
+class RequestTimings:
+    """Tiempos acumulados durante una petición."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.db_queries = 0
+        self.db_seconds = 0.0
+        self.stages = {} # {etapa: segundos}
+        self._open = set() # Etapas en curso: las anidadas con el mismo nombre no se cuentan dos veces
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def execute_wrapper(self, execute, sql, params, many, context):
+        """Cuenta y cronometra cada consulta."""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_seconds += time.perf_counter() - start
+
+
+_current = contextvars.ContextVar('dicaprios_request_timings', default=None)
+
+
+def current_timings():
+    """Tiempos de la petición en curso, o None fuera de una petición."""
+    return _current.get()
+
+
+def begin_request():
+    """Empieza a medir una petición. Devuelve (tiempos, token para end_request)."""
+    timings = RequestTimings()
+    return timings, _current.set(timings)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def db_execute_wrapper(execute, sql, params, many, context):
+    """Envoltorio fijo de las conexiones (ver Dicaprios.db_hooks): mide si hay una petición en curso."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings.execute_wrapper(execute, sql, params, many, context)
+
+
+class stage:
+    """
+    Suma a la etapa `name` de la petición en curso el tiempo del bloque `with`.
+    Es una clase y no un @contextmanager porque se usa por cada fila serializada.
+    """
+    __slots__ = ('name', 'timings', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        timings = _current.get()
+        if timings is None or self.name in timings._open:
+            self.timings = None
+            return self
+        self.timings = timings
+        timings._open.add(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings._open.discard(self.name)
+            self.timings.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def record(route, method, status_code, timings, total_seconds):
+    REQUEST_DURATION.observe(total_seconds, route, method, str(status_code))
+    DB_QUERIES.observe(timings.db_queries, route, method)
+    DB_DURATION.observe(timings.db_seconds, route, method)
+    for name, seconds in timings.stages.items():
+        STAGE_DURATION.observe(seconds, route, name)
+
+
+def server_timing(timings, total_seconds):
+    """Valor de la cabecera Server-Timing (duraciones en milisegundos)."""
+    parts = [f'db;dur={timings.db_seconds * 1000:.2f};desc="{timings.db_queries} consultas"']
+    parts += [f'{name};dur={seconds * 1000:.2f}' for name, seconds in timings.stages.items()]
+    parts.append(f'total;dur={total_seconds * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def render_metrics():
+    return '\n'.join(histogram.expose() for histogram in HISTOGRAMS) + '\n'
+
+
+def reset_metrics():
+    """Vacía todos los histogramas (para los tests)."""
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+
+
+def metrics_view(request):
+    """
+    GET /metrics en formato de texto de Prometheus. Si METRICS_TOKEN está configurado,
+    exige la cabecera `Authorization: Bearer <token>`. Si no, fuera de DEBUG solo
+    responde a las IPs de METRICS_ALLOWED_IPS (por defecto, la propia máquina).
+    """
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return HttpResponse('No autorizado.\n', status=401, content_type='text/plain; charset=utf-8')
+    elif not settings.DEBUG:
+        allowed_ips = getattr(settings, 'METRICS_ALLOWED_IPS', DEFAULT_ALLOWED_IPS)
+        if request.META.get('REMOTE_ADDR') not in allowed_ips:
+            return HttpResponse('Prohibido.\n', status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
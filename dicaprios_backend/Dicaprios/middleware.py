@@ -0,0 +1,122 @@
+# dicaprios_backend/Dicaprios/middleware.py
+"""
+Middleware comunes del proyecto.
+
+Admiten peticiones síncronas y asíncronas (sync_capable y async_capable): bajo ASGI,
+un middleware solo síncrono obligaría a Django a pasar cada petición por un hilo, y las
+vistas asíncronas (p. ej. el buscador visual) dejarían de ejecutarse en el bucle de eventos.
+"""
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import db_hooks, metrics
+from .query_profiler import profile_queries, log_profile
+
+
+class MetricsMiddleware:
+    """
+    Mide cada petición (ver Dicaprios.metrics): latencia, consultas y tiempo de base de
+    datos (ver Dicaprios.db_hooks) y las etapas marcadas con `stage()`. El
+    renderizado de las respuestas de DRF se mide como etapa 'render'.
+
+    Con METRICS_SERVER_TIMING = True añade la cabecera Server-Timing, visible en las
+    herramientas de desarrollo del navegador. Debe ir el primero en MIDDLEWARE para
+    cubrir también a los demás middleware.
+
+    En las respuestas en streaming (exportaciones) se mide hasta que empieza el envío,
+    no hasta el último byte.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'METRICS_ENABLED', True)
+        self.server_timing = getattr(settings, 'METRICS_SERVER_TIMING', False)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        if self.enabled:
+            db_hooks.register_execute_wrapper(metrics.db_execute_wrapper)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if not self.enabled:
+            return self.get_response(request)
+
+        timings, token = metrics.begin_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._record(request, response, timings)
+
+    async def __acall__(self, request):
+        if not self.enabled:
+            return await self.get_response(request)
+
+        timings, token = metrics.begin_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            metrics.end_request(token)
+        return self._record(request, response, timings)
+
+    def _record(self, request, response, timings):
+        total = time.perf_counter() - timings.started
+        match = getattr(request, 'resolver_match', None)
+        # Nombre de la vista, no la URL: el número de series no crece con los IDs
+        route = (match.view_name or match.route) if match is not None else 'sin_ruta'
+        metrics.record(route, request.method, response.status_code, timings, total)
+        if self.server_timing:
+            response['Server-Timing'] = metrics.server_timing(timings, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # Se llama justo antes de response.render() (p. ej. el JSON de una Response de DRF)
+        timings = metrics.current_timings()
+        if timings is not None:
+            start = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: timings.add('render', time.perf_counter() - start))
+        return response
+
+
+class QueryProfilerMiddleware:
+    """
+    Perfila las consultas de una fracción de las peticiones (QUERY_PROFILER_SAMPLE_RATE,
+    0 = desactivado) y registra sus N+1 y consultas lentas, con EXPLAIN, en el registro
+    de consultas lentas (ver Dicaprios.query_profiler).
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'QUERY_PROFILER_SAMPLE_RATE', 0.0)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+        with profile_queries() as profile:
+            response = self.get_response(request)
+        log_profile(profile, request.method, request.path)
+        return response
+
+    async def __acall__(self, request):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return await self.get_response(request)
+        with profile_queries() as profile:
+            response = await self.get_response(request)
+        log_profile(profile, request.method, request.path)
+        return response
@@ -0,0 +1,34 @@
+# dicaprios_backend/Dicaprios/pagination.py
+"""
+Paginación por cursor (keyset) para todos los viewsets.
+
+Cada página filtra por la posición del último registro (`WHERE orden > posición`)
+en lugar de usar OFFSET, así que el coste no crece al avanzar hacia páginas
+profundas siempre que el campo de orden esté indexado.
+
+Es opcional para no romper a los clientes que esperan la lista completa: solo se
+pagina cuando la petición incluye `?page_size=` o `?cursor=`. La respuesta es
+entonces {"next": url, "previous": url, "results": [...]}.
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+    # Orden por defecto; los viewsets pueden declarar `cursor_ordering` (el primer campo
+    # debe ser único o casi único e indexado, p. ej. la clave primaria).
+    ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if self.cursor_query_param not in params and self.page_size_query_param not in params:
+            return None # Sin parámetros de paginación: lista completa (compatibilidad)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering:
+            return (ordering,) if isinstance(ordering, str) else tuple(ordering)
+        return super().get_ordering(request, queryset, view)
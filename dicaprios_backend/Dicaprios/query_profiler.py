@@ -0,0 +1,217 @@
+# dicaprios_backend/Dicaprios/query_profiler.py
+"""
+Perfilador de consultas SQL por petición, enganchado a las conexiones con un
+execute_wrapper fijo (ver Dicaprios.db_hooks), así que también cubre el ORM asíncrono.
+
+Para cada consulta guarda su forma (el SQL sin valores, con las listas IN y las filas
+de los INSERT múltiples colapsadas), la duración y la línea del proyecto que la
+originó. Con eso:
+- Agrupa las consultas repetidas de la petición.
+- Marca como probable N+1 una misma SELECT repetida `n_plus_one_threshold` veces o
+  más (típicamente, una relación leída fila a fila en un serializador).
+- Ejecuta EXPLAIN sobre las consultas que tardan más de `slow_ms`.
+
+Se usa de dos formas:
+- En producción, por muestreo, con QueryProfilerMiddleware (QUERY_PROFILER_SAMPLE_RATE).
+  Las consultas lentas y los N+1 se escriben en el logger 'Dicaprios.query_profiler'
+  (un archivo rotativo, ver LOGGING en settings.py).
+- En los tests, con `profile_queries()` o APITestMixin.assertNoNPlusOne().
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from django.conf import settings
+
+from . import db_hooks
+
+logger = logging.getLogger('Dicaprios.query_profiler')
+
+DEFAULT_SLOW_MS = 100
+DEFAULT_N_PLUS_ONE_THRESHOLD = 5
+MAX_SQL_LOG_LENGTH = 2000 # Caracteres de SQL por entrada del registro
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+_IN_RE = re.compile(r'\bIN \((?:%s|\?)(?:, (?:%s|\?))*\)', re.IGNORECASE)
+_VALUES_RE = re.compile(r'(\((?:%s|\?)(?:, (?:%s|\?))*\))(?:, \1)+')
+
+_PROJECT_DIR = str(settings.BASE_DIR) + os.sep
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def query_shape(sql):
+    """SQL sin valores: dos consultas con la misma forma solo difieren en los parámetros."""
+    shape = _STRING_RE.sub('?', sql)
+    shape = _NUMBER_RE.sub('?', shape)
+    shape = _IN_RE.sub('IN (...)', shape)
+    return _VALUES_RE.sub(r'\1, ...', shape)
+
+
+def _origin():
+    """
+    Primera línea del proyecto (fuera de este módulo y de las dependencias) en la pila.
+    En los métodos se añade la clase de `self`: en un serializador la línea suele ser la
+    de un mixin común, y la clase indica cuál es el serializador afectado.
+    """
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if (filename.startswith(_PROJECT_DIR) and filename != _THIS_FILE
+                and 'site-packages' not in filename and os.sep + 'venv' + os.sep not in filename):
+            function = frame.f_code.co_name
+            owner = frame.f_locals.get('self') if frame.f_code.co_argcount else None
+            if owner is not None:
+                function = f'{type(owner).__name__}.{function}'
+            return f'{os.path.relpath(filename, _PROJECT_DIR)}:{frame.f_lineno} ({function})'
+        frame = frame.f_back
+    return None
+
+
+@dataclass
+class QueryRecord:
+    alias: str
+    sql: str
+    shape: str
+    params: object
+    duration_ms: float
+    origin: str
+    explain: str = None
+
+
+class QueryProfile:
+    """Consultas de un bloque de código (ver `profile_queries`)."""
+
+    def __init__(self, slow_ms=None, explain=True, n_plus_one_threshold=None, using=None):
+        self.slow_ms = slow_ms if slow_ms is not None else getattr(settings, 'QUERY_PROFILER_SLOW_MS', DEFAULT_SLOW_MS)
+        self.explain = explain
+        self.n_plus_one_threshold = n_plus_one_threshold or getattr(
+            settings, 'QUERY_PROFILER_N_PLUS_ONE_THRESHOLD', DEFAULT_N_PLUS_ONE_THRESHOLD
+        )
+        self.using = using # None: todas las conexiones
+        self.queries = []
+        self._explaining = False
+
+    def add(self, sql, params, many, context, duration_ms, failed, origin):
+        connection = context['connection']
+        if self.using is not None and connection.alias != self.using:
+            return
+        record = QueryRecord(connection.alias, sql, query_shape(sql), params, duration_ms, origin)
+        self.queries.append(record)
+        if self.explain and not failed and not many and duration_ms >= self.slow_ms:
+            record.explain = self._explain(connection, sql, params)
+
+    def _explain(self, connection, sql, params):
+        if not sql.lstrip().upper().startswith('SELECT'):
+            return None
+        self._explaining = True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                return '\n'.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
+        except Exception as e: # Una transacción abortada o SQL que no admite EXPLAIN: no romper la petición
+            return f'EXPLAIN no disponible: {e}'
+        finally:
+            self._explaining = False
+
+    @property
+    def total_ms(self):
+        return sum(query.duration_ms for query in self.queries)
+
+    def groups(self):
+        """Consultas agrupadas por forma, de más a menos repetidas."""
+        groups = {}
+        for query in self.queries:
+            group = groups.setdefault(query.shape, {'shape': query.shape, 'count': 0, 'total_ms': 0.0, 'origins': Counter()})
+            group['count'] += 1
+            group['total_ms'] += query.duration_ms
+            group['origins'][query.origin] += 1
+        return sorted(groups.values(), key=lambda group: (-group['count'], -group['total_ms']))
+
+    def n_plus_one(self):
+        """Grupos de SELECT repetidas que probablemente vienen de un bucle fila a fila."""
+        return [
+            {
+                'shape': group['shape'],
+                'count': group['count'],
+                'total_ms': round(group['total_ms'], 3),
+                'origin': group['origins'].most_common(1)[0][0],
+            }
+            for group in self.groups()
+            if group['count'] >= self.n_plus_one_threshold and group['shape'].lstrip().upper().startswith('SELECT')
+        ]
+
+    def slow_queries(self):
+        return [query for query in self.queries if query.duration_ms >= self.slow_ms]
+
+    def report(self):
+        """Resumen legible (para mensajes de error de los tests)."""
+        lines = [f'{len(self.queries)} consultas, {self.total_ms:.1f} ms']
+        for group in self.n_plus_one():
+            lines.append(f"N+1: {group['count']}x desde {group['origin']}: {group['shape'][:300]}")
+        for query in self.slow_queries():
+            lines.append(f'Lenta ({query.duration_ms:.1f} ms) desde {query.origin}: {query.sql[:300]}')
+        return '\n'.join(lines)
+
+
+_active = contextvars.ContextVar('dicaprios_query_profiles', default=())
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    profiles = _active.get()
+    if not profiles or any(profile._explaining for profile in profiles): # El propio EXPLAIN no se registra
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    failed = True
+    try:
+        result = execute(sql, params, many, context)
+        failed = False
+        return result
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        origin = _origin()
+        for profile in profiles:
+            profile.add(sql, params, many, context, duration_ms, failed, origin)
+
+
+@contextmanager
+def profile_queries(using=None, **kwargs):
+    """
+    Perfila las consultas del bloque en la conexión indicada (todas por defecto),
+    incluidas las que el ORM asíncrono ejecuta en otros hilos:
+
+        with profile_queries() as profile:
+            client.get('/api/facturas/')
+        assert not profile.n_plus_one(), profile.report()
+
+    Los bloques anidados registran las consultas en todos los perfiles activos.
+    """
+    profile = QueryProfile(using=using, **kwargs)
+    db_hooks.register_execute_wrapper(_execute_wrapper)
+    token = _active.set(_active.get() + (profile,))
+    try:
+        yield profile
+    finally:
+        _active.reset(token)
+
+
+def log_profile(profile, method, path):
+    """Escribe en el registro de consultas lentas los N+1 y las consultas lentas de una petición."""
+    for group in profile.n_plus_one():
+        logger.warning(json.dumps({
+            'tipo': 'n_plus_one', 'metodo': method, 'ruta': path, 'repeticiones': group['count'],
+            'total_ms': group['total_ms'], 'origen': group['origin'], 'sql': group['shape'][:MAX_SQL_LOG_LENGTH],
+        }, ensure_ascii=False))
+    for query in profile.slow_queries():
+        logger.warning(json.dumps({
+            'tipo': 'lenta', 'metodo': method, 'ruta': path, 'duracion_ms': round(query.duration_ms, 3),
+            'origen': query.origin, 'base_de_datos': query.alias, 'sql': query.sql[:MAX_SQL_LOG_LENGTH],
+            'explain': query.explain,
+        }, ensure_ascii=False, default=str))
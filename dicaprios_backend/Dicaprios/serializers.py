@@ -0,0 +1,78 @@
+# dicaprios_backend/Dicaprios/serializers.py
+"""
+Utilidades comunes para los serializadores de la API.
+"""
+from .metrics import stage
+
+
+class SparseFieldsetMixin:
+    """
+    Permite elegir los campos de la respuesta con `?fields=id,nombre` o excluirlos con
+    `?omit=imagen_url`. Los campos omitidos no se calculan (p. ej. SerializerMethodField
+    o serializadores anidados), por lo que las pantallas de listado pueden evitar los costosos.
+
+    Solo se aplica en lecturas (GET/HEAD) y en el serializador principal de la petición,
+    no en los anidados.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        # Los serializadores anidados se construyen sin contexto, así que no se ven afectados
+        if request is None or request.method not in ('GET', 'HEAD'):
+            return
+        for name in list(self.fields):
+            if field_excluded(request, name):
+                self.fields.pop(name)
+
+
+def field_excluded(request, name):
+    """True si la petición excluye el campo `name` con ?fields= u ?omit= (solo lecturas)."""
+    if request is None or request.method not in ('GET', 'HEAD'):
+        return False
+    fields = _param_list(request.query_params.get('fields'))
+    return (bool(fields) and name not in fields) or name in _param_list(request.query_params.get('omit'))
+
+
+def _param_list(value):
+    return {item.strip() for item in value.split(',') if item.strip()} if value else set()
+
+
+class EagerLoadingMixin:
+    """
+    Declara en el serializador las relaciones que lee, para cargarlas en la misma consulta
+    (select_related) o en una consulta adicional por relación (prefetch_related) en lugar
+    de una consulta por fila. Los viewsets lo aplican con EagerLoadingViewSetMixin.
+    Las relaciones prefetch cuyo campo anidado se omite con ?fields=/?omit= no se consultan,
+    y tampoco las select_related cuyos campos se omiten todos.
+    """
+    select_related_fields = {} # {relación: campos del serializador que la leen}
+    prefetch_related_fields = () # Nombres o objetos Prefetch (el nombre debe coincidir con el campo)
+
+    @classmethod
+    def setup_eager_loading(cls, queryset, request=None):
+        related = [
+            relation for relation, fields in cls.select_related_fields.items()
+            if not all(field_excluded(request, name) for name in fields)
+        ]
+        if related:
+            queryset = queryset.select_related(*related)
+        prefetches = [
+            lookup for lookup in cls.prefetch_related_fields
+            if not field_excluded(request, getattr(lookup, 'prefetch_to', lookup).split('__')[0])
+        ]
+        if prefetches:
+            queryset = queryset.prefetch_related(*prefetches)
+        return queryset
+
+
+class TimedRepresentationMixin:
+    """
+    Mide como etapa 'serialize' (ver Dicaprios.metrics) el tiempo de to_representation.
+    En los listados se mide cada fila, así que no incluye la consulta del queryset;
+    los serializadores anidados quedan dentro del tiempo del que los contiene.
+    """
+
+    def to_representation(self, instance):
+        with stage('serialize'):
+            return super().to_representation(instance)
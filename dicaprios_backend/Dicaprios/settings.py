@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -49,6 +50,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Dicaprios.middleware.MetricsMiddleware', # El primero: mide también al resto de middleware
+    'Dicaprios.middleware.QueryProfilerMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -59,6 +62,43 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Métricas por petición en /metrics (formato Prometheus, ver Dicaprios/metrics.py).
+# METRICS_SERVER_TIMING añade la cabecera Server-Timing con el desglose de cada respuesta.
+# Con METRICS_TOKEN, /metrics exige 'Authorization: Bearer <token>'. Sin token y con DEBUG = False,
+# solo responde a las IPs de METRICS_ALLOWED_IPS (separadas por comas; por defecto, la propia máquina).
+METRICS_ENABLED = True
+METRICS_SERVER_TIMING = os.environ.get('METRICS_SERVER_TIMING', '0') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+METRICS_ALLOWED_IPS = [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()]
+
+# Perfilador de consultas (ver Dicaprios/query_profiler.py): fracción de peticiones perfiladas
+# (0 = ninguna, 1 = todas), umbral de consulta lenta y repeticiones que se consideran N+1.
+# Los hallazgos se escriben en un archivo rotativo (SLOW_QUERY_LOG).
+QUERY_PROFILER_SAMPLE_RATE = float(os.environ.get('QUERY_PROFILER_SAMPLE_RATE', '0'))
+QUERY_PROFILER_SLOW_MS = int(os.environ.get('QUERY_PROFILER_SLOW_MS', '100'))
+QUERY_PROFILER_N_PLUS_ONE_THRESHOLD = 5
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "consultas_lentas": {
+            "class": "logging.handlers.RotatingFileHandler",
+            "filename": os.environ.get('SLOW_QUERY_LOG', str(BASE_DIR / 'consultas_lentas.log')),
+            "maxBytes": 10 * 1024 * 1024,
+            "backupCount": 5,
+            "delay": True, # El archivo no se crea hasta la primera entrada
+            "encoding": "utf-8",
+        },
+        "consola": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "Dicaprios.query_profiler": {"handlers": ["consultas_lentas"], "level": "WARNING", "propagate": False},
+        # Carga del modelo y del índice de búsqueda visual; los errores incluyen el detalle que no se expone en la API
+        "visual_searcher": {"handlers": ["consola"], "level": os.environ.get('VISUAL_SEARCH_LOG_LEVEL', 'INFO'), "propagate": False},
+    },
+}
+
 ROOT_URLCONF = 'Dicaprios.urls'
 
 TEMPLATES = [
@@ -93,12 +133,46 @@ WSGI_APPLICATION = 'Dicaprios.wsgi.application'
 #         # 'PORT': '3306',
 #     }
 # }
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": "mydatabase",
+# Producción: PostgreSQL si está definida POSTGRES_DB. Con DB_POOL (por defecto activo) se usa
+# el pool de psycopg 3 (pip install "psycopg[binary,pool]"), que comparten los hilos de un worker
+# WSGI y las tareas de uno ASGI; cada petición devuelve su conexión al pool al terminar.
+# Sin pool se reutilizan conexiones persistentes (CONN_MAX_AGE) con comprobación de salud.
+if os.environ.get('POSTGRES_DB'):
+    DB_POOL = os.environ.get('DB_POOL', '1') == '1'
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ['POSTGRES_DB'],
+            "USER": os.environ.get('POSTGRES_USER', 'postgres'),
+            "PASSWORD": os.environ.get('POSTGRES_PASSWORD', ''),
+            "HOST": os.environ.get('POSTGRES_HOST', 'localhost'),
+            "PORT": os.environ.get('POSTGRES_PORT', '5432'),
+            "CONN_MAX_AGE": 0 if DB_POOL else int(os.environ.get('DB_CONN_MAX_AGE', '60')), # El pool no admite conexiones persistentes
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                "pool": {
+                    "min_size": int(os.environ.get('DB_POOL_MIN_SIZE', '2')),
+                    "max_size": int(os.environ.get('DB_POOL_MAX_SIZE', '20')),
+                    "timeout": int(os.environ.get('DB_POOL_TIMEOUT', '10')), # Segundos esperando una conexión libre
+                },
+            } if DB_POOL else {},
+        }
+    }
+else:
+    # Desarrollo local: SQLite en modo WAL (las lecturas no esperan a las escrituras).
+    # Las transacciones empiezan con BEGIN IMMEDIATE para tomar el bloqueo de escritura al
+    # principio y esperar hasta `timeout` segundos en vez de fallar con "database is locked".
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": "mydatabase",
+            "OPTIONS": {
+                "timeout": 20,
+                "transaction_mode": "IMMEDIATE",
+                "init_command": "PRAGMA journal_mode=WAL;PRAGMA synchronous=NORMAL",
+            },
+        }
     }
-}
 
 
 
@@ -159,6 +233,8 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Paginación por cursor opcional: solo con ?page_size= o ?cursor= (ver Dicaprios/pagination.py)
+    'DEFAULT_PAGINATION_CLASS': 'Dicaprios.pagination.KeysetCursorPagination',
 }
 
 SIMPLE_JWT = {
@@ -171,3 +247,69 @@ SIMPLE_JWT = {
 }
 
 
+# Búsqueda visual
+# 'flat' = búsqueda exacta, 'ivf' = índice aproximado construido por 'generate_image_embeddings'.
+# VISUAL_SEARCH_NPROBE controla cuántas listas IVF se recorren (más = mejor recall, más latencia).
+VISUAL_SEARCH_INDEX = 'ivf'
+VISUAL_SEARCH_NPROBE = 8
+# Tipo con el que se recorren los embeddings ('float32', 'float16' o 'int8'); los archivos se
+# abren con mmap y se comparten entre procesos. Con float16/int8, los k * VISUAL_SEARCH_RESCORE_FACTOR
+# mejores candidatos se re-puntúan con la copia float32 (0 = sin re-puntuar). Es el tipo de las regeneraciones
+# completas; 'generate_image_embeddings --incremental' conserva el de la versión base salvo que se pase --dtype.
+VISUAL_SEARCH_STORAGE_DTYPE = 'int8'
+VISUAL_SEARCH_RESCORE_FACTOR = 4
+# Las consultas concurrentes de un mismo proceso se agrupan en un solo lote de inferencia:
+# se espera como máximo VISUAL_SEARCH_MAX_BATCH_WAIT_MS para reunir hasta VISUAL_SEARCH_MAX_BATCH_SIZE imágenes.
+VISUAL_SEARCH_DYNAMIC_BATCHING = True
+VISUAL_SEARCH_MAX_BATCH_SIZE = 32
+VISUAL_SEARCH_MAX_BATCH_WAIT_MS = 5
+# Las imágenes de consulta se decodifican en memoria; las que superan este número de píxeles se rechazan (413).
+VISUAL_SEARCH_MAX_QUERY_PIXELS = 40_000_000
+# Cada proceso del servidor carga y calienta el modelo y el índice en segundo plano al arrancar
+# (VisualSearcherConfig.ready); /api/visual-search/health/ responde 200 cuando el proceso está listo.
+VISUAL_SEARCH_EAGER_WARMUP = True
+# Caché de embeddings de imágenes de consulta (clave: hash de la imagen + versión del índice).
+# LocMemCache es una LRU por proceso limitada por MAX_ENTRIES; para compartirla entre workers
+# usar Redis, p. ej. 'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'.
+VISUAL_SEARCH_CACHE_ALIAS = 'visual_search'
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'visual_search': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'visual-search-embeddings',
+        'TIMEOUT': 60 * 60, # Segundos
+        'OPTIONS': {'MAX_ENTRIES': 2000}, # ~8 KB por embedding
+    },
+    'catalog': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'catalog-lists',
+        'TIMEOUT': 10 * 60, # Las versiones invalidan antes; esto solo limpia entradas huérfanas
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+# Caché de los listados de categorías, proveedores y productos (ver Dicaprios/cache.py).
+# Con REDIS_URL definida se usa Redis, necesario con varios workers para que todos vean
+# las mismas versiones (con LocMemCache cada proceso solo ve sus propias escrituras).
+CATALOG_CACHE_ALIAS = 'catalog'
+if os.environ.get('REDIS_URL'):
+    CACHES['catalog'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+        'KEY_PREFIX': 'dicaprios',
+        'TIMEOUT': 10 * 60,
+    }
+# Motor de inferencia de ResNet50: 'keras' (TensorFlow), 'onnx' (ONNX Runtime) o 'tflite'.
+# Los modelos ONNX/TFLite se generan con 'python manage.py export_visual_model --backend onnx [--quantize]';
+# si el motor o su modelo no están disponibles se usa Keras. THREADS = None deja el valor del motor.
+VISUAL_SEARCH_INFERENCE_BACKEND = 'keras'
+VISUAL_SEARCH_INFERENCE_QUANTIZED = False
+VISUAL_SEARCH_INFERENCE_THREADS = None
+# Búsqueda visual asíncrona (/api/visual-search/search-async/, con ASGI): hilos para decodificar,
+# preprocesar y buscar, y control de admisión. Con MAX_CONCURRENT búsquedas en curso las siguientes
+# esperan turno; con MAX_QUEUE esperando, o tras QUEUE_TIMEOUT_SECONDS, se responde 503 con Retry-After.
+VISUAL_SEARCH_ASYNC_WORKERS = 4
+VISUAL_SEARCH_MAX_CONCURRENT = 8
+VISUAL_SEARCH_MAX_QUEUE = 32
+VISUAL_SEARCH_QUEUE_TIMEOUT_SECONDS = 5
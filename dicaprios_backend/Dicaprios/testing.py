@@ -0,0 +1,64 @@
+# dicaprios_backend/Dicaprios/testing.py
+"""
+Utilidades para los tests de la API.
+"""
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from .query_profiler import profile_queries
+
+
+class APITestMixin:
+    """Cliente autenticado y comprobaciones de consultas (constantes en los listados, sin N+1)."""
+
+    def setUp(self):
+        super().setUp()
+        # La base de datos se revierte entre tests, pero la caché de listados no
+        caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')].clear()
+        self.user = User.objects.create_user('tester', 'tester@example.com', 'clave')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def count_list_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(ctx.captured_queries)
+
+    def count_post_queries(self, url, data=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(url, data, format='json')
+        self.assertIn(response.status_code, (200, 201), response.content)
+        return len(ctx.captured_queries)
+
+    def assertConstantListQueries(self, url, create_rows, small=3, large=15):
+        """
+        Crea `small` filas con `create_rows(n)`, cuenta las consultas del listado, crea
+        `large` filas más y comprueba que el número de consultas no cambia (sin N+1).
+        """
+        create_rows(small)
+        queries_small = self.count_list_queries(url)
+        create_rows(large)
+        queries_large = self.count_list_queries(url)
+        self.assertEqual(
+            queries_small, queries_large,
+            f"{url}: {queries_small} consultas con {small} filas y {queries_large} con {small + large} (N+1)."
+        )
+        return queries_large
+
+    @contextmanager
+    def assertNoNPlusOne(self, threshold=None):
+        """
+        Falla si dentro del bloque se repite `threshold` veces o más una misma SELECT
+        (ver Dicaprios.query_profiler). El mensaje indica la línea que la origina.
+        """
+        with profile_queries(n_plus_one_threshold=threshold, explain=False) as profile:
+            yield profile
+        if profile.n_plus_one():
+            self.fail(f"Posible N+1:\n{profile.report()}")
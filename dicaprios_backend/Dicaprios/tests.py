@@ -0,0 +1,116 @@
+import json
+
+from django.test import TestCase, override_settings
+
+from clientes.models import Cliente
+from .metrics import Histogram, reset_metrics
+from .query_profiler import profile_queries, query_shape
+from .testing import APITestMixin
+
+
+class MetricsTests(APITestMixin, TestCase):
+    """Middleware de métricas y endpoint /metrics (usa el listado de clientes como petición de ejemplo)."""
+
+    def setUp(self):
+        super().setUp()
+        reset_metrics()
+        Cliente.objects.bulk_create([
+            Cliente(nombre=f'Cliente {i}', email='c@example.com', telefono=1, direccion='Zona 1') for i in range(3)
+        ])
+
+    def test_metricas_por_ruta(self):
+        self.assertEqual(self.client.get('/api/clientes/').status_code, 200)
+        self.client.get('/api/clientes/')
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('dicaprios_http_request_duration_seconds_count{route="cliente-list",method="GET",status="200"} 2', body)
+        self.assertIn('dicaprios_http_request_db_queries_sum{route="cliente-list",method="GET"} 2', body) # 1 consulta por petición
+        self.assertIn('dicaprios_http_request_stage_duration_seconds_count{route="cliente-list",stage="serialize"} 2', body)
+        self.assertIn('dicaprios_http_request_stage_duration_seconds_count{route="cliente-list",stage="render"} 2', body)
+
+    def test_server_timing_desactivado_por_defecto(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/clientes/'))
+
+    @override_settings(METRICS_SERVER_TIMING=True)
+    def test_server_timing(self):
+        header = self.client.get('/api/clientes/')['Server-Timing']
+        self.assertIn('db;dur=', header)
+        self.assertIn('desc="1 consultas"', header)
+        self.assertIn('serialize;dur=', header)
+        self.assertIn('total;dur=', header)
+
+    @override_settings(METRICS_TOKEN='secreto')
+    def test_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto').status_code, 200)
+        self.assertEqual(
+            self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secreto', REMOTE_ADDR='203.0.113.7').status_code, 200
+        )
+
+    @override_settings(METRICS_TOKEN=None, METRICS_ALLOWED_IPS=['127.0.0.1', '10.0.0.5'])
+    def test_sin_token_solo_ips_permitidas(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200) # El cliente de tests usa 127.0.0.1
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        with override_settings(DEBUG=True):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 200)
+
+    def test_formato_histograma(self):
+        histogram = Histogram('prueba', 'Prueba.', ('route',), (1, 5))
+        for value in (0.5, 1, 3, 7):
+            histogram.observe(value, 'a"b')
+        self.assertEqual(histogram.expose().splitlines()[2:], [
+            'dicaprios_prueba_bucket{route="a\\"b",le="1"} 2',
+            'dicaprios_prueba_bucket{route="a\\"b",le="5"} 3',
+            'dicaprios_prueba_bucket{route="a\\"b",le="+Inf"} 4',
+            'dicaprios_prueba_sum{route="a\\"b"} 11.5',
+            'dicaprios_prueba_count{route="a\\"b"} 4',
+        ])
+
+
+class QueryProfilerTests(APITestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Cliente.objects.bulk_create([
+            Cliente(nombre=f'Cliente {i}', email='c@example.com', telefono=1, direccion='Zona 1') for i in range(6)
+        ])
+
+    def test_forma_de_la_consulta(self):
+        self.assertEqual(
+            query_shape('SELECT "T1"."id" FROM t WHERE a IN (%s, %s, %s) AND b = \'x\' LIMIT 21'),
+            'SELECT "T1"."id" FROM t WHERE a IN (...) AND b = ? LIMIT ?',
+        )
+        self.assertEqual(query_shape('INSERT INTO t VALUES (%s, %s), (%s, %s), (%s, %s)'), 'INSERT INTO t VALUES (%s, %s), ...')
+
+    def test_detecta_n_mas_1_con_su_origen(self):
+        with profile_queries() as profile:
+            for cliente_id in Cliente.objects.values_list('id', flat=True):
+                Cliente.objects.get(id=cliente_id) # Una consulta por fila
+        self.assertEqual(len(profile.queries), 7)
+        [grupo] = profile.n_plus_one()
+        self.assertEqual(grupo['count'], 6)
+        self.assertIn('Dicaprios/tests.py', grupo['origin'])
+        self.assertIn('test_detecta_n_mas_1_con_su_origen', grupo['origin'])
+
+    def test_assert_no_n_plus_one(self):
+        with self.assertNoNPlusOne():
+            self.client.get('/api/clientes/')
+        with self.assertRaisesMessage(AssertionError, 'Posible N+1'):
+            with self.assertNoNPlusOne():
+                for cliente in Cliente.objects.all():
+                    Cliente.objects.filter(id=cliente.id).exists()
+
+    def test_explain_de_consultas_lentas(self):
+        with profile_queries(slow_ms=0) as profile: # Todas cuentan como lentas
+            list(Cliente.objects.filter(nombre='Cliente 1'))
+        [consulta] = profile.slow_queries()
+        self.assertIn('SCAN', consulta.explain.upper()) # Plan de SQLite
+
+    @override_settings(QUERY_PROFILER_SAMPLE_RATE=1.0, QUERY_PROFILER_SLOW_MS=0)
+    def test_middleware_registra_consultas_lentas(self):
+        with self.assertLogs('Dicaprios.query_profiler', 'WARNING') as logs:
+            self.client.get('/api/clientes/')
+        entrada = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entrada['tipo'], 'lenta')
+        self.assertEqual(entrada['ruta'], '/api/clientes/')
+        self.assertIn('clientes_cliente', entrada['sql'])
+        self.assertTrue(entrada['explain'])
@@ -7,7 +7,8 @@ from rest_framework_simplejwt.views import (
 )
 from clientes.views import ClienteViewSet
 from productos.views import ProductoViewSet, ProveedorViewSet, CategoriaViewSet
-from ventas.views import PedidoViewSet, DetallePedidoViewSet, FacturaViewSet, DetalleFacturaViewSet
+from ventas.views import PedidoViewSet, DetallePedidoViewSet, FacturaViewSet, DetalleFacturaViewSet, AnaliticaVentasViewSet
+from Dicaprios.metrics import metrics_view
 from django.conf import settings # <--- IMPORTAR
 from django.conf.urls.static import static # <--- IMPORTAR
 
@@ -20,6 +21,7 @@ router.register(r'pedidos', PedidoViewSet)
 router.register(r'detalles-pedido', DetallePedidoViewSet)
 router.register(r'facturas', FacturaViewSet)
 router.register(r'detalles-factura', DetalleFacturaViewSet)
+router.register(r'analitica-ventas', AnaliticaVentasViewSet, basename='analitica-ventas')
 
 
 urlpatterns = [
@@ -28,6 +30,7 @@ urlpatterns = [
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('api/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('api/visual-search/', include('visual_searcher.urls')),
+    path('metrics', metrics_view, name='metrics'), # Prometheus
 ]
 
 if settings.DEBUG:
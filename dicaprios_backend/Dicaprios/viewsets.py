@@ -0,0 +1,19 @@
+# dicaprios_backend/Dicaprios/viewsets.py
+"""
+Utilidades comunes para los viewsets de la API.
+"""
+
+
+class EagerLoadingViewSetMixin:
+    """
+    Aplica al queryset el plan de carga anticipada del serializador en uso
+    (ver Dicaprios.serializers.EagerLoadingMixin), de modo que listar N filas
+    cueste un número constante de consultas.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        serializer_class = self.get_serializer_class()
+        if hasattr(serializer_class, 'setup_eager_loading'):
+            queryset = serializer_class.setup_eager_loading(queryset, self.request)
+        return queryset
@@ -1,7 +1,8 @@
 from rest_framework import serializers
 from .models import Cliente
+from Dicaprios.serializers import TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin
 
-class ClienteSerializer(serializers.ModelSerializer):
+class ClienteSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Cliente
         fields = ['id', 'nombre', 'email', 'telefono', 'direccion']
\ No newline at end of file
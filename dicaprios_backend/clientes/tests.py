@@ -1,3 +1,30 @@
 from django.test import TestCase
 
-# Create your tests here.
+from Dicaprios.testing import APITestMixin
+from .models import Cliente
+
+
+class ClienteListQueriesTests(APITestMixin, TestCase):
+
+    def create_clientes(self, n):
+        Cliente.objects.bulk_create([
+            Cliente(nombre=f'Cliente {i}', email='c@example.com', telefono=1, direccion='Zona 1') for i in range(n)
+        ])
+
+    def test_listado_clientes_consultas_constantes(self):
+        self.assertConstantListQueries('/api/clientes/', self.create_clientes)
+
+    def test_busqueda_por_ids(self):
+        self.create_clientes(5)
+        ids = list(Cliente.objects.order_by('id').values_list('id', flat=True))
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/clientes/?ids={ids[0]},{ids[3]}')
+        self.assertEqual(sorted(c['id'] for c in response.data), [ids[0], ids[3]])
+
+    def test_busqueda_por_ids_invalidos(self):
+        self.create_clientes(2)
+        response = self.client.get('/api/clientes/?ids=1,abc')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ids', response.data)
+        ids = ','.join(str(i) for i in range(1, 502))
+        self.assertEqual(self.client.get(f'/api/clientes/?ids={ids}').status_code, 400)
@@ -1,7 +1,26 @@
 from rest_framework import viewsets
+from rest_framework.exceptions import ValidationError
 from .models import Cliente
 from .serializers import ClienteSerializer
+from Dicaprios.viewsets import EagerLoadingViewSetMixin
 
-class ClienteViewSet(viewsets.ModelViewSet):
+MAX_IDS_POR_CONSULTA = 500 # Límite de IDs en ?ids= (parámetros de la consulta SQL)
+
+
+class ClienteViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Cliente.objects.all()
     serializer_class = ClienteSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        # Búsqueda de varios clientes en una sola petición: ?ids=1,2,3
+        ids = self.request.query_params.get('ids')
+        if ids:
+            try:
+                ids_int = {int(value) for value in ids.split(',') if value.strip()}
+            except ValueError:
+                raise ValidationError({"ids": "Debe ser una lista de IDs numéricos separados por comas."})
+            if len(ids_int) > MAX_IDS_POR_CONSULTA:
+                raise ValidationError({"ids": f"Se admiten como máximo {MAX_IDS_POR_CONSULTA} IDs por consulta."})
+            queryset = queryset.filter(id__in=ids_int)
+        return queryset
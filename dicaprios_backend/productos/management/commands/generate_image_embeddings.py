@@ -1,128 +1,343 @@
+import hashlib
+import io
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from tqdm import tqdm # Para una barra de progreso amigable
 
-from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 from productos.models import Producto
+from visual_searcher import store
+from visual_searcher.vector_index import normalize_embeddings, IVFIndex, INDEX_IVF, INDEX_TYPES, STORAGE_DTYPES
+from visual_searcher.preprocessing import load_image_array, preprocess_resnet50, IMG_WIDTH, IMG_HEIGHT
+from visual_searcher.backends import build_embedder, INFERENCE_BACKENDS, BACKEND_KERAS
+
+
+EMBEDDING_DIM = 2048 # Dimensión de la salida de ResNet50 con pooling='avg'
+
+# Si más de esta fracción de filas está marcada como eliminada, se compacta el índice
+COMPACT_TOMBSTONE_RATIO = 0.25
 
 
-# Intentar importar TensorFlow y sus componentes. Manejar error si no está instalado.
-try:
-    import tensorflow as tf
-    from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
-    from tensorflow.keras.preprocessing import image as keras_image
-    from tensorflow.keras.models import Model
-except ImportError:
-    raise CommandError(
-        "TensorFlow no está instalado o no se pudo importar. "
-        "Asegúrate de haberlo instalado en tu entorno virtual. "
-        "Ejecuta: pip install tensorflow numpy scikit-learn"
-    )
-
-# Definir el tamaño de entrada esperado por el modelo ResNet50
-IMG_WIDTH, IMG_HEIGHT = 224, 224
-
-# Directorio donde se guardarán los embeddings y los IDs
-# Se crea dentro de la carpeta 'media' para mantenerlo junto con otros archivos subidos,
-# pero podría ser cualquier otra ubicación que decidas.
-EMBEDDINGS_DIR = os.path.join(settings.MEDIA_ROOT, 'ia_embeddings')
-EMBEDDINGS_FILE = os.path.join(EMBEDDINGS_DIR, 'product_embeddings.npy')
-PRODUCT_IDS_FILE = os.path.join(EMBEDDINGS_DIR, 'product_ids.npy')
+def _file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
 
 class Command(BaseCommand):
     help = 'Genera y guarda los embeddings de las imágenes de los productos utilizando ResNet50.'
 
-    def _get_embedding(self, image_path, model):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--index', choices=INDEX_TYPES, default=INDEX_IVF,
+            help="Tipo de índice a construir junto a los embeddings ('flat' no genera archivo adicional)."
+        )
+        parser.add_argument(
+            '--nlist', type=int, default=None,
+            help='Número de listas del índice IVF (por defecto ≈ sqrt(N)).'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=64,
+            help='Imágenes por llamada al modelo.'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Hilos dedicados a decodificar y redimensionar imágenes.'
+        )
+        parser.add_argument(
+            '--dtype', choices=STORAGE_DTYPES, default=None,
+            help='Tipo de la copia de embeddings que recorren las búsquedas (float32 siempre se conserva). '
+                 'Por defecto, con --incremental el de la versión base y si no VISUAL_SEARCH_STORAGE_DTYPE.'
+        )
+        parser.add_argument(
+            '--backend', choices=INFERENCE_BACKENDS,
+            default=getattr(settings, 'VISUAL_SEARCH_INFERENCE_BACKEND', BACKEND_KERAS),
+            help="Motor de inferencia (los modelos 'onnx'/'tflite' se generan con 'export_visual_model')."
+        )
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Procesa solo los productos con imagen nueva, modificada o eliminada desde la última versión.'
+        )
+
+    def _load_model(self, backend):
+        # ResNet50 sin la capa de clasificación final y con Average Pooling global (vector de 2048)
+        try:
+            model = build_embedder(
+                backend,
+                quantized=getattr(settings, 'VISUAL_SEARCH_INFERENCE_QUANTIZED', False),
+                num_threads=getattr(settings, 'VISUAL_SEARCH_INFERENCE_THREADS', None),
+            )
+        except ImportError as e:
+            raise CommandError(
+                f"No se pudo importar el motor de inferencia ({e}). "
+                "Asegúrate de haberlo instalado en tu entorno virtual. "
+                "Ejecuta: pip install tensorflow numpy"
+            )
+        except Exception as e:
+            raise CommandError(f"Error al cargar el modelo ResNet50: {e}. Asegúrate de tener conexión a internet la primera vez para descargar los pesos.")
+        self.stdout.write(self.style.SUCCESS(f"Modelo ResNet50 cargado exitosamente (motor '{model.name}')."))
+        return model
+
+    def _load_image(self, image_path):
         """
-        Genera un embedding para una única imagen.
+        Lee, calcula el hash y decodifica una imagen (se ejecuta en los hilos del pool).
+        Devuelve (array, sha256) o (None, None) si la imagen no se puede leer.
         """
         try:
-            img = keras_image.load_img(image_path, target_size=(IMG_WIDTH, IMG_HEIGHT))
-            img_array = keras_image.img_to_array(img)
-            img_array_expanded = np.expand_dims(img_array, axis=0)
-            img_preprocessed = preprocess_input(img_array_expanded) # Preprocesamiento específico de ResNet50
-            
-            embedding = model.predict(img_preprocessed, verbose=0) # verbose=0 para no mostrar barra de progreso de Keras por cada imagen
-            return embedding.flatten() # Aplanar para obtener un vector 1D
+            with open(image_path, 'rb') as f:
+                data = f.read()
+            return load_image_array(io.BytesIO(data)), hashlib.sha256(data).hexdigest()
         except Exception as e:
             self.stderr.write(f"Error procesando la imagen {image_path}: {e}")
-            return None
+            return None, None
 
-    def handle(self, *args, **options):
-        self.stdout.write(self.style.SUCCESS("Iniciando la generación de embeddings de imágenes..."))
+    def _decoded_images(self, items, workers, prefetch):
+        """
+        Decodifica las imágenes en un pool de hilos y las entrega en orden.
+        Como máximo `prefetch` imágenes esperan en memoria a ser consumidas (cola acotada).
+        """
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = deque()
+            for product_id, image_path in items:
+                pending.append((product_id, executor.submit(self._load_image, image_path)))
+                if len(pending) >= prefetch:
+                    product_id_listo, future = pending.popleft()
+                    yield (product_id_listo, *future.result())
+            while pending:
+                product_id_listo, future = pending.popleft()
+                yield (product_id_listo, *future.result())
 
-        # 1. Cargar el modelo ResNet50 pre-entrenado
-        # Usamos include_top=False para quitar la capa de clasificación final.
-        # pooling='avg' aplica Average Pooling global a la salida de la última capa convolucional.
-        try:
-            base_model = ResNet50(weights='imagenet', include_top=False, pooling='avg', input_shape=(IMG_WIDTH, IMG_HEIGHT, 3))
-            # En algunos casos, si solo quieres las características de una capa específica, puedes hacer:
-            # model = Model(inputs=base_model.input, outputs=base_model.output)
-            # Para este caso, base_model.output ya es el vector de características deseado debido a pooling='avg'
-            model = base_model 
-            self.stdout.write(self.style.SUCCESS("Modelo ResNet50 cargado exitosamente."))
-        except Exception as e:
-            raise CommandError(f"Error al cargar el modelo ResNet50: {e}. Asegúrate de tener conexión a internet la primera vez para descargar los pesos.")
+    def _embed_items(self, model, items, batch_size, workers):
+        """
+        Genera embeddings por lotes: los hilos decodifican mientras el modelo procesa el lote anterior.
+        Los resultados se escriben directamente en un array float32 preasignado.
+        Devuelve (embeddings normalizados, ids, {id: sha256}, número de fallos).
+        """
+        embeddings_np = np.empty((len(items), EMBEDDING_DIM), dtype=np.float32)
+        product_ids_np = np.empty(len(items), dtype=np.int64)
+        batch = np.empty((batch_size, IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+        batch_ids = []
+        hashes = {}
+        processed_count = 0
+        failed_count = 0
+
+        def flush_batch():
+            nonlocal processed_count
+            n = len(batch_ids)
+            if n == 0:
+                return
+            # preprocess_resnet50 modifica el lote en sitio; se vuelve a llenar en cada iteración
+            embeddings = model.predict_batch(preprocess_resnet50(batch[:n]))
+            embeddings_np[processed_count:processed_count + n] = np.asarray(embeddings).reshape(n, -1)
+            product_ids_np[processed_count:processed_count + n] = batch_ids
+            processed_count += n
+            batch_ids.clear()
+
+        decoded = self._decoded_images(items, workers, prefetch=2 * batch_size)
+        for product_id, img_array, digest in tqdm(decoded, total=len(items), desc="Procesando imágenes"):
+            if img_array is None:
+                failed_count += 1
+                continue
+            batch[len(batch_ids)] = img_array
+            batch_ids.append(product_id)
+            hashes[product_id] = digest
+            if len(batch_ids) == batch_size:
+                flush_batch()
+        flush_batch()
+
+        # Normalizar (coseno = producto punto) y descartar las filas de imágenes fallidas
+        return (
+            normalize_embeddings(embeddings_np[:processed_count]),
+            product_ids_np[:processed_count],
+            hashes,
+            failed_count,
+        )
 
-        # 2. Obtener todos los productos con imágenes
+    def _collect_images(self):
+        """
+        Devuelve {producto_id: (nombre del archivo, ruta, os.stat)} de los productos con imagen
+        disponible en disco, y el número de productos cuya imagen no se encontró.
+        """
         # El modelo Producto tiene el campo 'imagen' y el nombre del producto es 'nombre_producto'
-        # según tu `models.py` que me compartiste: `imagen = models.ImageField(upload_to='productos_imagenes/', blank=True, null=True)`
         productos_con_imagen = Producto.objects.filter(imagen__isnull=False).exclude(imagen__exact='')
-        
-        if not productos_con_imagen.exists():
-            self.stdout.write(self.style.WARNING("No se encontraron productos con imágenes para procesar."))
-            return
-
         self.stdout.write(f"Se encontraron {productos_con_imagen.count()} productos con imágenes.")
 
-        all_embeddings = []
-        product_ids = []
-        processed_count = 0
+        images = {}
         failed_count = 0
-
-        # 3. Iterar sobre los productos y generar embeddings
-        # Usar tqdm para una barra de progreso
-        for producto in tqdm(productos_con_imagen, desc="Procesando imágenes"):
+        for producto in productos_con_imagen.only('id', 'nombre_producto', 'imagen').iterator(chunk_size=2000):
             if not producto.imagen or not producto.imagen.path:
                 self.stderr.write(f"Producto ID {producto.id} ('{producto.nombre_producto}') no tiene una ruta de imagen válida. Saltando.")
                 failed_count += 1
                 continue
 
             image_full_path = producto.imagen.path
-            
+
             if not os.path.exists(image_full_path):
                 self.stderr.write(f"Imagen no encontrada en la ruta: {image_full_path} para el producto ID {producto.id}. Saltando.")
                 failed_count += 1
                 continue
-            
-            embedding = self._get_embedding(image_full_path, model)
-            
-            if embedding is not None:
-                all_embeddings.append(embedding)
-                product_ids.append(producto.id)
-                processed_count += 1
-            else:
-                failed_count += 1
-        
-        if not all_embeddings:
-            self.stdout.write(self.style.ERROR("No se pudo generar ningún embedding. Revisa los errores."))
-            return
 
-        # 4. Convertir a arrays NumPy
-        all_embeddings_np = np.array(all_embeddings)
-        product_ids_np = np.array(product_ids)
+            images[producto.id] = (producto.imagen.name, image_full_path, os.stat(image_full_path))
+        return images, failed_count
 
-        # 5. Guardar los embeddings y los IDs
-        # Asegurarse de que el directorio de embeddings exista
-        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
-        
+    def _manifest_entry(self, name, stat, digest):
+        return {"imagen": name, "mtime": stat.st_mtime, "size": stat.st_size, "sha256": digest}
+
+    def _build_ivf(self, embeddings, nlist):
         try:
-            np.save(EMBEDDINGS_FILE, all_embeddings_np)
-            np.save(PRODUCT_IDS_FILE, product_ids_np)
-            self.stdout.write(self.style.SUCCESS(f"Embeddings guardados en: {EMBEDDINGS_FILE}"))
-            self.stdout.write(self.style.SUCCESS(f"IDs de productos guardados en: {PRODUCT_IDS_FILE}"))
+            ivf_index = IVFIndex.build(embeddings, nlist=nlist)
+            self.stdout.write(self.style.SUCCESS(f"Índice IVF construido ({ivf_index.nlist} listas)."))
+            return ivf_index
+        except Exception as e:
+            raise CommandError(f"Error al construir el índice IVF: {e}")
+
+    def _save(self, embeddings, product_ids, tombstones, manifest, ivf_index, storage_dtype):
+        try:
+            version = store.write_version(embeddings, product_ids, tombstones, manifest, ivf_index, storage_dtype)
         except Exception as e:
             raise CommandError(f"Error al guardar los archivos de embeddings/IDs: {e}")
+        self.stdout.write(self.style.SUCCESS(f"Versión {version} del índice guardada en: {store.EMBEDDINGS_DIR}"))
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS("Iniciando la generación de embeddings de imágenes..."))
+        batch_size = max(1, options['batch_size'])
+        workers = max(1, options['workers'])
+
+        images, failed_count = self._collect_images()
+
+        # Otra ejecución simultánea espera aquí: si no, ambas partirían de la misma versión base
+        with store.writer_lock():
+            base = store.read_version() if options['incremental'] else None
+            if options['incremental'] and (base is None or base.version == 0):
+                # El formato antiguo no guarda las firmas de las imágenes: hace falta una regeneración completa
+                self.stdout.write(self.style.WARNING("No existe una versión previa con manifiesto. Se regenerará el índice completo."))
+                base = None
+
+            if options['dtype'] is None:
+                # Sin --dtype explícito, una ejecución incremental no cambia el almacenamiento del índice
+                options['dtype'] = (
+                    base.storage_dtype if base is not None
+                    else getattr(settings, 'VISUAL_SEARCH_STORAGE_DTYPE', 'float32')
+                )
+
+            if base is None:
+                self._handle_full(images, failed_count, batch_size, workers, options)
+            else:
+                self._handle_incremental(base, images, failed_count, batch_size, workers, options)
+
+    def _handle_full(self, images, failed_count, batch_size, workers, options):
+        if not images:
+            self.stdout.write(self.style.WARNING("No se encontraron productos con imágenes para procesar."))
+            return
+
+        model = self._load_model(options['backend'])
+        items = [(product_id, path) for product_id, (_, path, _) in images.items()]
+        embeddings, product_ids, hashes, failed = self._embed_items(model, items, batch_size, workers)
+        failed_count += failed
+
+        if product_ids.size == 0:
+            self.stdout.write(self.style.ERROR("No se pudo generar ningún embedding. Revisa los errores."))
+            return
+
+        manifest = {
+            str(product_id): self._manifest_entry(images[product_id][0], images[product_id][2], hashes[product_id])
+            for product_id in product_ids.tolist()
+        }
+        tombstones = np.zeros(product_ids.shape[0], dtype=bool)
+        ivf_index = self._build_ivf(embeddings, options['nlist']) if options['index'] == INDEX_IVF else None
+        self._save(embeddings, product_ids, tombstones, manifest, ivf_index, options['dtype'])
+
+        self.stdout.write(self.style.SUCCESS(f"Proceso completado. {product_ids.size} imágenes procesadas exitosamente, {failed_count} fallaron."))
+
+    def _handle_incremental(self, base, images, failed_count, batch_size, workers, options):
+        # Fila vigente (no eliminada) de cada producto en la versión base
+        live_rows = {
+            int(product_id): row
+            for row, product_id in enumerate(base.product_ids.tolist())
+            if not base.tombstones[row]
+        }
+        manifest = dict(base.manifest)
+        tombstones = base.tombstones.copy()
+
+        # 1. Clasificar: sin cambios, posible cambio (misma ruta y tamaño, otra fecha) o nuevo/modificado
+        to_embed = []
+        maybe_changed = []
+        for product_id, (name, path, stat) in images.items():
+            entry = manifest.get(str(product_id))
+            if entry is None or product_id not in live_rows or entry['imagen'] != name or entry['size'] != stat.st_size:
+                to_embed.append(product_id)
+            elif entry['mtime'] != stat.st_mtime:
+                maybe_changed.append(product_id)
+
+        # Si solo cambió la fecha, comparar el contenido antes de recalcular el embedding
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            digests = executor.map(_file_sha256, [images[product_id][1] for product_id in maybe_changed])
+            for product_id, digest in zip(maybe_changed, digests):
+                name, _, stat = images[product_id]
+                if digest == manifest[str(product_id)]['sha256']:
+                    manifest[str(product_id)] = self._manifest_entry(name, stat, digest)
+                else:
+                    to_embed.append(product_id)
+
+        # 2. Productos eliminados o sin imagen: marcar su fila como eliminada
+        deleted = [product_id for product_id in live_rows if product_id not in images]
+        for product_id in deleted:
+            tombstones[live_rows[product_id]] = True
+            manifest.pop(str(product_id), None)
+
+        # La fila de una imagen modificada queda obsoleta aunque la nueva no se pueda procesar:
+        # si no, la búsqueda seguiría devolviendo el producto por su imagen anterior
+        for product_id in to_embed:
+            if product_id in live_rows:
+                tombstones[live_rows[product_id]] = True
+            manifest.pop(str(product_id), None) # Sin entrada: la siguiente ejecución lo reintenta
+
+        self.stdout.write(f"Incremental: {len(to_embed)} imágenes nuevas o modificadas, {len(deleted)} eliminadas.")
+        if not to_embed and not deleted and manifest == base.manifest:
+            self.stdout.write(self.style.SUCCESS(f"El índice (versión {base.version}) ya está actualizado."))
+            return
+
+        # 3. Generar embeddings solo para lo nuevo/modificado y añadirlos al final
+        new_embeddings = np.empty((0, base.embeddings.shape[1]), dtype=np.float32)
+        new_ids = np.empty(0, dtype=np.int64)
+        if to_embed:
+            model = self._load_model(options['backend'])
+            items = [(product_id, images[product_id][1]) for product_id in to_embed]
+            new_embeddings, new_ids, hashes, failed = self._embed_items(model, items, batch_size, workers)
+            failed_count += failed
+            for product_id in new_ids.tolist():
+                name, _, stat = images[product_id]
+                manifest[str(product_id)] = self._manifest_entry(name, stat, hashes[product_id])
+            if new_ids.size == 0 and manifest == base.manifest and np.array_equal(tombstones, base.tombstones):
+                # Solo imágenes que siguen sin poder procesarse: nada que escribir
+                self.stdout.write(self.style.WARNING(f"No se pudo procesar ninguna imagen; el índice sigue en la versión {base.version}."))
+                return
+
+        embeddings = np.concatenate((base.embeddings, new_embeddings))
+        product_ids = np.concatenate((base.product_ids, new_ids))
+        tombstones = np.concatenate((tombstones, np.zeros(new_ids.shape[0], dtype=bool)))
+
+        # 4. Actualizar el índice IVF: las filas nuevas se asignan a los centroides existentes
+        ivf_index = None
+        if options['index'] == INDEX_IVF:
+            if os.path.exists(base.ivf_path):
+                try:
+                    ivf_index = IVFIndex.load(base.ivf_path, base.embeddings).extend(embeddings)
+                except ValueError as e:
+                    # Archivo IVF que no corresponde a la versión base: se reentrena, como hace load_index
+                    self.stderr.write(self.style.WARNING(f"{e} Se reconstruirá el índice IVF."))
+            if ivf_index is None:
+                ivf_index = self._build_ivf(embeddings, options['nlist'])
+
+        # 5. Compactar si hay demasiadas filas eliminadas
+        if tombstones.size and tombstones.mean() > COMPACT_TOMBSTONE_RATIO:
+            live = np.flatnonzero(~tombstones)
+            embeddings, product_ids, tombstones = embeddings[live], product_ids[live], tombstones[live]
+            if ivf_index is not None:
+                ivf_index = ivf_index.subset(live)
+            self.stdout.write(f"Índice compactado a {live.size} filas.")
 
-        self.stdout.write(self.style.SUCCESS(f"Proceso completado. {processed_count} imágenes procesadas exitosamente, {failed_count} fallaron."))
\ No newline at end of file
+        self._save(embeddings, product_ids, tombstones, manifest, ivf_index, options['dtype'])
+        self.stdout.write(self.style.SUCCESS(f"Proceso completado. {new_ids.size} imágenes procesadas exitosamente, {failed_count} fallaron."))
@@ -3,6 +3,12 @@ from django.db import models
 class Categoria(models.Model):
     nombre_categoria = models.CharField(max_length=45)
 
+    class Meta:
+        indexes = [
+            # Orden de la paginación por cursor (cursor_ordering de CategoriaViewSet)
+            models.Index(fields=['nombre_categoria', 'id'], name='categoria_nombre_id_idx'),
+        ]
+
     def __str__(self):
         return self.nombre_categoria
     
@@ -34,5 +40,14 @@ class Producto(models.Model):
     # --- FIN NUEVO CAMPO ---
     imagen = models.ImageField(upload_to='productos_imagenes/', blank=True, null=True)
 
+    class Meta:
+        indexes = [
+            # Listados filtrados por categoría o proveedor y ordenados por nombre
+            models.Index(fields=['categoria', 'nombre_producto'], name='producto_categoria_nombre_idx'),
+            models.Index(fields=['proveedor', 'nombre_producto'], name='producto_proveedor_nombre_idx'),
+            # Orden de la paginación por cursor sin filtros (cursor_ordering de ProductoViewSet)
+            models.Index(fields=['nombre_producto', 'id'], name='producto_nombre_id_idx'),
+        ]
+
     def __str__(self):
         return self.nombre_producto
\ No newline at end of file
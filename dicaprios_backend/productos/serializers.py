@@ -2,18 +2,21 @@
 
 from rest_framework import serializers
 from .models import Producto, Categoria, Proveedor
+from Dicaprios.serializers import TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin
 
-class CategoriaSerializer(serializers.ModelSerializer):
+class CategoriaSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Categoria
         fields = ('id', 'nombre_categoria')
 
-class ProveedorSerializer(serializers.ModelSerializer):
+class ProveedorSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = Proveedor
         fields = ('id', 'nombre_proveedor', 'contacto', 'telefono', 'direccion')
 
-class ProductoSerializer(serializers.ModelSerializer):
+class ProductoSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = {'categoria': ('categoria_nombre',), 'proveedor': ('proveedor_nombre',)}
+
     categoria_nombre = serializers.CharField(source='categoria.nombre_categoria', read_only=True, allow_null=True)
     categoria = serializers.PrimaryKeyRelatedField(
         queryset=Categoria.objects.all(),
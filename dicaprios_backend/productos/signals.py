@@ -0,0 +1,18 @@
+# dicaprios_backend/productos/signals.py
+"""
+Invalidación de la caché de listados del catálogo (Dicaprios/cache.py) al guardar
+o borrar categorías, proveedores y productos. Las escrituras masivas que no emiten
+señales (update, bulk_update) llaman a bump_versions directamente.
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from Dicaprios.cache import bump_versions
+from .models import Categoria, Proveedor, Producto
+
+
+@receiver([post_save, post_delete], sender=Categoria)
+@receiver([post_save, post_delete], sender=Proveedor)
+@receiver([post_save, post_delete], sender=Producto)
+def invalidar_catalogo(sender, **kwargs):
+    bump_versions(sender)
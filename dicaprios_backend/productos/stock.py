@@ -0,0 +1,54 @@
+# dicaprios_backend/productos/stock.py
+"""
+Reserva atómica de stock.
+
+El descuento se hace con un UPDATE condicional en la base de datos
+(`SET stock = stock - n WHERE stock >= n`) en lugar de leer, comparar y guardar
+desde Python: dos peticiones simultáneas no pueden vender la misma unidad, ya que
+la comprobación y la escritura son una sola sentencia sobre la fila.
+
+Debe llamarse dentro de transaction.atomic junto con la inserción que depende de
+la reserva, para que ambas se confirmen o se reviertan a la vez.
+"""
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Value, When
+
+from Dicaprios.cache import bump_versions
+from .models import Producto
+
+
+def reservar_stock(producto_id, cantidad):
+    """Descuenta `cantidad` unidades si hay stock suficiente. Devuelve True si se reservó."""
+    reservado = Producto.objects.filter(id=producto_id, stock__gte=cantidad).update(stock=F('stock') - cantidad) == 1
+    if reservado:
+        bump_versions(Producto) # update() no emite señales: invalida los listados de productos
+    return reservado
+
+
+def reservar_stock_lote(cantidades):
+    """
+    Reserva varias líneas en un único UPDATE. `cantidades` es {producto_id: cantidad}.
+    Es todo o nada: si algún producto no tiene stock suficiente no se descuenta ninguno.
+    Devuelve la lista de IDs de producto sin stock suficiente (vacía si se reservó todo).
+    """
+    if not cantidades:
+        return []
+    ids = sorted(cantidades) # Orden estable de bloqueo de filas
+    cantidad_por_id = Case(
+        *[When(id=producto_id, then=Value(cantidades[producto_id])) for producto_id in ids],
+        output_field=IntegerField(),
+    )
+    # Bloque atómico propio (un savepoint si ya hay transacción): en autocommit un savepoint
+    # suelto no hace nada y el descuento parcial quedaría confirmado
+    with transaction.atomic():
+        actualizados = Producto.objects.filter(id__in=ids, stock__gte=cantidad_por_id).update(
+            stock=F('stock') - cantidad_por_id
+        )
+        if actualizados != len(ids):
+            transaction.set_rollback(True) # Deshace el descuento de las filas que sí tenían stock
+    if actualizados == len(ids):
+        bump_versions(Producto)
+        return []
+
+    stocks = dict(Producto.objects.filter(id__in=ids).values_list('id', 'stock'))
+    return [producto_id for producto_id in ids if stocks.get(producto_id, 0) < cantidades[producto_id]]
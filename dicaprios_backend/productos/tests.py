@@ -1,3 +1,173 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 
-# Create your tests here.
+from Dicaprios.testing import APITestMixin
+from .models import Producto, Categoria, Proveedor
+from .stock import reservar_stock_lote
+
+
+class ProductoListQueriesTests(APITestMixin, TestCase):
+    """El listado de productos no debe hacer una consulta por fila (categoría y proveedor)."""
+
+    def create_productos(self, n):
+        for i in range(n):
+            categoria = Categoria.objects.create(nombre_categoria=f'Categoria {Categoria.objects.count()}')
+            proveedor = Proveedor.objects.create(nombre_proveedor=f'Proveedor {Proveedor.objects.count()}')
+            Producto.objects.create(
+                nombre_producto=f'Producto {i}', precio=10, color='Negro', stock=5,
+                categoria=categoria, proveedor=proveedor,
+            )
+
+    def test_listado_productos_consultas_constantes(self):
+        queries = self.assertConstantListQueries('/api/productos/', self.create_productos)
+        self.assertEqual(queries, 1)
+
+    def test_listado_productos_paginado_consultas_constantes(self):
+        self.assertConstantListQueries('/api/productos/?page_size=10', self.create_productos)
+
+    def test_listado_incluye_nombres_relacionados(self):
+        self.create_productos(1)
+        producto = self.client.get('/api/productos/').json()[0]
+        self.assertTrue(producto['categoria_nombre'].startswith('Categoria'))
+        self.assertTrue(producto['proveedor_nombre'].startswith('Proveedor'))
+
+
+class CatalogoCacheTests(APITestMixin, TestCase):
+    """Los listados del catálogo se sirven desde caché hasta que cambian los datos."""
+    url = '/api/productos/'
+
+    def setUp(self):
+        super().setUp()
+        self.categoria = Categoria.objects.create(nombre_categoria='Camisas')
+        self.producto = Producto.objects.create(
+            nombre_producto='Camisa', precio=10, color='Blanco', stock=5, categoria=self.categoria,
+        )
+
+    def test_segunda_lectura_sin_consultas(self):
+        self.assertEqual(self.count_list_queries(self.url), 1)
+        self.assertEqual(self.count_list_queries(self.url), 0)
+
+    def test_parametros_distintos_no_comparten_entrada(self):
+        self.client.get(self.url)
+        response = self.client.get(self.url + '?fields=id')
+        self.assertEqual(response.json(), [{'id': self.producto.id}])
+
+    def test_etag_devuelve_304_sin_consultas(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_guardar_invalida_listado_y_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.producto.precio = 12
+        self.producto.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['precio'], '12.00')
+
+    def test_cambio_en_categoria_invalida_listado_de_productos(self):
+        self.client.get(self.url)
+        self.categoria.nombre_categoria = 'Camisetas'
+        self.categoria.save()
+        self.assertEqual(self.client.get(self.url).json()[0]['categoria_nombre'], 'Camisetas')
+
+    def test_borrar_invalida_listado(self):
+        self.client.get(self.url)
+        self.producto.delete()
+        self.assertEqual(self.client.get(self.url).json(), [])
+
+    def test_actualizar_stock_lote_invalida_listado(self):
+        self.client.get(self.url)
+        self.client.post(
+            '/api/productos/actualizar-stock-lote/',
+            [{'producto_id': self.producto.id, 'cantidad_a_anadir': 3}], format='json',
+        )
+        self.assertEqual(self.client.get(self.url).json()[0]['stock'], 8)
+
+
+class ExportarProductosTests(APITestMixin, TestCase):
+    def test_exportar_csv_con_filtro(self):
+        categoria = Categoria.objects.create(nombre_categoria='Camisas')
+        Producto.objects.create(nombre_producto='Camisa', precio=10, color='Blanco', stock=5, categoria=categoria)
+        Producto.objects.create(nombre_producto='Gorra', precio=5, color='Negro', stock=2)
+        response = self.client.get(f'/api/productos/exportar/?categoria_id={categoria.id}')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="productos.csv"')
+        lineas = b''.join(response.streaming_content).decode('utf-8-sig').splitlines()
+        self.assertEqual(lineas[0], 'id,nombre_producto,precio,talla,color,stock,categoria_id,categoria_nombre,proveedor_id,proveedor_nombre')
+        self.assertEqual(lineas[1].split(',')[1:], ['Camisa', '10.00', '', 'Blanco', '5', str(categoria.id), 'Camisas', '', ''])
+        self.assertEqual(len(lineas), 2)
+
+
+class ActualizarStockLoteTests(APITestMixin, TestCase):
+    url = '/api/productos/actualizar-stock-lote/'
+
+    def setUp(self):
+        super().setUp()
+        Producto.objects.bulk_create([
+            Producto(nombre_producto=f'Producto {i}', precio=10, color='Negro', stock=i) for i in range(50)
+        ])
+        self.ids = list(Producto.objects.order_by('id').values_list('id', flat=True))
+
+    def test_actualiza_en_consultas_constantes(self):
+        payload = [{"producto_id": producto_id, "cantidad_a_anadir": 3} for producto_id in self.ids]
+        payload.append({"producto_id": self.ids[0], "cantidad_a_anadir": "2"}) # Producto repetido
+        with self.assertNumQueries(4): # SAVEPOINT, SELECT FOR UPDATE, UPDATE, RELEASE
+            response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        detalle = response.data['productos_actualizados_detalle']
+        self.assertEqual(len(detalle), 51)
+        self.assertEqual((detalle[0]['stock_anterior'], detalle[0]['nuevo_stock']), (0, 3))
+        self.assertEqual((detalle[-1]['stock_anterior'], detalle[-1]['nuevo_stock']), (3, 5))
+        self.assertEqual(Producto.objects.get(id=self.ids[0]).stock, 5)
+        self.assertEqual(Producto.objects.get(id=self.ids[49]).stock, 52)
+
+    def test_errores_no_modifican_nada(self):
+        payload = [
+            {"producto_id": self.ids[1], "cantidad_a_anadir": 5},
+            {"producto_id": 999999, "cantidad_a_anadir": 1},
+            {"producto_id": self.ids[2], "cantidad_a_anadir": -1},
+        ]
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.data['errores_detalle']), 2)
+        self.assertEqual(Producto.objects.get(id=self.ids[1]).stock, 1)
+
+
+class ReservarStockLoteTests(TransactionTestCase):
+    """Sin transacción externa (autocommit): la reserva parcial también se deshace."""
+
+    def setUp(self):
+        self.con_stock = Producto.objects.create(nombre_producto='Con stock', precio=10, color='Negro', stock=5)
+        self.sin_stock = Producto.objects.create(nombre_producto='Sin stock', precio=10, color='Negro', stock=0)
+
+    def test_todo_o_nada(self):
+        self.assertEqual(reservar_stock_lote({self.con_stock.id: 2, self.sin_stock.id: 1}), [self.sin_stock.id])
+        self.con_stock.refresh_from_db()
+        self.assertEqual(self.con_stock.stock, 5)
+
+        self.assertEqual(reservar_stock_lote({self.con_stock.id: 2}), [])
+        self.con_stock.refresh_from_db()
+        self.assertEqual(self.con_stock.stock, 3)
+
+
+class IndicesTests(TestCase):
+    def test_paginacion_por_cursor_usa_indice(self):
+        # Consulta de una página intermedia: WHERE campo > posición ORDER BY campo, id
+        casos = (
+            (Producto.objects.filter(nombre_producto__gt='M').order_by('nombre_producto', 'id'), 'producto_nombre_id_idx'),
+            (Categoria.objects.filter(nombre_categoria__gt='M').order_by('nombre_categoria', 'id'), 'categoria_nombre_id_idx'),
+        )
+        for queryset, index in casos:
+            plan = queryset[:50].explain()
+            self.assertIn(index, plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_filtro_por_categoria_ordenado_por_nombre_usa_indice(self):
+        plan = Producto.objects.filter(categoria_id=1).order_by('nombre_producto').explain()
+        self.assertIn('producto_categoria_nombre_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan) # El orden lo da el índice
+
+    def test_filtro_por_proveedor_ordenado_por_nombre_usa_indice(self):
+        plan = Producto.objects.filter(proveedor_id=1).order_by('nombre_producto').explain()
+        self.assertIn('producto_proveedor_nombre_idx', plan)
@@ -6,15 +6,24 @@ from rest_framework.response import Response # <--- CORRECCIÓN: Importar Respon
 from .models import Producto, Categoria, Proveedor
 from .serializers import ProductoSerializer, CategoriaSerializer, ProveedorSerializer
 from django.db import transaction
+from Dicaprios.viewsets import EagerLoadingViewSetMixin
+from Dicaprios.cache import CachedListMixin, bump_versions
+from Dicaprios.exports import export_format, streaming_export
 
-class CategoriaViewSet(viewsets.ModelViewSet):
+STOCK_LOTE_CHUNK_SIZE = 2000 # Filas por SELECT FOR UPDATE / UPDATE en actualizar_stock_lote
+
+class CategoriaViewSet(CachedListMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Categoria.objects.all().order_by('nombre_categoria') # Buena práctica añadir order_by
     serializer_class = CategoriaSerializer
+    cache_dependencies = (Categoria,)
+    cursor_ordering = ('nombre_categoria', 'id') # Orden de la paginación por cursor (?page_size=)
     permission_classes = [IsAuthenticated] # Aplicar permisos
 
-class ProductoViewSet(viewsets.ModelViewSet):
+class ProductoViewSet(CachedListMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Producto.objects.all().order_by('nombre_producto')
     serializer_class = ProductoSerializer
+    cache_dependencies = (Producto, Categoria, Proveedor) # categoria_nombre y proveedor_nombre
+    cursor_ordering = ('nombre_producto', 'id')
     permission_classes = [IsAuthenticated] # Usar nombre correcto
 
     def get_queryset(self):
@@ -39,68 +48,107 @@ class ProductoViewSet(viewsets.ModelViewSet):
                 return queryset.none()
         return queryset
     
+    @action(detail=False, methods=['get'], url_path='exportar')
+    def exportar(self, request):
+        """Exporta el catálogo en streaming (?formato=csv|ndjson), con los filtros ?categoria_id= y ?proveedor_id=."""
+        return streaming_export(
+            self.get_queryset().order_by('id'),
+            ['id', 'nombre_producto', 'precio', 'talla', 'color', 'stock',
+             'categoria_id', 'categoria_nombre', 'proveedor_id', 'proveedor_nombre'],
+            ['id', 'nombre_producto', 'precio', 'talla', 'color', 'stock',
+             'categoria_id', 'categoria__nombre_categoria', 'proveedor_id', 'proveedor__nombre_proveedor'],
+            export_format(request), 'productos',
+        )
+
     @action(detail=False, methods=['post'], url_path='actualizar-stock-lote')
     @transaction.atomic
     def actualizar_stock_lote(self, request):
+        """
+        Suma cantidades al stock de varios productos en pocas consultas:
+        1. Se valida todo el payload sin tocar la base de datos.
+        2. Se bloquean todas las filas afectadas con un SELECT ... FOR UPDATE por bloque de IDs,
+           siempre en orden de ID para evitar interbloqueos entre recepciones concurrentes.
+        3. Se escriben los nuevos stocks con bulk_update (un UPDATE ... CASE por bloque).
+        """
         productos_data = request.data
         if not isinstance(productos_data, list):
             return Response({"error": "Se esperaba una lista de productos."}, status=status.HTTP_400_BAD_REQUEST)
         if not productos_data:
             return Response({"mensaje": "No se proporcionaron productos para actualizar."}, status=status.HTTP_200_OK)
 
-        actualizados_info = []
-        # Usaremos una lista para acumular errores. Si hay alguno, revertiremos al final.
+        # Usaremos una lista para acumular errores. Si hay alguno, no se modifica nada.
         errores_items = []
+        items_validos = [] # (producto_id, cantidad_a_anadir) en el orden recibido
 
         for item_data in productos_data:
+            if not isinstance(item_data, dict):
+                errores_items.append({"item": item_data, "error": "Cada elemento debe ser un objeto."})
+                continue
             producto_id = item_data.get('producto_id')
             cantidad_str = item_data.get('cantidad_a_anadir')
 
             if producto_id is None or cantidad_str is None:
                 errores_items.append({"item": item_data, "error": "Falta producto_id o cantidad_a_anadir."})
                 continue # Continuar para recolectar todos los errores de formato
-            
+
+            try:
+                producto_id = int(producto_id)
+            except (TypeError, ValueError):
+                errores_items.append({"producto_id": producto_id, "error": "El producto_id debe ser un número entero."})
+                continue
+
             try:
                 cantidad_a_anadir = int(cantidad_str)
-                if cantidad_a_anadir < 0: # No permitir cantidades negativas
-                    errores_items.append({"producto_id": producto_id, "error": "La cantidad a añadir no puede ser negativa."})
-                    continue
-                if cantidad_a_anadir == 0: # Omitir si la cantidad es 0, no es un error
-                    actualizados_info.append({"producto_id": producto_id, "mensaje": "Cantidad cero, no se actualizó."})
-                    continue
-            except ValueError:
+            except (TypeError, ValueError):
                 errores_items.append({"producto_id": producto_id, "error": "La cantidad a añadir debe ser un número entero."})
                 continue
+            if cantidad_a_anadir < 0: # No permitir cantidades negativas
+                errores_items.append({"producto_id": producto_id, "error": "La cantidad a añadir no puede ser negativa."})
+                continue
+            items_validos.append((producto_id, cantidad_a_anadir))
 
-            try:
-                producto = Producto.objects.select_for_update().get(pk=producto_id)
-                stock_anterior = producto.stock # Guardar stock anterior para la respuesta
-                producto.stock += cantidad_a_anadir
-                producto.save()
-                actualizados_info.append({
-                    "producto_id": producto.id,
-                    "nombre_producto": producto.nombre_producto,
-                    "stock_anterior": stock_anterior,
-                    "cantidad_anadida": cantidad_a_anadir,
-                    "nuevo_stock": producto.stock
-                })
-            except Producto.DoesNotExist:
+        # Bloquear todas las filas afectadas (las cantidades cero no se modifican)
+        ids = sorted({producto_id for producto_id, cantidad in items_validos if cantidad > 0})
+        productos = {}
+        for inicio in range(0, len(ids), STOCK_LOTE_CHUNK_SIZE):
+            bloque = ids[inicio:inicio + STOCK_LOTE_CHUNK_SIZE]
+            for producto in (Producto.objects.select_for_update().filter(id__in=bloque)
+                             .order_by('id').only('id', 'nombre_producto', 'stock')):
+                productos[producto.id] = producto
+
+        actualizados_info = []
+        for producto_id, cantidad_a_anadir in items_validos:
+            if cantidad_a_anadir == 0: # Omitir si la cantidad es 0, no es un error
+                actualizados_info.append({"producto_id": producto_id, "mensaje": "Cantidad cero, no se actualizó."})
+                continue
+            producto = productos.get(producto_id)
+            if producto is None:
                 errores_items.append({"producto_id": producto_id, "error": "Producto no encontrado."})
-            except Exception as e: # Otras excepciones inesperadas
-                errores_items.append({"producto_id": producto_id, "error": f"Error inesperado: {str(e)}"})
-        
+                continue
+            stock_anterior = producto.stock # Guardar stock anterior para la respuesta
+            producto.stock += cantidad_a_anadir # Un mismo producto puede repetirse en el lote
+            actualizados_info.append({
+                "producto_id": producto.id,
+                "nombre_producto": producto.nombre_producto,
+                "stock_anterior": stock_anterior,
+                "cantidad_anadida": cantidad_a_anadir,
+                "nuevo_stock": producto.stock
+            })
+
         if errores_items:
             # Si hubo cualquier error en la validación de los items o al encontrar productos,
-            # la transacción debería revertirse. @transaction.atomic se encarga de esto si
-            # una excepción no controlada se propaga. Para asegurar la reversión explícitamente
-            # si hemos capturado las excepciones:
+            # no se escribe nada y se liberan los bloqueos.
             transaction.set_rollback(True)
             return Response({
                 "mensaje": "La actualización de stock falló debido a errores en los datos. No se realizaron cambios.",
                 "errores_detalle": errores_items,
             }, status=status.HTTP_400_BAD_REQUEST)
-        
-        if not actualizados_info: # Si la lista de productos_data estaba vacía o todas las cantidades eran 0
+
+        if productos:
+            Producto.objects.bulk_update(productos.values(), ['stock'], batch_size=STOCK_LOTE_CHUNK_SIZE)
+            bump_versions(Producto) # bulk_update no emite señales
+
+        if not actualizados_info: # Si la lista de productos_data estaba vacía
             return Response({
                 "mensaje": "No se procesaron productos para actualizar (lista vacía o cantidades cero).",
             }, status=status.HTTP_200_OK)
@@ -111,7 +159,9 @@ class ProductoViewSet(viewsets.ModelViewSet):
         }, status=status.HTTP_200_OK)
 
 
-class ProveedorViewSet(viewsets.ModelViewSet):
+class ProveedorViewSet(CachedListMixin, EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Proveedor.objects.all().order_by('nombre_proveedor') # Añadir order_by
     serializer_class = ProveedorSerializer
+    cache_dependencies = (Proveedor,)
+    cursor_ordering = 'nombre_proveedor' # Único
     permission_classes = [IsAuthenticated] # Aplicar permisos
\ No newline at end of file
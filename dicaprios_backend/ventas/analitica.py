@@ -0,0 +1,169 @@
+# dicaprios_backend/ventas/analitica.py
+"""
+Resúmenes diarios de ventas y consultas agregadas para el panel.
+
+VentaDiariaProducto y VentaDiariaCliente guardan, por día, lo facturado por cada
+producto y cada cliente. Se mantienen así:
+- Al facturar (facturar_pedidos) se suman las facturas nuevas con `acumular_facturas`:
+  unas pocas consultas por bloque, sin recorrer el histórico.
+- Las ediciones manuales de facturas o líneas por la API recalculan sus días
+  (`recalcular_periodo`, desde ventas/signals.py) al confirmar la transacción.
+- El comando `recalcular_ventas_diarias` reconstruye cualquier periodo (carga inicial
+  o reparación).
+
+Las consultas del panel leen solo estas tablas: su coste depende del rango de fechas
+pedido, no de los años de DetalleFactura acumulados. Las ventas por categoría y
+proveedor usan la categoría y el proveedor actuales del producto.
+"""
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from .models import Factura, DetalleFactura, VentaDiariaProducto, VentaDiariaCliente
+
+
+def acumular_facturas(factura_ids):
+    """Suma las facturas indicadas (recién creadas) a los resúmenes de su día. Requiere transacción."""
+    por_cliente = {
+        (fila['dia'], fila['cliente_id']): {'facturas': fila['n'], 'total': fila['suma']}
+        for fila in Factura.objects.filter(id__in=factura_ids)
+        .annotate(dia=TruncDate('fecha_emision')).values('dia', 'cliente_id')
+        .annotate(n=Count('id'), suma=Sum('total')).order_by()
+    }
+    por_producto = {
+        (fila['dia'], fila['producto_id']): {'cantidad': fila['unidades'], 'total': fila['suma']}
+        for fila in DetalleFactura.objects.filter(factura_id__in=factura_ids)
+        .annotate(dia=TruncDate('factura__fecha_emision')).values('dia', 'producto_id')
+        .annotate(unidades=Sum('cantidad'), suma=Sum('subtotal')).order_by()
+    }
+    _sumar(VentaDiariaCliente, 'cliente_id', por_cliente)
+    _sumar(VentaDiariaProducto, 'producto_id', por_producto)
+
+
+def _sumar(modelo, campo, incrementos):
+    """
+    Suma `incrementos` ({(fecha, id): {columna: valor}}) a las filas de `modelo`.
+    Primero se crean las filas que falten (ON CONFLICT DO NOTHING, seguro con facturaciones
+    simultáneas); después se bloquean en orden de ID y se actualizan con bulk_update.
+    """
+    if not incrementos:
+        return
+    modelo.objects.bulk_create(
+        [modelo(fecha=fecha, **{campo: objeto_id}) for fecha, objeto_id in incrementos],
+        ignore_conflicts=True,
+    )
+    fechas = {fecha for fecha, _ in incrementos}
+    ids = {objeto_id for _, objeto_id in incrementos}
+    filas = []
+    for fila in modelo.objects.select_for_update().filter(fecha__in=fechas, **{f'{campo}__in': ids}).order_by('id'):
+        incremento = incrementos.get((fila.fecha, getattr(fila, campo)))
+        if incremento is None: # Combinación fecha/objeto no afectada
+            continue
+        for columna, valor in incremento.items():
+            setattr(fila, columna, getattr(fila, columna) + valor)
+        filas.append(fila)
+    columnas = list(next(iter(incrementos.values())))
+    modelo.objects.bulk_update(filas, columnas, batch_size=500)
+
+
+def _filtro_emision(campo, desde, hasta):
+    """
+    Filtro de fecha_emision entre dos días (incluidos) con límites en la zona horaria
+    actual. Equivale a fecha_emision__date__range, pero compara la columna directamente
+    en lugar de convertir cada fila a fecha (en SQLite, una función Python por fila).
+    """
+    return {
+        f'{campo}__gte': timezone.make_aware(datetime.combine(desde, time.min)),
+        f'{campo}__lt': timezone.make_aware(datetime.combine(hasta + timedelta(days=1), time.min)),
+    }
+
+
+def recalcular_periodo(desde, hasta):
+    """Rehace los resúmenes de los días entre `desde` y `hasta` (incluidos) a partir de las facturas."""
+    VentaDiariaCliente.objects.filter(fecha__range=(desde, hasta)).delete()
+    VentaDiariaProducto.objects.filter(fecha__range=(desde, hasta)).delete()
+    VentaDiariaCliente.objects.bulk_create([
+        VentaDiariaCliente(fecha=fila['dia'], cliente_id=fila['cliente_id'], facturas=fila['n'], total=fila['suma'])
+        for fila in Factura.objects.filter(**_filtro_emision('fecha_emision', desde, hasta))
+        .annotate(dia=TruncDate('fecha_emision')).values('dia', 'cliente_id')
+        .annotate(n=Count('id'), suma=Sum('total')).order_by()
+    ], batch_size=500)
+    VentaDiariaProducto.objects.bulk_create([
+        VentaDiariaProducto(fecha=fila['dia'], producto_id=fila['producto_id'], cantidad=fila['unidades'], total=fila['suma'])
+        for fila in DetalleFactura.objects.filter(**_filtro_emision('factura__fecha_emision', desde, hasta))
+        .annotate(dia=TruncDate('factura__fecha_emision')).values('dia', 'producto_id')
+        .annotate(unidades=Sum('cantidad'), suma=Sum('subtotal')).order_by()
+    ], batch_size=500)
+
+
+def _importe(valor):
+    return str(Decimal(valor or 0).quantize(Decimal('0.01')))
+
+
+def ventas_por_dia(desde, hasta):
+    filas = (VentaDiariaCliente.objects.filter(fecha__range=(desde, hasta))
+             .values('fecha').annotate(n=Sum('facturas'), suma=Sum('total')).order_by('fecha'))
+    return [{"fecha": fila['fecha'], "facturas": fila['n'], "total": _importe(fila['suma'])} for fila in filas]
+
+
+def ventas_por_mes(desde, hasta):
+    filas = (VentaDiariaCliente.objects.filter(fecha__range=(desde, hasta))
+             .annotate(mes=TruncMonth('fecha')).values('mes')
+             .annotate(n=Sum('facturas'), suma=Sum('total')).order_by('mes'))
+    return [
+        {"mes": fila['mes'].strftime('%Y-%m'), "facturas": fila['n'], "total": _importe(fila['suma'])}
+        for fila in filas
+    ]
+
+
+def top_productos(desde, hasta, limite):
+    filas = (VentaDiariaProducto.objects.filter(fecha__range=(desde, hasta))
+             .values('producto_id', 'producto__nombre_producto')
+             .annotate(unidades=Sum('cantidad'), suma=Sum('total')).order_by('-suma', 'producto_id')[:limite])
+    return [
+        {
+            "producto_id": fila['producto_id'],
+            "nombre_producto": fila['producto__nombre_producto'],
+            "cantidad": fila['unidades'],
+            "total": _importe(fila['suma']),
+        }
+        for fila in filas
+    ]
+
+
+def top_clientes(desde, hasta, limite):
+    filas = (VentaDiariaCliente.objects.filter(fecha__range=(desde, hasta))
+             .values('cliente_id', 'cliente__nombre')
+             .annotate(n=Sum('facturas'), suma=Sum('total')).order_by('-suma', 'cliente_id')[:limite])
+    return [
+        {"cliente_id": fila['cliente_id'], "nombre": fila['cliente__nombre'], "facturas": fila['n'], "total": _importe(fila['suma'])}
+        for fila in filas
+    ]
+
+
+def _ventas_por_relacion(desde, hasta, relacion, campo_nombre):
+    id_campo = f'producto__{relacion}_id'
+    nombre_campo = f'producto__{relacion}__{campo_nombre}'
+    filas = (VentaDiariaProducto.objects.filter(fecha__range=(desde, hasta))
+             .values(id_campo, nombre_campo)
+             .annotate(unidades=Sum('cantidad'), suma=Sum('total')).order_by('-suma'))
+    return [
+        {
+            f"{relacion}_id": fila[id_campo], # None: productos sin categoría/proveedor
+            campo_nombre: fila[nombre_campo],
+            "cantidad": fila['unidades'],
+            "total": _importe(fila['suma']),
+        }
+        for fila in filas
+    ]
+
+
+def ventas_por_categoria(desde, hasta):
+    return _ventas_por_relacion(desde, hasta, 'categoria', 'nombre_categoria')
+
+
+def ventas_por_proveedor(desde, hasta):
+    return _ventas_por_relacion(desde, hasta, 'proveedor', 'nombre_proveedor')
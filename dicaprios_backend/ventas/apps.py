@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class VentasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ventas'
+
+    def ready(self):
+        from . import signals  # noqa: F401 (mantiene los resúmenes diarios ante ediciones manuales)
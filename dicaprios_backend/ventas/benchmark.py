@@ -0,0 +1,185 @@
+# dicaprios_backend/ventas/benchmark.py
+"""
+Benchmark de los endpoints de ventas y productos sobre los datos de la base de datos
+actual (ver ventas/datos_sinteticos.py para generarlos).
+
+Cada escenario se ejecuta con el cliente de pruebas de DRF: recorre middleware,
+autenticación, vista, serializadores y base de datos, sin la red. Por escenario se
+mide el número de consultas, la latencia p50/p95/p99 y el pico de memoria asignada
+durante la petición (tracemalloc, en una ejecución aparte para no inflar la latencia).
+
+Los escenarios que escriben (facturación, reservas, stock) se ejecutan dentro de una
+transacción que se revierte, así que la base de datos no cambia y cada repetición
+parte del mismo estado.
+"""
+import statistics
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from clientes.models import Cliente
+from productos.models import Producto, Categoria
+from .models import Pedido, DetallePedido, Factura, DetalleFactura
+
+PAGE_SIZE = 100 # Los listados se piden paginados: sin ?page_size= devuelven la tabla completa
+LOTE = 100 # Pedidos por facturar-lote y productos por actualizar-stock-lote
+
+
+class _Rollback(Exception):
+    pass
+
+
+@dataclass
+class Escenario:
+    nombre: str
+    metodo: str
+    url: str
+    datos: object = None
+    escribe: bool = False # Se ejecuta en una transacción que se revierte
+    cache_fria: bool = False # Vacía la caché del catálogo antes de cada petición
+    omitido: str = None # Motivo por el que no se puede ejecutar con los datos actuales
+
+
+def volumen():
+    """Filas de cada tabla implicada, para acompañar los resultados."""
+    return {
+        "clientes": Cliente.objects.count(),
+        "productos": Producto.objects.count(),
+        "pedidos": Pedido.objects.count(),
+        "lineas_pedido": DetallePedido.objects.count(),
+        "facturas": Factura.objects.count(),
+        "lineas_factura": DetalleFactura.objects.count(),
+    }
+
+
+def escenarios():
+    """Escenarios con IDs reales tomados de la base de datos (los más recientes)."""
+    pendientes = list(
+        Pedido.objects.filter(estado=Pedido.ESTADO_PENDIENTE, factura__isnull=True, detalles__isnull=False)
+        .order_by('-id').values_list('id', flat=True).distinct()[:LOTE]
+    )
+    producto = Producto.objects.filter(stock__gte=1).order_by('-id').values('id', 'precio').first()
+    productos = list(Producto.objects.order_by('-id').values_list('id', flat=True)[:LOTE])
+    cliente_id = Pedido.objects.order_by('-id').values_list('cliente_id', flat=True).first()
+    categoria_id = Categoria.objects.order_by('-id').values_list('id', flat=True).first()
+    sin_pedidos = None if pendientes else "No hay pedidos pendientes con líneas."
+    sin_productos = None if producto else "No hay productos con stock."
+    pagina = f'page_size={PAGE_SIZE}'
+
+    return [
+        Escenario('productos: listado', 'get', f'/api/productos/?{pagina}', cache_fria=True),
+        Escenario('productos: listado (caché)', 'get', f'/api/productos/?{pagina}'),
+        Escenario('productos: filtro categoría', 'get', f'/api/productos/?categoria_id={categoria_id}&{pagina}',
+                  cache_fria=True, omitido=None if categoria_id else "No hay categorías."),
+        Escenario('pedidos: listado', 'get', f'/api/pedidos/?{pagina}'),
+        Escenario('pedidos: filtro estado', 'get', f'/api/pedidos/?estado={Pedido.ESTADO_PENDIENTE}&{pagina}'),
+        Escenario('pedidos: filtro cliente', 'get', f'/api/pedidos/?cliente={cliente_id}&{pagina}',
+                  omitido=None if cliente_id else "No hay pedidos."),
+        Escenario('facturas: listado', 'get', f'/api/facturas/?{pagina}'),
+        Escenario('detalles-pedido: filtro pedido', 'get', f'/api/detalles-pedido/?pedido={pendientes[0] if pendientes else 0}',
+                  omitido=sin_pedidos),
+        Escenario('facturación: generar-factura', 'post', f'/api/pedidos/{pendientes[0] if pendientes else 0}/generar-factura/',
+                  escribe=True, omitido=sin_pedidos),
+        Escenario(f'facturación: facturar-lote ({len(pendientes)})', 'post', '/api/pedidos/facturar-lote/',
+                  {"pedido_ids": pendientes}, escribe=True, omitido=sin_pedidos),
+        Escenario('stock: reservar (detalle de pedido)', 'post', '/api/detalles-pedido/', {
+            "pedido": pendientes[0] if pendientes else 0, "producto": producto['id'] if producto else 0,
+            "cantidad": 1, "precio_unitario": str(producto['precio']) if producto else '0', "subtotal": str(producto['precio']) if producto else '0',
+        }, escribe=True, omitido=sin_pedidos or sin_productos),
+        Escenario(f'stock: actualizar-stock-lote ({len(productos)})', 'post', '/api/productos/actualizar-stock-lote/',
+                  [{"producto_id": producto_id, "cantidad_a_anadir": 5} for producto_id in productos],
+                  escribe=True, omitido=None if productos else "No hay productos."),
+    ]
+
+
+def _host():
+    """Un host aceptado por ALLOWED_HOSTS ('localhost' vale con DEBUG y la lista vacía)."""
+    return next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+
+
+def _cliente():
+    client = APIClient(HTTP_HOST=_host())
+    client.force_authenticate(User(username='benchmark')) # Sin guardar: no escribe en la base de datos
+    return client
+
+
+def _peticion(client, escenario):
+    if escenario.cache_fria:
+        caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')].clear()
+    llamada = getattr(client, escenario.metodo)
+    if not escenario.escribe:
+        return llamada(escenario.url, escenario.datos, format='json')
+    respuesta = None
+    try:
+        with transaction.atomic():
+            respuesta = llamada(escenario.url, escenario.datos, format='json')
+            raise _Rollback
+    except _Rollback:
+        pass
+    return respuesta
+
+
+def _percentiles(timings_ms):
+    if len(timings_ms) == 1:
+        return {"p50": timings_ms[0], "p95": timings_ms[0], "p99": timings_ms[0], "mean": timings_ms[0]}
+    cortes = statistics.quantiles(timings_ms, n=100, method='inclusive')
+    return {
+        "p50": round(statistics.median(timings_ms), 3),
+        "p95": round(cortes[94], 3),
+        "p99": round(cortes[98], 3),
+        "mean": round(statistics.fmean(timings_ms), 3),
+    }
+
+
+def medir_escenario(escenario, repeticiones=20, calentamiento=2):
+    """Consultas, latencia y memoria de un escenario."""
+    if escenario.omitido:
+        return {"escenario": escenario.nombre, "omitido": escenario.omitido}
+    client = _cliente()
+    for _ in range(calentamiento):
+        _peticion(client, escenario)
+
+    with CaptureQueriesContext(connection) as ctx:
+        respuesta = _peticion(client, escenario)
+    # SAVEPOINT/RELEASE de la transacción del benchmark no cuentan
+    consultas = sum(1 for query in ctx.captured_queries if 'SAVEPOINT' not in query['sql'].upper())
+
+    timings = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        _peticion(client, escenario)
+        timings.append((time.perf_counter() - inicio) * 1000)
+
+    tracemalloc.start()
+    try:
+        _peticion(client, escenario)
+        _, pico = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    contenido = b'' if respuesta.streaming else respuesta.content
+    return {
+        "escenario": escenario.nombre,
+        "metodo": escenario.metodo.upper(),
+        "url": escenario.url,
+        "estado_http": respuesta.status_code,
+        "consultas": consultas,
+        "latencia_ms": _percentiles(timings),
+        "memoria_pico_bytes": pico,
+        "bytes_respuesta": len(contenido),
+    }
+
+
+def ejecutar(repeticiones=20, calentamiento=2, filtro=None):
+    """Mide todos los escenarios (o los que contienen `filtro` en el nombre)."""
+    return [
+        medir_escenario(escenario, repeticiones, calentamiento)
+        for escenario in escenarios() if not filtro or filtro in escenario.nombre
+    ]
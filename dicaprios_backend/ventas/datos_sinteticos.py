@@ -0,0 +1,200 @@
+# dicaprios_backend/ventas/datos_sinteticos.py
+"""
+Generador de datos sintéticos para reproducir volúmenes de producción en local.
+
+Crea categorías, proveedores, clientes, productos, pedidos con sus líneas y, para una
+parte de los pedidos, facturas con sus líneas. Todo se inserta con bulk_create por
+bloques (una transacción por bloque). La memoria depende del tamaño del bloque, no
+del total, así que sirve para millones de líneas.
+
+Las fechas se reparten entre `dias` días hasta hoy, en orden creciente de ID como en
+producción. `fecha` y `fecha_emision` son auto_now_add, así que bulk_create siempre
+guarda la fecha actual; después se corrige con un UPDATE por día y bloque.
+
+Los resúmenes diarios de ventas se rehacen al final con `recalcular_periodo`, por
+meses: sumar cada bloque con `acumular_facturas` (pensado para las facturas de un
+día) actualizaría fila a fila los resúmenes de todos los días del bloque.
+
+Los datos se añaden a los existentes: usa una base de datos dedicada
+(p. ej. POSTGRES_DB=dicaprios_bench).
+"""
+import random
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from Dicaprios.cache import bump_versions
+from clientes.models import Cliente
+from productos.models import Producto, Categoria, Proveedor
+from .models import Pedido, DetallePedido, Factura, DetalleFactura
+from .analitica import recalcular_periodo
+
+BATCH_SIZE = 5000 # Pedidos por bloque (con sus líneas y facturas)
+INSERT_BATCH_SIZE = 1000 # Filas por INSERT (límite de parámetros de SQLite)
+DIAS_POR_RECALCULO = 31
+
+CATEGORIAS = ['Camisas', 'Pantalones', 'Vestidos', 'Chaquetas', 'Zapatos', 'Accesorios', 'Deportiva', 'Interior']
+COLORES = ['Negro', 'Blanco', 'Azul', 'Rojo', 'Verde', 'Gris', 'Beige', 'Marrón']
+TALLAS = ['XS', 'S', 'M', 'L', 'XL', None]
+STOCK_INICIAL = 1_000_000 # Suficiente para que los benchmarks de reserva no agoten el stock
+
+
+def _por_bloques(total, tamano):
+    for inicio in range(0, total, tamano):
+        yield inicio, min(tamano, total - inicio)
+
+
+def _crear_catalogo_base(rng, categorias, proveedores, etiqueta):
+    Categoria.objects.bulk_create([Categoria(nombre_categoria=f'{nombre} {etiqueta}') for nombre in CATEGORIAS[:categorias]])
+    Proveedor.objects.bulk_create([
+        Proveedor(nombre_proveedor=f'Proveedor {etiqueta}-{i}', contacto=f'Contacto {i}', telefono=str(rng.randrange(10**8, 10**9)))
+        for i in range(proveedores)
+    ], ignore_conflicts=True)
+    categoria_ids = list(Categoria.objects.filter(nombre_categoria__endswith=f' {etiqueta}').values_list('id', flat=True))
+    proveedor_ids = list(Proveedor.objects.filter(nombre_proveedor__startswith=f'Proveedor {etiqueta}-').values_list('id', flat=True))
+    return categoria_ids, proveedor_ids
+
+
+def _crear_clientes(rng, total, etiqueta):
+    for inicio, n in _por_bloques(total, BATCH_SIZE):
+        Cliente.objects.bulk_create([
+            Cliente(
+                nombre=f'Cliente {etiqueta}-{inicio + i}',
+                email=f'cliente{inicio + i}@example.com',
+                telefono=rng.randrange(10**8, 10**9),
+                direccion=f'Calle {rng.randrange(1, 200)} #{rng.randrange(1, 100)}',
+            )
+            for i in range(n)
+        ], batch_size=INSERT_BATCH_SIZE)
+
+
+def _crear_productos(rng, total, categoria_ids, proveedor_ids, etiqueta):
+    for inicio, n in _por_bloques(total, BATCH_SIZE):
+        Producto.objects.bulk_create([
+            Producto(
+                nombre_producto=f'Producto {etiqueta}-{inicio + i}',
+                precio=Decimal(rng.randrange(500, 50000)) / 100,
+                talla=rng.choice(TALLAS),
+                color=rng.choice(COLORES),
+                stock=STOCK_INICIAL,
+                categoria_id=rng.choice(categoria_ids) if categoria_ids else None,
+                proveedor_id=rng.choice(proveedor_ids) if proveedor_ids else None,
+            )
+            for i in range(n)
+        ], batch_size=INSERT_BATCH_SIZE)
+
+
+def _fijar_fechas(modelo, campo, ids, fechas, a_valor):
+    """Un UPDATE por tramo de IDs consecutivos con la misma fecha (los IDs llegan en orden)."""
+    tramo_inicio = 0
+    for i in range(1, len(ids) + 1):
+        if i == len(ids) or fechas[i] != fechas[tramo_inicio]:
+            modelo.objects.filter(id__range=(ids[tramo_inicio], ids[i - 1])).update(**{campo: a_valor(fechas[tramo_inicio])})
+            tramo_inicio = i
+
+
+def _mediodia(dia):
+    return timezone.make_aware(datetime.combine(dia, time(12)))
+
+
+def _crear_pedidos(rng, total, lineas_por_pedido, proporcion_facturada, dias, cliente_ids, productos, stdout):
+    """Pedidos, líneas, facturas y líneas de factura por bloques. Devuelve el rango de fechas."""
+    hoy = timezone.localdate()
+    primer_dia = hoy - timedelta(days=dias - 1)
+    lineas = facturas = 0
+    for inicio, n in _por_bloques(total, BATCH_SIZE):
+        # Fecha creciente con el número de pedido, repartida uniformemente en el periodo
+        fechas = [primer_dia + timedelta(days=(inicio + i) * dias // total) for i in range(n)]
+        facturados = [rng.random() < proporcion_facturada for _ in range(n)]
+        with transaction.atomic():
+            pedidos = Pedido.objects.bulk_create([
+                Pedido(
+                    cliente_id=rng.choice(cliente_ids),
+                    estado=Pedido.ESTADO_FACTURADO if facturado else rng.choice(
+                        [Pedido.ESTADO_PENDIENTE] * 9 + [Pedido.ESTADO_CANCELADO]
+                    ),
+                )
+                for facturado in facturados
+            ], batch_size=INSERT_BATCH_SIZE)
+            pedido_ids = [pedido.id for pedido in pedidos]
+            _fijar_fechas(Pedido, 'fecha', pedido_ids, fechas, lambda dia: dia)
+
+            detalles = []
+            totales = []
+            for pedido in pedidos:
+                total_pedido = Decimal(0)
+                for _ in range(max(1, round(rng.expovariate(1 / lineas_por_pedido)))):
+                    producto_id, precio = rng.choice(productos)
+                    cantidad = rng.randint(1, 5)
+                    subtotal = precio * cantidad
+                    total_pedido += subtotal
+                    detalles.append(DetallePedido(
+                        pedido_id=pedido.id, producto_id=producto_id, cantidad=cantidad,
+                        precio_unitario=precio, subtotal=subtotal,
+                    ))
+                totales.append(total_pedido)
+            DetallePedido.objects.bulk_create(detalles, batch_size=INSERT_BATCH_SIZE)
+
+            nuevas = [
+                Factura(cliente_id=pedido.cliente_id, pedido_id=pedido.id, total=total_pedido)
+                for pedido, total_pedido, facturado in zip(pedidos, totales, facturados) if facturado
+            ]
+            factura_por_pedido = {
+                factura.pedido_id: factura.id for factura in Factura.objects.bulk_create(nuevas, batch_size=INSERT_BATCH_SIZE)
+            }
+            _fijar_fechas(
+                Factura, 'fecha_emision', list(factura_por_pedido.values()),
+                [fecha for fecha, facturado in zip(fechas, facturados) if facturado], _mediodia,
+            )
+            DetalleFactura.objects.bulk_create([
+                DetalleFactura(
+                    factura_id=factura_por_pedido[detalle.pedido_id], producto_id=detalle.producto_id,
+                    cantidad=detalle.cantidad, precio_unitario=detalle.precio_unitario, subtotal=detalle.subtotal,
+                )
+                for detalle in detalles if detalle.pedido_id in factura_por_pedido
+            ], batch_size=INSERT_BATCH_SIZE)
+        lineas += len(detalles)
+        facturas += len(nuevas)
+        if stdout is not None:
+            stdout.write(f"Pedidos {inicio + n}/{total} ({lineas} líneas, {facturas} facturas)")
+    return primer_dia, hoy, lineas, facturas
+
+
+def generar_datos(clientes, productos, pedidos, lineas_por_pedido=3, proporcion_facturada=0.6, dias=365,
+                  categorias=8, proveedores=50, seed=0, stdout=None):
+    """
+    Añade el volumen indicado de datos sintéticos. Los pedidos se reparten entre todos
+    los clientes y productos existentes, no solo los nuevos. Devuelve un resumen con
+    las filas creadas de cada modelo.
+    """
+    if lineas_por_pedido < 1 or dias < 1 or not 0 <= proporcion_facturada <= 1:
+        raise ValueError("Parámetros fuera de rango: lineas_por_pedido >= 1, dias >= 1 y 0 <= proporcion_facturada <= 1.")
+    rng = random.Random(seed)
+    etiqueta = f's{seed}-{timezone.now():%Y%m%d%H%M%S%f}' # Nombres únicos aunque se genere varias veces
+
+    categoria_ids, proveedor_ids = _crear_catalogo_base(rng, min(categorias, len(CATEGORIAS)), proveedores, etiqueta)
+    _crear_clientes(rng, clientes, etiqueta)
+    _crear_productos(rng, productos, categoria_ids, proveedor_ids, etiqueta)
+    bump_versions(Producto, Categoria, Proveedor) # bulk_create no emite señales
+
+    resumen = {"clientes": clientes, "productos": productos, "pedidos": 0, "lineas_pedido": 0, "facturas": 0}
+    if not pedidos:
+        return resumen
+    cliente_ids = list(Cliente.objects.values_list('id', flat=True))
+    catalogo = list(Producto.objects.values_list('id', 'precio'))
+    if not cliente_ids or not catalogo:
+        raise ValueError("Se necesitan clientes y productos para generar pedidos.")
+
+    desde, hasta, lineas, facturas = _crear_pedidos(
+        rng, pedidos, lineas_por_pedido, proporcion_facturada, dias, cliente_ids, catalogo, stdout,
+    )
+    inicio = desde
+    while inicio <= hasta:
+        fin = min(inicio + timedelta(days=DIAS_POR_RECALCULO - 1), hasta)
+        with transaction.atomic():
+            recalcular_periodo(inicio, fin)
+        inicio = fin + timedelta(days=1)
+    resumen.update(pedidos=pedidos, lineas_pedido=lineas, facturas=facturas)
+    return resumen
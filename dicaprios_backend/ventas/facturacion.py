@@ -0,0 +1,98 @@
+# dicaprios_backend/ventas/facturacion.py
+"""
+Generación de facturas por conjuntos: el coste en consultas no depende del número
+de líneas ni de pedidos (salvo por los bloques de IDs).
+
+Para cada bloque de pedidos:
+- Los totales se calculan en la base de datos con SUM agrupado por pedido.
+- Las facturas y sus líneas se insertan con bulk_create, copiando las columnas de
+  DetallePedido (producto_id incluido) sin cargar los productos.
+- El estado de los pedidos se actualiza con un único UPDATE.
+- Las facturas nuevas se suman a los resúmenes diarios de ventas (ver ventas/analitica.py).
+
+Debe llamarse dentro de una transacción (transaction.atomic).
+"""
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import Pedido, DetallePedido, Factura, DetalleFactura
+from .analitica import acumular_facturas
+
+CHUNK_SIZE = 500 # Pedidos por bloque (límite de parámetros de la consulta SQL)
+
+ERROR_NO_ENCONTRADO = "Pedido no encontrado."
+ERROR_YA_FACTURADO = "Este pedido ya ha sido facturado."
+ERROR_SIN_DETALLES = "El pedido no tiene detalles y no se puede facturar."
+ERROR_NO_PENDIENTE = f"Solo se pueden facturar pedidos en estado '{Pedido.ESTADO_PENDIENTE}'."
+
+
+def facturar_pedidos(pedido_ids, solo_pendientes=False):
+    """
+    Factura los pedidos indicados. Bloquea las filas de los pedidos (SELECT ... FOR UPDATE,
+    en orden de ID) para que dos ejecuciones simultáneas no facturen el mismo pedido.
+    Devuelve (facturas creadas, {pedido_id: mensaje de error}) de los pedidos omitidos.
+    """
+    pedido_ids = sorted(set(pedido_ids))
+    facturas = []
+    errores = {}
+    for inicio in range(0, len(pedido_ids), CHUNK_SIZE):
+        bloque = pedido_ids[inicio:inicio + CHUNK_SIZE]
+        creadas, errores_bloque = _facturar_bloque(bloque, solo_pendientes)
+        facturas.extend(creadas)
+        errores.update(errores_bloque)
+    return facturas, errores
+
+
+def _facturar_bloque(pedido_ids, solo_pendientes):
+    errores = {}
+    pedidos = {
+        pedido_id: (cliente_id, estado)
+        for pedido_id, cliente_id, estado in Pedido.objects.select_for_update()
+        .filter(id__in=pedido_ids).order_by('id').values_list('id', 'cliente_id', 'estado')
+    }
+    ya_facturados = set(Factura.objects.filter(pedido_id__in=pedido_ids).values_list('pedido_id', flat=True))
+    totales = dict(
+        DetallePedido.objects.filter(pedido_id__in=pedido_ids)
+        .values('pedido_id').annotate(total=Sum('subtotal')).values_list('pedido_id', 'total')
+    )
+
+    ahora = timezone.now()
+    nuevas = []
+    for pedido_id in pedido_ids:
+        if pedido_id not in pedidos:
+            errores[pedido_id] = ERROR_NO_ENCONTRADO
+        elif pedido_id in ya_facturados:
+            errores[pedido_id] = ERROR_YA_FACTURADO
+        elif solo_pendientes and pedidos[pedido_id][1] != Pedido.ESTADO_PENDIENTE:
+            errores[pedido_id] = ERROR_NO_PENDIENTE
+        elif pedido_id not in totales:
+            errores[pedido_id] = ERROR_SIN_DETALLES
+        else:
+            nuevas.append(Factura(
+                cliente_id=pedidos[pedido_id][0],
+                pedido_id=pedido_id,
+                fecha_emision=ahora,
+                total=totales[pedido_id],
+            ))
+    if not nuevas:
+        return [], errores
+
+    facturas = Factura.objects.bulk_create(nuevas) # Devuelve las PK (RETURNING en PostgreSQL/SQLite)
+    factura_por_pedido = {factura.pedido_id: factura.id for factura in facturas}
+
+    DetalleFactura.objects.bulk_create([
+        DetalleFactura(
+            factura_id=factura_por_pedido[pedido_id],
+            producto_id=producto_id,
+            cantidad=cantidad,
+            precio_unitario=precio_unitario,
+            subtotal=subtotal,
+        )
+        for pedido_id, producto_id, cantidad, precio_unitario, subtotal in
+        DetallePedido.objects.filter(pedido_id__in=factura_por_pedido).order_by('id')
+        .values_list('pedido_id', 'producto_id', 'cantidad', 'precio_unitario', 'subtotal')
+    ], batch_size=CHUNK_SIZE)
+
+    Pedido.objects.filter(id__in=factura_por_pedido).update(estado=Pedido.ESTADO_FACTURADO)
+    acumular_facturas(list(factura_por_pedido.values()))
+    return facturas, errores
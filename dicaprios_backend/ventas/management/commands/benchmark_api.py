@@ -0,0 +1,88 @@
+import json
+import platform
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ventas.benchmark import ejecutar, volumen
+from ventas.datos_sinteticos import generar_datos
+
+CLIENTES_POR_PEDIDO = 0.1 # Al completar una escala: 1 cliente por cada 10 pedidos
+PRODUCTOS_POR_PEDIDO = 0.02 # y 1 producto por cada 50
+
+
+def _csv(value):
+    return [int(item.strip()) for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide consultas, latencia y memoria de los listados, filtros, facturación y stock de ventas y '
+        'productos con los datos actuales. Con --escalas completa antes los datos sintéticos hasta cada '
+        'número de pedidos (solo añade filas: usa una base de datos dedicada).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--escalas', default='', help='Número de pedidos de cada escala, separados por comas (p. ej. 10000,100000,1000000).')
+        parser.add_argument('--repeticiones', type=int, default=20, help='Peticiones medidas por escenario.')
+        parser.add_argument('--calentamiento', type=int, default=2, help='Peticiones previas no medidas.')
+        parser.add_argument('--escenario', default=None, help='Solo los escenarios cuyo nombre contiene este texto.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Archivo JSON donde guardar el informe.')
+
+    def _escribir(self, resultados):
+        self.stdout.write(f"{'escenario':<42} {'HTTP':>4} {'consultas':>9} {'p50 ms':>9} {'p95 ms':>9} {'memoria KB':>11}")
+        for r in resultados:
+            if 'omitido' in r:
+                self.stdout.write(f"{r['escenario']:<42} omitido: {r['omitido']}")
+                continue
+            self.stdout.write(
+                f"{r['escenario']:<42} {r['estado_http']:>4} {r['consultas']:>9} {r['latencia_ms']['p50']:>9.2f} "
+                f"{r['latencia_ms']['p95']:>9.2f} {r['memoria_pico_bytes'] / 1024:>11.0f}"
+            )
+
+    def handle(self, *args, **options):
+        if options['repeticiones'] < 1 or options['calentamiento'] < 0:
+            raise CommandError("--repeticiones debe ser al menos 1 y --calentamiento no puede ser negativo.")
+        try:
+            escalas = _csv(options['escalas'])
+        except ValueError:
+            raise CommandError("--escalas debe ser una lista de enteros separados por comas.")
+
+        informe = {
+            "entorno": {"python": platform.python_version(), "django": django.get_version(), "base_de_datos": connection.vendor},
+            "escalas": [],
+        }
+        for escala in escalas or [None]:
+            if escala is not None:
+                faltan = escala - volumen()['pedidos']
+                if faltan > 0:
+                    self.stdout.write(f"Generando {faltan} pedidos para la escala {escala}...")
+                    generar_datos(
+                        max(1, int(faltan * CLIENTES_POR_PEDIDO)), max(1, int(faltan * PRODUCTOS_POR_PEDIDO)), faltan,
+                        seed=options['seed'] + escala,
+                    )
+            filas = volumen()
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                "Volumen: " + ", ".join(f"{nombre} {n}" for nombre, n in filas.items())
+            ))
+            resultados = ejecutar(options['repeticiones'], options['calentamiento'], options['escenario'])
+            self._escribir(resultados)
+            informe['escalas'].append({"volumen": filas, "resultados": resultados})
+
+        # Un número de consultas que cambia con el volumen indica N+1 o consultas por fila
+        consultas = {}
+        for escala in informe['escalas']:
+            for r in escala['resultados']:
+                if 'consultas' in r:
+                    consultas.setdefault(r['escenario'], set()).add(r['consultas'])
+        variables = sorted(nombre for nombre, valores in consultas.items() if len(valores) > 1)
+        for nombre in variables:
+            self.stdout.write(self.style.WARNING(f"{nombre}: el número de consultas cambia con el volumen."))
+        informe['consultas_variables'] = variables
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(informe, f, indent=2, ensure_ascii=False)
+            self.stdout.write(f"Informe guardado en {options['output']}")
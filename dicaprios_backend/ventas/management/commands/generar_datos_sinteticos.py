@@ -0,0 +1,39 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ventas.datos_sinteticos import generar_datos
+
+
+class Command(BaseCommand):
+    help = (
+        'Añade datos sintéticos (clientes, productos, pedidos, facturas y sus líneas) con bulk_create '
+        'por bloques, para reproducir volúmenes de producción. Usa una base de datos dedicada.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=10000)
+        parser.add_argument('--productos', type=int, default=2000)
+        parser.add_argument('--pedidos', type=int, default=100000)
+        parser.add_argument('--lineas-por-pedido', type=float, default=3, help='Media de líneas por pedido (distribución exponencial).')
+        parser.add_argument('--proporcion-facturada', type=float, default=0.6, help='Fracción de pedidos con factura.')
+        parser.add_argument('--dias', type=int, default=365, help='Días de historia sobre los que se reparten los pedidos.')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if min(options['clientes'], options['productos'], options['pedidos']) < 0:
+            raise CommandError("Las cantidades no pueden ser negativas.")
+        inicio = time.perf_counter()
+        try:
+            resumen = generar_datos(
+                options['clientes'], options['productos'], options['pedidos'],
+                lineas_por_pedido=options['lineas_por_pedido'],
+                proporcion_facturada=options['proporcion_facturada'],
+                dias=options['dias'], seed=options['seed'], stdout=self.stdout,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(
+            f"Creados {resumen['clientes']} clientes, {resumen['productos']} productos, {resumen['pedidos']} pedidos "
+            f"({resumen['lineas_pedido']} líneas) y {resumen['facturas']} facturas en {time.perf_counter() - inicio:.1f} s."
+        ))
@@ -0,0 +1,41 @@
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from ventas.models import Factura
+from ventas.analitica import recalcular_periodo
+
+DIAS_POR_BLOQUE = 31 # Cada bloque se recalcula en su propia transacción
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye los resúmenes diarios de ventas (VentaDiariaProducto/VentaDiariaCliente) '
+        'a partir de las facturas. Úsalo para la carga inicial o tras cambios hechos fuera de la API.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', type=date.fromisoformat, help='Primer día (AAAA-MM-DD). Por defecto, la primera factura.')
+        parser.add_argument('--hasta', type=date.fromisoformat, help='Último día (AAAA-MM-DD). Por defecto, la última factura.')
+
+    def handle(self, *args, **options):
+        rango = Factura.objects.aggregate(primera=Min('fecha_emision'), ultima=Max('fecha_emision'))
+        if rango['primera'] is None and not (options['desde'] and options['hasta']):
+            self.stdout.write("No hay facturas: nada que recalcular.")
+            return
+        desde = options['desde'] or timezone.localdate(rango['primera'])
+        hasta = options['hasta'] or timezone.localdate(rango['ultima'])
+        if desde > hasta:
+            raise CommandError("--desde no puede ser posterior a --hasta.")
+
+        inicio = desde
+        while inicio <= hasta:
+            fin = min(inicio + timedelta(days=DIAS_POR_BLOQUE - 1), hasta)
+            with transaction.atomic():
+                recalcular_periodo(inicio, fin)
+            self.stdout.write(f"Recalculado {inicio} - {fin}")
+            inicio = fin + timedelta(days=1)
+        self.stdout.write(self.style.SUCCESS(f"Resúmenes diarios de ventas recalculados del {desde} al {hasta}."))
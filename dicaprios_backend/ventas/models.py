@@ -22,6 +22,13 @@ class Pedido(models.Model):
         default=ESTADO_PENDIENTE
     )
 
+    class Meta:
+        indexes = [
+            # Filtro ?estado= (p. ej. pedidos pendientes) y facturación por lotes, por fecha.
+            # cliente y DetallePedido.pedido ya tienen índice por ser ForeignKey.
+            models.Index(fields=['estado', 'fecha'], name='pedido_estado_fecha_idx'),
+        ]
+
     def __str__(self):
         
         nombre_cliente = self.cliente.nombre if hasattr(self.cliente, 'nombre') and self.cliente.nombre else "Desconocido"
@@ -57,3 +64,37 @@ class DetalleFactura(models.Model):
 
     def __str__(self):
         return f'Detalles de Factura {self.factura.id} - Producto {self.producto.nombre_producto}'
+
+
+# --- Resúmenes diarios de ventas (ver ventas/analitica.py) ---
+# Se mantienen de forma incremental al facturar, de modo que las consultas del panel
+# recorren como mucho una fila por día y producto/cliente, no todas las líneas de factura.
+
+class VentaDiariaProducto(models.Model):
+    fecha = models.DateField()
+    producto = models.ForeignKey(Producto, on_delete=models.CASCADE, related_name='+')
+    cantidad = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'producto'], name='venta_diaria_producto_unica'),
+        ]
+
+    def __str__(self):
+        return f'{self.fecha} - Producto {self.producto_id}: {self.total}'
+
+
+class VentaDiariaCliente(models.Model):
+    fecha = models.DateField()
+    cliente = models.ForeignKey(Cliente, on_delete=models.CASCADE, related_name='+')
+    facturas = models.IntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['fecha', 'cliente'], name='venta_diaria_cliente_unica'),
+        ]
+
+    def __str__(self):
+        return f'{self.fecha} - Cliente {self.cliente_id}: {self.total}'
@@ -1,17 +1,33 @@
 from rest_framework import serializers
 from .models import Pedido, DetallePedido, Factura, DetalleFactura, Cliente, Producto
+from django.db.models import Prefetch
+from Dicaprios.serializers import TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin
+
+class PedidoSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    # Nombre del cliente en la misma consulta (JOIN); con ?omit=cliente_nombre no se hace el JOIN
+    select_related_fields = {'cliente': ('cliente_nombre',)}
+    cliente_nombre = serializers.CharField(source='cliente.nombre', read_only=True)
 
-class PedidoSerializer(serializers.ModelSerializer):
     class Meta:
         model = Pedido
-        fields = ['id', 'cliente', 'fecha', 'estado']
+        fields = ['id', 'cliente', 'cliente_nombre', 'fecha', 'estado']
 
-class DetallePedidoSerializer(serializers.ModelSerializer):
+class DetallePedidoSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer):
     class Meta:
         model = DetallePedido
         fields = ['id', 'pedido', 'producto', 'cantidad', 'precio_unitario', 'subtotal']
 
-class DetalleFacturaSerializer(serializers.ModelSerializer): # Corregido: DetalleFactura
+class DetallePedidoLoteSerializer(serializers.Serializer):
+    """Línea de la creación por lotes: IDs sin consultar cada relación (se validan en bloque en la vista)."""
+    pedido = serializers.IntegerField()
+    producto = serializers.IntegerField()
+    cantidad = serializers.IntegerField(min_value=1)
+    precio_unitario = serializers.DecimalField(max_digits=10, decimal_places=2)
+    subtotal = serializers.DecimalField(max_digits=10, decimal_places=2)
+
+class DetalleFacturaSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer): # Corregido: DetalleFactura
+    select_related_fields = {'producto': ('producto_nombre',)}
+
     producto_nombre = serializers.CharField(source='producto.nombre_producto', read_only=True)
 
     class Meta:
@@ -19,10 +35,15 @@ class DetalleFacturaSerializer(serializers.ModelSerializer): # Corregido: Detall
         fields = ['id', 'factura', 'producto', 'producto_nombre', 'cantidad', 'precio_unitario', 'subtotal']
         # 'factura' podría ser read_only si siempre se crea a través de la factura padre
 
-class FacturaSerializer(serializers.ModelSerializer):
+class FacturaSerializer(TimedRepresentationMixin, SparseFieldsetMixin, EagerLoadingMixin, serializers.ModelSerializer):
+    select_related_fields = {'cliente': ('cliente_nombre',)}
+    prefetch_related_fields = (
+        Prefetch('detalles', queryset=DetalleFactura.objects.select_related('producto')),
+    )
+
     detalles = DetalleFacturaSerializer(many=True, read_only=True)
-    cliente_nombre = serializers.CharField(source='cliente.nombre_completo', read_only=True) # Asumiendo 'nombre_completo' en Cliente, o ajusta
-    pedido_id = serializers.IntegerField(source='pedido.id', read_only=True)
+    cliente_nombre = serializers.CharField(source='cliente.nombre', read_only=True) # Cliente no tiene 'nombre_completo'
+    pedido_id = serializers.IntegerField(read_only=True) # Columna FK: no carga el pedido
 
     class Meta:
         model = Factura
@@ -0,0 +1,83 @@
+# dicaprios_backend/ventas/signals.py
+"""
+Las facturas creadas con facturar_pedidos se suman a los resúmenes diarios de forma
+incremental (bulk_create no emite señales). Las altas, ediciones y borrados manuales
+de facturas o líneas por la API recalculan los días afectados: el de la factura y, si
+se cambió su fecha de emisión (o la línea pasó a otra factura), también el anterior.
+
+El recálculo se hace una sola vez por transacción, al confirmarla
+(transaction.on_commit): guardar las N líneas de una factura no rehace el día N veces.
+"""
+import threading
+
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import Factura, DetalleFactura
+from .analitica import recalcular_periodo
+
+_pendientes = threading.local() # Días por recalcular en las transacciones en curso de este hilo
+
+
+def _dia(fecha_emision):
+    return timezone.localdate(fecha_emision) if timezone.is_aware(fecha_emision) else fecha_emision.date()
+
+
+def _dias_pendientes():
+    dias = getattr(_pendientes, 'dias', None)
+    if dias is None:
+        dias = _pendientes.dias = set()
+    return dias
+
+
+def _recalcular_pendientes():
+    dias, _pendientes.dias = _dias_pendientes(), set()
+    for dia in sorted(dias):
+        with transaction.atomic():
+            recalcular_periodo(dia, dia)
+
+
+def _programar(*fechas_emision):
+    """
+    Marca los días para recalcularlos al confirmar la transacción. Cada llamada registra
+    un callback, pero solo el primero que se ejecuta trabaja: los demás encuentran el
+    conjunto vacío. Los días de una transacción revertida se recalculan de más en la
+    siguiente, sin efecto en el resultado.
+    """
+    _dias_pendientes().update(_dia(fecha) for fecha in fechas_emision if fecha is not None)
+    transaction.on_commit(_recalcular_pendientes)
+
+
+@receiver(pre_save, sender=Factura)
+def factura_por_modificar(sender, instance, update_fields=None, **kwargs):
+    # Fecha guardada antes de la edición: si cambia, el día anterior también queda desactualizado
+    instance._fecha_emision_anterior = None
+    if instance.pk is not None and (update_fields is None or 'fecha_emision' in update_fields):
+        instance._fecha_emision_anterior = (
+            Factura.objects.filter(pk=instance.pk).values_list('fecha_emision', flat=True).first()
+        )
+
+
+@receiver([post_save, post_delete], sender=Factura)
+def factura_modificada(sender, instance, **kwargs):
+    _programar(instance.fecha_emision, getattr(instance, '_fecha_emision_anterior', None))
+
+
+@receiver(pre_save, sender=DetalleFactura)
+def detalle_factura_por_modificar(sender, instance, **kwargs):
+    # La línea puede pasar a otra factura: se recalcula también el día de la anterior
+    instance._fecha_emision_anterior = None
+    if instance.pk is not None:
+        instance._fecha_emision_anterior = (
+            DetalleFactura.objects.filter(pk=instance.pk).values_list('factura__fecha_emision', flat=True).first()
+        )
+
+
+@receiver([post_save, post_delete], sender=DetalleFactura)
+def detalle_factura_modificado(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Factura):
+        return # Borrado en cascada: se recalcula con la señal de la factura
+    fecha_emision = Factura.objects.filter(id=instance.factura_id).values_list('fecha_emision', flat=True).first()
+    _programar(fecha_emision, getattr(instance, '_fecha_emision_anterior', None))
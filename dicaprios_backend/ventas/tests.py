@@ -1,3 +1,531 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction, OperationalError
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from Dicaprios.testing import APITestMixin
+from clientes.models import Cliente
+from django.utils import timezone
+from productos.models import Producto, Categoria, Proveedor
+from .models import Pedido, DetallePedido, Factura, DetalleFactura, VentaDiariaProducto, VentaDiariaCliente
+from .analitica import recalcular_periodo
+from .datos_sinteticos import generar_datos
+
+
+class VentasListQueriesTests(APITestMixin, TestCase):
+    """Los listados de ventas deben costar un número constante de consultas."""
+
+    def create_facturas(self, n):
+        for i in range(n):
+            cliente = Cliente.objects.create(nombre=f'Cliente {i}', email='c@example.com', telefono=1, direccion='Zona 1')
+            pedido = Pedido.objects.create(cliente=cliente)
+            factura = Factura.objects.create(cliente=cliente, pedido=pedido, total=20)
+            for j in range(2):
+                producto = Producto.objects.create(nombre_producto=f'Producto {i}-{j}', precio=10, color='Azul', stock=5)
+                DetallePedido.objects.create(pedido=pedido, producto=producto, cantidad=1, precio_unitario=10, subtotal=10)
+                DetalleFactura.objects.create(factura=factura, producto=producto, cantidad=1, precio_unitario=10, subtotal=10)
+
+    def test_listado_facturas_consultas_constantes(self):
+        queries = self.assertConstantListQueries('/api/facturas/', self.create_facturas)
+        self.assertEqual(queries, 2) # Facturas con cliente + detalles con producto
+
+    def test_listado_detalles_factura_consultas_constantes(self):
+        self.assertConstantListQueries('/api/detalles-factura/', self.create_facturas)
+
+    def test_listado_pedidos_consultas_constantes(self):
+        self.assertConstantListQueries('/api/pedidos/', self.create_facturas)
+
+    def test_listado_detalles_pedido_consultas_constantes(self):
+        self.assertConstantListQueries('/api/detalles-pedido/', self.create_facturas)
+
+    def test_factura_incluye_nombres(self):
+        self.create_facturas(1)
+        factura = self.client.get('/api/facturas/').data[0]
+        self.assertEqual(factura['cliente_nombre'], 'Cliente 0')
+        self.assertEqual(len(factura['detalles']), 2)
+        self.assertTrue(factura['detalles'][0]['producto_nombre'].startswith('Producto 0-'))
+
+    def test_omitir_detalles_no_los_consulta(self):
+        self.create_facturas(3)
+        self.assertEqual(self.count_list_queries('/api/facturas/?omit=detalles'), 1)
+
+    def test_pedido_incluye_nombre_cliente(self):
+        self.create_facturas(2)
+        pedidos = self.client.get('/api/pedidos/').data
+        self.assertEqual([p['cliente_nombre'] for p in pedidos], ['Cliente 0', 'Cliente 1'])
+        self.assertNotIn('cliente_nombre', self.client.get('/api/pedidos/?omit=cliente_nombre').data[0])
+
+    def test_omitir_nombre_cliente_evita_el_join(self):
+        self.create_facturas(2)
+        for url, join in (
+            ('/api/pedidos/', True),
+            ('/api/pedidos/?omit=cliente_nombre', False),
+            ('/api/pedidos/?fields=id,estado', False),
+            ('/api/facturas/?omit=cliente_nombre,detalles', False),
+        ):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual('JOIN "clientes_cliente"' in ctx.captured_queries[0]['sql'], join, url)
+
+
+class FacturacionTests(APITestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Ana', email='a@example.com', telefono=1, direccion='Zona 1')
+        self.productos = [
+            Producto.objects.create(nombre_producto=f'Producto {i}', precio=10, color='Rojo', stock=100) for i in range(3)
+        ]
+
+    def crear_pedido(self, lineas=3, estado=Pedido.ESTADO_PENDIENTE):
+        pedido = Pedido.objects.create(cliente=self.cliente, estado=estado)
+        DetallePedido.objects.bulk_create([
+            DetallePedido(pedido=pedido, producto=self.productos[i % 3], cantidad=i + 1, precio_unitario=10, subtotal=10 * (i + 1))
+            for i in range(lineas)
+        ])
+        return pedido
+
+    def test_generar_factura(self):
+        pedido = self.crear_pedido(lineas=3)
+        response = self.client.post(f'/api/pedidos/{pedido.id}/generar-factura/')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(float(response.data['total']), 60)
+        self.assertEqual(response.data['cliente_nombre'], 'Ana')
+        self.assertEqual([d['producto_nombre'] for d in response.data['detalles']], ['Producto 0', 'Producto 1', 'Producto 2'])
+        pedido.refresh_from_db()
+        self.assertEqual(pedido.estado, Pedido.ESTADO_FACTURADO)
+
+        response = self.client.post(f'/api/pedidos/{pedido.id}/generar-factura/')
+        self.assertEqual(response.data['error'], "Este pedido ya ha sido facturado.")
+
+    def test_generar_factura_consultas_constantes(self):
+        conteos = []
+        for lineas in (2, 40):
+            pedido = self.crear_pedido(lineas=lineas)
+            conteos.append(self.count_post_queries(f'/api/pedidos/{pedido.id}/generar-factura/'))
+        self.assertEqual(conteos[0], conteos[1])
+
+    def test_facturar_lote(self):
+        pedidos = [self.crear_pedido(lineas=2) for _ in range(5)]
+        sin_detalles = Pedido.objects.create(cliente=self.cliente)
+        cancelado = self.crear_pedido(estado=Pedido.ESTADO_CANCELADO)
+        self.client.post(f'/api/pedidos/{pedidos[0].id}/generar-factura/')
+
+        response = self.client.post('/api/pedidos/facturar-lote/', {}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(sorted(f['pedido_id'] for f in response.data['facturas']), [p.id for p in pedidos[1:]])
+        self.assertEqual(response.data['errores_detalle'], [
+            {"pedido_id": sin_detalles.id, "error": "El pedido no tiene detalles y no se puede facturar."},
+        ])
+        self.assertEqual(DetalleFactura.objects.count(), 10)
+        self.assertFalse(Factura.objects.filter(pedido=cancelado).exists())
+
+        response = self.client.post('/api/pedidos/facturar-lote/', {"pedido_ids": [cancelado.id, pedidos[1].id]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['errores_detalle']), 2)
+
+    def test_facturar_lote_consultas_constantes(self):
+        for _ in range(3):
+            self.crear_pedido()
+        pocos = self.count_post_queries('/api/pedidos/facturar-lote/', {})
+        for _ in range(30):
+            self.crear_pedido()
+        self.assertEqual(pocos, self.count_post_queries('/api/pedidos/facturar-lote/', {}))
+
+
+class AnaliticaVentasTests(APITestMixin, TestCase):
+    url = '/api/analitica-ventas/'
+
+    def setUp(self):
+        super().setUp()
+        self.ana = Cliente.objects.create(nombre='Ana', email='a@example.com', telefono=1, direccion='Zona 1')
+        self.luis = Cliente.objects.create(nombre='Luis', email='l@example.com', telefono=2, direccion='Zona 2')
+        categoria = Categoria.objects.create(nombre_categoria='Camisas')
+        proveedor = Proveedor.objects.create(nombre_proveedor='Textiles SA')
+        self.camisa = Producto.objects.create(
+            nombre_producto='Camisa', precio=10, color='Blanco', stock=100, categoria=categoria, proveedor=proveedor,
+        )
+        self.gorra = Producto.objects.create(nombre_producto='Gorra', precio=5, color='Negro', stock=100)
+        # Ana: 2 camisas + 1 gorra (25) y 1 camisa (10); Luis: 4 gorras (20)
+        self.facturar([(self.ana, [(self.camisa, 2), (self.gorra, 1)]), (self.ana, [(self.camisa, 1)]), (self.luis, [(self.gorra, 4)])])
+
+    def facturar(self, pedidos):
+        for cliente, lineas in pedidos:
+            pedido = Pedido.objects.create(cliente=cliente)
+            DetallePedido.objects.bulk_create([
+                DetallePedido(pedido=pedido, producto=producto, cantidad=cantidad,
+                              precio_unitario=producto.precio, subtotal=producto.precio * cantidad)
+                for producto, cantidad in lineas
+            ])
+        response = self.client.post('/api/pedidos/facturar-lote/', {}, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+
+    def resumenes(self):
+        return (
+            sorted(VentaDiariaProducto.objects.values_list('fecha', 'producto_id', 'cantidad', 'total')),
+            sorted(VentaDiariaCliente.objects.values_list('fecha', 'cliente_id', 'facturas', 'total')),
+        )
+
+    def test_por_dia_y_por_mes(self):
+        hoy = timezone.localdate()
+        self.assertEqual(self.client.get(self.url + 'por-dia/').json(), [
+            {"fecha": hoy.isoformat(), "facturas": 3, "total": "55.00"},
+        ])
+        self.assertEqual(self.client.get(self.url + 'por-mes/').json(), [
+            {"mes": hoy.strftime('%Y-%m'), "facturas": 3, "total": "55.00"},
+        ])
+
+    def test_rankings(self):
+        self.assertEqual(self.client.get(self.url + 'top-productos/').json(), [
+            {"producto_id": self.camisa.id, "nombre_producto": "Camisa", "cantidad": 3, "total": "30.00"},
+            {"producto_id": self.gorra.id, "nombre_producto": "Gorra", "cantidad": 5, "total": "25.00"},
+        ])
+        self.assertEqual(self.client.get(self.url + 'top-clientes/?limite=1').json(), [
+            {"cliente_id": self.ana.id, "nombre": "Ana", "facturas": 2, "total": "35.00"},
+        ])
+        self.assertEqual(self.client.get(self.url + 'por-categoria/').json(), [
+            {"categoria_id": self.camisa.categoria_id, "nombre_categoria": "Camisas", "cantidad": 3, "total": "30.00"},
+            {"categoria_id": None, "nombre_categoria": None, "cantidad": 5, "total": "25.00"},
+        ])
+        self.assertEqual(self.client.get(self.url + 'por-proveedor/').json()[0]['nombre_proveedor'], 'Textiles SA')
+
+    def test_rango_sin_ventas_y_fechas_invalidas(self):
+        self.assertEqual(self.client.get(self.url + 'por-dia/?desde=2000-01-01&hasta=2000-01-31').json(), [])
+        self.assertEqual(self.client.get(self.url + 'por-dia/?desde=ayer').status_code, 400)
+        self.assertEqual(self.client.get(self.url + 'por-dia/?desde=2000-02-01&hasta=2000-01-01').status_code, 400)
+
+    def test_incremental_coincide_con_recalculo(self):
+        self.facturar([(self.luis, [(self.camisa, 5)])]) # Suma a filas ya existentes
+        incremental = self.resumenes()
+        hoy = timezone.localdate()
+        recalcular_periodo(hoy, hoy)
+        self.assertEqual(self.resumenes(), incremental)
+
+    def test_consultas_no_leen_lineas_de_factura(self):
+        for endpoint in ('por-dia/', 'por-mes/', 'top-productos/', 'top-clientes/', 'por-categoria/', 'por-proveedor/'):
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(self.url + endpoint).status_code, 200)
+            self.assertEqual(len(ctx.captured_queries), 1, endpoint)
+            self.assertNotIn('detallefactura', ctx.captured_queries[0]['sql'].lower(), endpoint)
+
+    def test_borrar_factura_recalcula_el_dia(self):
+        factura = Factura.objects.get(cliente=self.luis)
+        with self.captureOnCommitCallbacks(execute=True): # El recálculo se hace al confirmar
+            self.assertEqual(self.client.delete(f'/api/facturas/{factura.id}/').status_code, 204)
+        self.assertEqual(self.client.get(self.url + 'por-dia/').json()[0]['total'], "35.00")
+        self.assertEqual(self.client.get(self.url + 'top-productos/').json()[1]['cantidad'], 1) # Gorras
+
+    def test_cambiar_fecha_de_emision_recalcula_ambos_dias(self):
+        hoy = timezone.localdate()
+        factura = Factura.objects.get(cliente=self.luis)
+        factura.fecha_emision -= timedelta(days=3)
+        with self.captureOnCommitCallbacks(execute=True):
+            factura.save()
+        self.assertEqual(self.client.get(self.url + 'por-dia/?desde=2000-01-01').json(), [
+            {"fecha": (hoy - timedelta(days=3)).isoformat(), "facturas": 1, "total": "20.00"},
+            {"fecha": hoy.isoformat(), "facturas": 2, "total": "35.00"},
+        ])
+        resumenes = self.resumenes()
+        recalcular_periodo(hoy - timedelta(days=3), hoy)
+        self.assertEqual(self.resumenes(), resumenes)
+
+    def test_un_recalculo_por_transaccion(self):
+        factura = Factura.objects.get(cliente=self.luis)
+        with mock.patch('ventas.signals.recalcular_periodo') as recalcular:
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    for detalle in factura.detalles.all():
+                        detalle.cantidad += 1
+                        detalle.save()
+                    DetalleFactura.objects.create(
+                        factura=factura, producto=self.camisa, cantidad=1, precio_unitario=10, subtotal=10,
+                    )
+                recalcular.assert_not_called() # Nada hasta confirmar
+        hoy = timezone.localdate()
+        recalcular.assert_called_once_with(hoy, hoy)
+
+    def test_comando_recalcula_resumenes(self):
+        esperado = self.resumenes()
+        VentaDiariaProducto.objects.all().delete()
+        VentaDiariaCliente.objects.all().delete()
+        call_command('recalcular_ventas_diarias', stdout=io.StringIO())
+        self.assertEqual(self.resumenes(), esperado)
+
+
+class ExportacionesTests(APITestMixin, TestCase):
+    """Las exportaciones se envían en streaming, por bloques y con filtro de fechas."""
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Ana', email='a@example.com', telefono=1, direccion='Zona 1')
+        self.producto = Producto.objects.create(nombre_producto='Camisa', precio=10, color='Blanco', stock=100)
+        for lineas in (1, 2, 3):
+            pedido = Pedido.objects.create(cliente=self.cliente)
+            DetallePedido.objects.bulk_create([
+                DetallePedido(pedido=pedido, producto=self.producto, cantidad=1, precio_unitario=10, subtotal=10)
+                for _ in range(lineas)
+            ])
+        self.client.post('/api/pedidos/facturar-lote/', {}, format='json')
+
+    def contenido(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8-sig')
+
+    def test_facturas_csv_una_fila_por_linea(self):
+        filas = list(csv.reader(io.StringIO(self.contenido('/api/facturas/exportar/'))))
+        self.assertEqual(filas[0][:2], ['factura_id', 'fecha_emision'])
+        self.assertEqual(len(filas), 1 + 6)
+        self.assertEqual(filas[1][7:], ['Camisa', '1', '10.00', '10.00'])
+
+    def test_facturas_ndjson_por_bloques(self):
+        with mock.patch('Dicaprios.exports.EXPORT_CHUNK_SIZE', 2):
+            response = self.client.get('/api/facturas/exportar/?formato=ndjson&detalle=0')
+            bloques = list(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(bloques), 2)
+        facturas = [json.loads(linea) for linea in b''.join(bloques).decode().splitlines()]
+        self.assertEqual([f['total'] for f in facturas], ['10.00', '20.00', '30.00'])
+        self.assertEqual(facturas[0]['cliente_nombre'], 'Ana')
+
+    def test_filtro_por_fechas(self):
+        hoy = timezone.localdate()
+        self.assertEqual(len(self.contenido(f'/api/facturas/exportar/?formato=ndjson&desde={hoy}&hasta={hoy}').splitlines()), 6)
+        ayer = hoy - timedelta(days=1)
+        self.assertEqual(self.contenido(f'/api/facturas/exportar/?formato=ndjson&hasta={ayer}'), '')
+        self.assertEqual(self.client.get('/api/facturas/exportar/?desde=ayer').status_code, 400)
+
+    def test_pedidos_con_filtros_del_listado(self):
+        Pedido.objects.create(cliente=self.cliente) # Pendiente, sin líneas
+        filas = list(csv.reader(io.StringIO(self.contenido('/api/pedidos/exportar/?estado=Pendiente'))))
+        self.assertEqual(len(filas), 2)
+        self.assertEqual(filas[1][2:], ['Pendiente', str(self.cliente.id), 'Ana'])
+        lineas = self.contenido('/api/pedidos/exportar/?formato=ndjson&detalle=1').splitlines()
+        self.assertEqual(len(lineas), 6)
+
+    def test_formato_no_soportado(self):
+        self.assertEqual(self.client.get('/api/pedidos/exportar/?formato=xlsx').status_code, 400)
+
+
+class ReservaStockTests(APITestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.cliente = Cliente.objects.create(nombre='Ana', email='a@example.com', telefono=1, direccion='Zona 1')
+        self.pedido = Pedido.objects.create(cliente=self.cliente)
+        self.producto = Producto.objects.create(nombre_producto='Camisa', precio=10, color='Blanco', stock=5)
+        self.otro = Producto.objects.create(nombre_producto='Pantalón', precio=20, color='Negro', stock=2)
+
+    def linea(self, producto, cantidad):
+        return {
+            "pedido": self.pedido.id, "producto": producto.id, "cantidad": cantidad,
+            "precio_unitario": "10.00", "subtotal": f"{10 * cantidad}.00",
+        }
+
+    def test_crear_detalle_descuenta_stock(self):
+        response = self.client.post('/api/detalles-pedido/', self.linea(self.producto, 3), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 2)
+
+        response = self.client.post('/api/detalles-pedido/', self.linea(self.producto, 3), format='json')
+        self.assertEqual(response.data, {"error": "Stock insuficiente para el producto seleccionado."})
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 2)
+
+    def test_detalle_invalido_no_descuenta_stock(self):
+        datos = self.linea(self.producto, 1)
+        datos['subtotal'] = 'no-es-numero'
+        self.assertEqual(self.client.post('/api/detalles-pedido/', datos, format='json').status_code, 400)
+        self.producto.refresh_from_db()
+        self.assertEqual(self.producto.stock, 5)
+
+    def test_crear_lote_en_un_update(self):
+        lineas = [self.linea(self.producto, 2), self.linea(self.otro, 2), self.linea(self.producto, 1)]
+        response = self.client.post('/api/detalles-pedido/lote/', lineas, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(Producto.objects.get(id=self.producto.id).stock, 2)
+        self.assertEqual(Producto.objects.get(id=self.otro.id).stock, 0)
+
+    def test_crear_lote_todo_o_nada(self):
+        lineas = [self.linea(self.producto, 2), self.linea(self.otro, 3)]
+        response = self.client.post('/api/detalles-pedido/lote/', lineas, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['productos_sin_stock'], [self.otro.id])
+        self.assertEqual(Producto.objects.get(id=self.producto.id).stock, 5)
+        self.assertFalse(DetallePedido.objects.exists())
+
+
+class ReservaStockConcurrenciaTests(TransactionTestCase):
+    """Cientos de peticiones simultáneas sobre el mismo producto no deben vender más que el stock."""
+    PETICIONES = 200
+    HILOS = 32
+    STOCK = 50
+
+    def setUp(self):
+        self.user = User.objects.create_user('tester', 'tester@example.com', 'clave')
+        cliente = Cliente.objects.create(nombre='Ana', email='a@example.com', telefono=1, direccion='Zona 1')
+        self.pedido = Pedido.objects.create(cliente=cliente)
+        self.producto = Producto.objects.create(nombre_producto='Camisa', precio=10, color='Blanco', stock=self.STOCK)
+
+    def reservar(self, _):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            while True:
+                try:
+                    response = client.post('/api/detalles-pedido/', {
+                        "pedido": self.pedido.id, "producto": self.producto.id, "cantidad": 1,
+                        "precio_unitario": "10.00", "subtotal": "10.00",
+                    }, format='json')
+                    return response.status_code
+                except OperationalError:
+                    # La base SQLite en memoria de los tests no espera a los bloqueos de escritura:
+                    # el cliente reintenta, como haría ante un error 500 transitorio. El error puede
+                    # llegar después del commit, por eso las comprobaciones se hacen sobre la base.
+                    time.sleep(0.001)
+        finally:
+            connection.close() # Cada hilo usa su propia conexión
+
+    def test_sin_sobreventa(self):
+        with ThreadPoolExecutor(max_workers=self.HILOS) as executor:
+            codigos = list(executor.map(self.reservar, range(self.PETICIONES)))
+
+        self.producto.refresh_from_db()
+        creados = DetallePedido.objects.filter(producto=self.producto).count()
+        self.assertEqual(self.producto.stock, 0) # Se vende todo el stock...
+        self.assertEqual(creados, self.STOCK) # ...sin una sola línea de más
+        self.assertLessEqual(codigos.count(201), self.STOCK)
+        self.assertEqual(set(codigos) - {201, 400}, set())
+
+
+class IndicesTests(TestCase):
+    def test_filtro_por_estado_usa_indice(self):
+        plan = Pedido.objects.filter(estado=Pedido.ESTADO_PENDIENTE).order_by('fecha').explain()
+        self.assertIn('pedido_estado_fecha_idx', plan)
+
+
+class DatosSinteticosTests(TestCase):
+    def test_genera_datos_coherentes(self):
+        with mock.patch('ventas.datos_sinteticos.BATCH_SIZE', 16): # Varios bloques
+            resumen = generar_datos(clientes=5, productos=8, pedidos=40, dias=10)
+        self.assertEqual(Cliente.objects.count(), 5)
+        self.assertEqual(Producto.objects.count(), 8)
+        self.assertEqual(Pedido.objects.count(), 40)
+        self.assertEqual(DetallePedido.objects.count(), resumen['lineas_pedido'])
+        self.assertEqual(Factura.objects.count(), resumen['facturas'])
+
+        # Fechas repartidas en el periodo, crecientes con el ID
+        fechas = list(Pedido.objects.order_by('id').values_list('fecha', flat=True))
+        self.assertEqual(fechas, sorted(fechas))
+        self.assertEqual(fechas[0], timezone.localdate() - timedelta(days=9))
+        self.assertEqual(fechas[-1], timezone.localdate())
+
+        # Cada factura corresponde a un pedido facturado y copia sus líneas
+        for factura in Factura.objects.select_related('pedido'):
+            self.assertEqual(factura.pedido.estado, Pedido.ESTADO_FACTURADO)
+            self.assertEqual(timezone.localdate(factura.fecha_emision), factura.pedido.fecha)
+            self.assertEqual(factura.total, factura.pedido.detalles.aggregate(s=Sum('subtotal'))['s'])
+            self.assertEqual(factura.detalles.count(), factura.pedido.detalles.count())
+        self.assertFalse(Pedido.objects.filter(estado=Pedido.ESTADO_FACTURADO, factura__isnull=True).exists())
+
+        # Resúmenes diarios al día
+        self.assertEqual(
+            VentaDiariaCliente.objects.aggregate(s=Sum('total'))['s'], Factura.objects.aggregate(s=Sum('total'))['s']
+        )
+        self.assertEqual(
+            VentaDiariaProducto.objects.aggregate(s=Sum('cantidad'))['s'], DetalleFactura.objects.aggregate(s=Sum('cantidad'))['s']
+        )
+
+    def test_generar_dos_veces_suma_datos(self):
+        generar_datos(clientes=2, productos=2, pedidos=5)
+        generar_datos(clientes=2, productos=2, pedidos=5) # Nombres de proveedor únicos en cada ejecución
+        self.assertEqual(Pedido.objects.count(), 10)
+        self.assertEqual(Cliente.objects.count(), 4)
+
+    def test_comando_rechaza_parametros_invalidos(self):
+        with self.assertRaises(CommandError):
+            call_command('generar_datos_sinteticos', '--pedidos', '5', '--proporcion-facturada', '2', stdout=io.StringIO())
+
+
+class BenchmarkAPITests(TestCase):
+    def test_escalas_sin_modificar_los_datos(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'informe.json')
+            call_command(
+                'benchmark_api', '--escalas', '20,40', '--repeticiones', '2', '--calentamiento', '0',
+                '--output', output, stdout=io.StringIO(),
+            )
+            with open(output) as f:
+                informe = json.load(f)
+
+        self.assertEqual([escala['volumen']['pedidos'] for escala in informe['escalas']], [20, 40])
+        facturas = Factura.objects.count()
+        self.assertEqual(informe['escalas'][-1]['volumen']['facturas'], facturas) # La facturación se revirtió
+        for escala in informe['escalas']:
+            for resultado in escala['resultados']:
+                self.assertNotIn('omitido', resultado)
+                self.assertIn(resultado['estado_http'], (200, 201), resultado['escenario'])
+                self.assertEqual(set(resultado['latencia_ms']), {'p50', 'p95', 'p99', 'mean'})
+        self.assertEqual(informe['consultas_variables'], []) # Sin N+1 entre escalas
+
+
+class ViewSetsNPlusOneTests(APITestMixin, TestCase):
+    """Ningún listado ni detalle de la API repite una consulta por fila."""
+    FILAS = 6
+
+    def setUp(self):
+        super().setUp()
+        categoria = Categoria.objects.create(nombre_categoria='Camisas')
+        proveedor = Proveedor.objects.create(nombre_proveedor='Textiles SA')
+        for i in range(self.FILAS):
+            cliente = Cliente.objects.create(nombre=f'Cliente {i}', email='c@example.com', telefono=1, direccion='Zona 1')
+            Categoria.objects.create(nombre_categoria=f'Categoría {i}')
+            Proveedor.objects.create(nombre_proveedor=f'Proveedor {i}')
+            pedido = Pedido.objects.create(cliente=cliente)
+            factura = Factura.objects.create(cliente=cliente, pedido=pedido, total=20)
+            for j in range(2):
+                producto = Producto.objects.create(
+                    nombre_producto=f'Producto {i}-{j}', precio=10, color='Azul', stock=5, categoria=categoria, proveedor=proveedor,
+                )
+                DetallePedido.objects.create(pedido=pedido, producto=producto, cantidad=1, precio_unitario=10, subtotal=10)
+                DetalleFactura.objects.create(factura=factura, producto=producto, cantidad=1, precio_unitario=10, subtotal=10)
+
+    def test_listados_y_detalles_sin_n_mas_1(self):
+        from Dicaprios.urls import router
+        for prefix, viewset, basename in router.registry:
+            if not hasattr(viewset, 'list'):
+                continue # AnaliticaVentasViewSet: solo acciones agregadas
+            with self.subTest(prefix=prefix):
+                with self.assertNoNPlusOne(threshold=self.FILAS):
+                    response = self.client.get(f'/api/{prefix}/')
+                self.assertEqual(response.status_code, 200)
+                filas = response.json()
+                self.assertGreaterEqual(len(filas), self.FILAS)
+                with self.assertNoNPlusOne(threshold=self.FILAS):
+                    self.assertEqual(self.client.get(f"/api/{prefix}/{filas[0]['id']}/").status_code, 200)
+
+    def test_actualizar_stock_lote_sin_n_mas_1(self):
+        productos = Producto.objects.values_list('id', flat=True)
+        with self.assertNoNPlusOne(threshold=self.FILAS):
+            response = self.client.post(
+                '/api/productos/actualizar-stock-lote/',
+                [{"producto_id": producto_id, "cantidad_a_anadir": 1} for producto_id in productos], format='json',
+            )
+        self.assertEqual(response.status_code, 200)
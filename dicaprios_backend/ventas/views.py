@@ -6,16 +6,23 @@ from .models import DetallePedido
 from .models import Factura
 from .models import DetalleFactura
 from productos.models import Producto
+from productos.stock import reservar_stock, reservar_stock_lote
 from .serializers import PedidoSerializer
-from .serializers import DetallePedidoSerializer
+from .serializers import DetallePedidoSerializer, DetallePedidoLoteSerializer
 from .serializers import FacturaSerializer
 from .serializers import DetalleFacturaSerializer
 from .filters import DetallePedidoFilter
+from .facturacion import facturar_pedidos
+from . import analitica
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from django.db import transaction
 from django.utils import timezone
+from datetime import date, timedelta
+from Dicaprios.viewsets import EagerLoadingViewSetMixin
+from Dicaprios.exports import export_format, date_param, date_range_filter, streaming_export
 
-class PedidoViewSet(viewsets.ModelViewSet):
+class PedidoViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Pedido.objects.all()
     serializer_class = PedidoSerializer
     filter_backends = [DjangoFilterBackend]
@@ -26,58 +33,74 @@ class PedidoViewSet(viewsets.ModelViewSet):
     def generar_factura(self, request, pk=None):
         pedido = self.get_object()
 
-        # 1. Verificar si el pedido ya tiene una factura
-        if Factura.objects.filter(pedido=pedido).exists():
-            return Response(
-                {"error": "Este pedido ya ha sido facturado."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # Total con SUM en la base de datos y líneas con un solo bulk_create (ver ventas/facturacion.py)
+        facturas, errores = facturar_pedidos([pedido.id])
+        if errores:
+            return Response({"error": errores[pedido.id]}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 2. (Opcional) Verificar el estado del pedido antes de facturar
-        # if pedido.estado != Pedido.ESTADO_PENDIENTE: # O el estado que consideres facturable
-        #     return Response(
-        #         {"error": f"Solo los pedidos en estado '{Pedido.ESTADO_PENDIENTE}' pueden ser facturados."},
-        #         status=status.HTTP_400_BAD_REQUEST
-        #     )
-
-        # 3. Crear la Factura
-        total_factura = 0
-        detalles_pedido = pedido.detalles.all()
-
-        if not detalles_pedido.exists():
-            return Response(
-                {"error": "El pedido no tiene detalles y no se puede facturar."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # Serializar y devolver la factura creada (cliente y líneas con su producto en 2 consultas)
+        factura = FacturaSerializer.setup_eager_loading(Factura.objects.filter(pk=facturas[0].pk)).get()
+        factura_serializer = FacturaSerializer(factura)
+        return Response(factura_serializer.data, status=status.HTTP_201_CREATED)
 
-        # Calcular el total basado en los detalles del pedido
-        for detalle_ped in detalles_pedido:
-            total_factura += detalle_ped.subtotal
+    @action(detail=False, methods=['post'], url_path='facturar-lote')
+    @transaction.atomic
+    def facturar_lote(self, request):
+        """
+        Factura muchos pedidos pendientes en una sola transacción (p. ej. el cierre del día).
+        Cuerpo opcional: {"pedido_ids": [1, 2, 3]}. Sin él se facturan todos los pedidos
+        pendientes que aún no tienen factura. Los pedidos que no se pueden facturar se
+        omiten y se devuelven en 'errores_detalle'.
+        """
+        pedido_ids = request.data.get('pedido_ids') if isinstance(request.data, dict) else None
+        if pedido_ids is None:
+            pedido_ids = Pedido.objects.filter(
+                estado=Pedido.ESTADO_PENDIENTE, factura__isnull=True
+            ).values_list('id', flat=True)
+        elif not isinstance(pedido_ids, list):
+            return Response({"error": "'pedido_ids' debe ser una lista de IDs."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            pedido_ids = [int(pedido_id) for pedido_id in pedido_ids]
+        except (TypeError, ValueError):
+            return Response({"error": "Los IDs de pedido deben ser números enteros."}, status=status.HTTP_400_BAD_REQUEST)
 
-        factura = Factura.objects.create(
-            cliente=pedido.cliente,
-            pedido=pedido,
-            fecha_emision=timezone.now(), # Usar timezone.now() para la fecha actual con zona horaria
-            total=total_factura 
-        )
+        facturas, errores = facturar_pedidos(pedido_ids, solo_pendientes=True)
+        return Response({
+            "mensaje": f"Se generaron {len(facturas)} facturas.",
+            "facturas": [
+                {"factura_id": factura.id, "pedido_id": factura.pedido_id, "total": factura.total}
+                for factura in facturas
+            ],
+            "errores_detalle": [
+                {"pedido_id": pedido_id, "error": error} for pedido_id, error in errores.items()
+            ],
+        }, status=status.HTTP_201_CREATED if facturas else status.HTTP_200_OK)
 
-        # 4. Crear los DetalleFactura a partir de los DetallePedido
-        for detalle_ped in detalles_pedido:
-            DetalleFactura.objects.create( # Corregido: DetalleFactura en lugar de DetalleFactrua
-                factura=factura,
-                producto=detalle_ped.producto,
-                cantidad=detalle_ped.cantidad,
-                precio_unitario=detalle_ped.precio_unitario,
-                subtotal=detalle_ped.subtotal
+    @action(detail=False, methods=['get'], url_path='exportar')
+    def exportar(self, request):
+        """
+        Exporta los pedidos en streaming (?formato=csv|ndjson), con los mismos filtros que el
+        listado (?cliente=, ?estado=...) y ?desde=/?hasta= sobre la fecha. Con ?detalle=1 se
+        exporta una fila por línea de pedido (los pedidos sin líneas no aparecen).
+        """
+        formato = export_format(request)
+        pedidos = self.filter_queryset(self.get_queryset()).filter(**date_range_filter(request, 'fecha'))
+        if request.query_params.get('detalle') == '1':
+            lineas = DetallePedido.objects.filter(pedido__in=pedidos.values('id')).order_by('pedido_id', 'id')
+            return streaming_export(
+                lineas,
+                ['pedido_id', 'fecha', 'estado', 'cliente_id', 'cliente_nombre', 'producto_id', 'producto_nombre',
+                 'cantidad', 'precio_unitario', 'subtotal'],
+                ['pedido_id', 'pedido__fecha', 'pedido__estado', 'pedido__cliente_id', 'pedido__cliente__nombre',
+                 'producto_id', 'producto__nombre_producto', 'cantidad', 'precio_unitario', 'subtotal'],
+                formato, 'pedidos_detalle',
             )
-
-        # 5. (Opcional pero Recomendado) Actualizar el estado del pedido a "Facturado"
-        pedido.estado = Pedido.ESTADO_FACTURADO 
-        pedido.save()
-
-        # 6. Serializar y devolver la factura creada
-        factura_serializer = FacturaSerializer(factura) # Asegúrate de tener este serializador
-        return Response(factura_serializer.data, status=status.HTTP_201_CREATED)
+        return streaming_export(
+            pedidos.order_by('id'),
+            ['id', 'fecha', 'estado', 'cliente_id', 'cliente_nombre'],
+            ['id', 'fecha', 'estado', 'cliente_id', 'cliente__nombre'],
+            formato, 'pedidos',
+        )
 
 # Asegúrate de que FacturaSerializer exista y funcione correctamente
 # Si no lo tienes, un ejemplo básico:
@@ -93,35 +116,165 @@ class PedidoViewSet(viewsets.ModelViewSet):
 
     
 
-class DetallePedidoViewSet(viewsets.ModelViewSet):
+class DetallePedidoViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = DetallePedido.objects.all()
     serializer_class = DetallePedidoSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = DetallePedidoFilter
 
     def create(self, request, *args, **kwargs):
-        try:
-            detalle_pedido_data = request.data
-            producto_id = detalle_pedido_data.get('producto')
-            cantidad = int(detalle_pedido_data.get('cantidad'))
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        producto = serializer.validated_data['producto']
+        cantidad = serializer.validated_data['cantidad']
+        if cantidad <= 0:
+            return Response({"error": "La cantidad debe ser mayor que cero."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Verificar y actualizar stock de cada producto
-            producto = Producto.objects.get(id=producto_id)
-            if producto.stock < cantidad:
+        # Reserva e inserción en la misma transacción: si la inserción falla, el stock se restaura
+        with transaction.atomic():
+            # UPDATE ... SET stock = stock - n WHERE stock >= n: sin sobreventa con peticiones concurrentes
+            if not reservar_stock(producto.id, cantidad):
                 return Response({"error": "Stock insuficiente para el producto seleccionado."}, status=status.HTTP_400_BAD_REQUEST)
-            
-            # Actualizar el stock del producto
-            producto.stock -= cantidad
-            producto.save()
+            self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    @action(detail=False, methods=['post'], url_path='lote')
+    def crear_lote(self, request):
+        """
+        Crea todas las líneas de un pedido reservando su stock en un único UPDATE.
+        Cuerpo: lista de detalles con el mismo formato que la creación individual.
+        Es todo o nada: si algún producto no tiene stock suficiente no se crea ninguna línea.
+        """
+        serializer = DetallePedidoLoteSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        lineas = serializer.validated_data
+        if not lineas:
+            return Response({"error": "No se proporcionaron detalles."}, status=status.HTTP_400_BAD_REQUEST)
 
-            return super().create(request, *args, **kwargs)
-        except ValueError as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        # Validar pedidos y productos con una consulta cada uno, no una por línea
+        pedido_ids = {linea['pedido'] for linea in lineas}
+        producto_ids = {linea['producto'] for linea in lineas}
+        pedidos_faltantes = pedido_ids - set(Pedido.objects.filter(id__in=pedido_ids).values_list('id', flat=True))
+        productos_faltantes = producto_ids - set(Producto.objects.filter(id__in=producto_ids).values_list('id', flat=True))
+        if pedidos_faltantes or productos_faltantes:
+            return Response({
+                "error": "Hay pedidos o productos que no existen.",
+                "pedidos_no_encontrados": sorted(pedidos_faltantes),
+                "productos_no_encontrados": sorted(productos_faltantes),
+            }, status=status.HTTP_400_BAD_REQUEST)
 
-class FacturaViewSet(viewsets.ModelViewSet):
+        cantidades = {}
+        for linea in lineas:
+            cantidades[linea['producto']] = cantidades.get(linea['producto'], 0) + linea['cantidad']
+
+        with transaction.atomic():
+            sin_stock = reservar_stock_lote(cantidades)
+            if sin_stock:
+                return Response({
+                    "error": "Stock insuficiente para algunos productos. No se creó ningún detalle.",
+                    "productos_sin_stock": sin_stock,
+                }, status=status.HTTP_400_BAD_REQUEST)
+            detalles = DetallePedido.objects.bulk_create([
+                DetallePedido(
+                    pedido_id=linea['pedido'],
+                    producto_id=linea['producto'],
+                    cantidad=linea['cantidad'],
+                    precio_unitario=linea['precio_unitario'],
+                    subtotal=linea['subtotal'],
+                )
+                for linea in lineas
+            ])
+        return Response(DetallePedidoSerializer(detalles, many=True).data, status=status.HTTP_201_CREATED)
+
+class FacturaViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = Factura.objects.all()
     serializer_class = FacturaSerializer
 
-class DetalleFacturaViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'], url_path='exportar')
+    def exportar(self, request):
+        """
+        Exporta el histórico de facturas en streaming (?formato=csv|ndjson), una fila por línea
+        de factura con los datos de su cabecera, filtrado por ?desde=/?hasta= sobre la fecha de
+        emisión. Con ?detalle=0 se exporta solo una fila por factura.
+        """
+        formato = export_format(request)
+        rango = date_range_filter(request, 'fecha_emision', es_datetime=True)
+        if request.query_params.get('detalle') == '0':
+            return streaming_export(
+                Factura.objects.filter(**rango).order_by('id'),
+                ['id', 'fecha_emision', 'cliente_id', 'cliente_nombre', 'pedido_id', 'total'],
+                ['id', 'fecha_emision', 'cliente_id', 'cliente__nombre', 'pedido_id', 'total'],
+                formato, 'facturas',
+            )
+        lineas = DetalleFactura.objects.filter(**{f'factura__{campo}': valor for campo, valor in rango.items()})
+        return streaming_export(
+            lineas.order_by('factura_id', 'id'),
+            ['factura_id', 'fecha_emision', 'cliente_id', 'cliente_nombre', 'pedido_id', 'total_factura',
+             'producto_id', 'producto_nombre', 'cantidad', 'precio_unitario', 'subtotal'],
+            ['factura_id', 'factura__fecha_emision', 'factura__cliente_id', 'factura__cliente__nombre',
+             'factura__pedido_id', 'factura__total', 'producto_id', 'producto__nombre_producto',
+             'cantidad', 'precio_unitario', 'subtotal'],
+            formato, 'facturas_detalle',
+        )
+
+class DetalleFacturaViewSet(EagerLoadingViewSetMixin, viewsets.ModelViewSet):
     queryset = DetalleFactura.objects.all()
     serializer_class = DetalleFacturaSerializer
+
+
+class AnaliticaVentasViewSet(viewsets.ViewSet):
+    """
+    Agregados de ventas para el panel, calculados sobre los resúmenes diarios
+    (ver ventas/analitica.py). Parámetros: ?desde=AAAA-MM-DD&hasta=AAAA-MM-DD
+    (por defecto los últimos DIAS_POR_DEFECTO días; 12 meses en por-mes) y, en los
+    rankings, ?limite= (por defecto 10, máximo LIMITE_MAXIMO).
+    """
+    DIAS_POR_DEFECTO = 30
+    LIMITE_MAXIMO = 100
+
+    def _fecha(self, nombre, por_defecto):
+        return date_param(self.request, nombre) or por_defecto
+
+    def _rango(self, dias=None):
+        hasta = self._fecha('hasta', timezone.localdate())
+        desde = self._fecha('desde', hasta - timedelta(days=(dias or self.DIAS_POR_DEFECTO) - 1))
+        if desde > hasta:
+            raise ValidationError({"desde": "'desde' no puede ser posterior a 'hasta'."})
+        return desde, hasta
+
+    def _limite(self):
+        try:
+            limite = int(self.request.query_params.get('limite', 10))
+        except ValueError:
+            raise ValidationError({"limite": "Debe ser un número entero."})
+        return max(1, min(limite, self.LIMITE_MAXIMO))
+
+    @action(detail=False, methods=['get'], url_path='por-dia')
+    def por_dia(self, request):
+        return Response(analitica.ventas_por_dia(*self._rango()))
+
+    @action(detail=False, methods=['get'], url_path='por-mes')
+    def por_mes(self, request):
+        hasta = self._fecha('hasta', timezone.localdate())
+        mes = hasta.year * 12 + hasta.month - 1 - 11 # Primer día del mes de hace 11 meses
+        desde = self._fecha('desde', date(mes // 12, mes % 12 + 1, 1))
+        if desde > hasta:
+            raise ValidationError({"desde": "'desde' no puede ser posterior a 'hasta'."})
+        return Response(analitica.ventas_por_mes(desde, hasta))
+
+    @action(detail=False, methods=['get'], url_path='top-productos')
+    def top_productos(self, request):
+        return Response(analitica.top_productos(*self._rango(), self._limite()))
+
+    @action(detail=False, methods=['get'], url_path='top-clientes')
+    def top_clientes(self, request):
+        return Response(analitica.top_clientes(*self._rango(), self._limite()))
+
+    @action(detail=False, methods=['get'], url_path='por-categoria')
+    def por_categoria(self, request):
+        return Response(analitica.ventas_por_categoria(*self._rango()))
+
+    @action(detail=False, methods=['get'], url_path='por-proveedor')
+    def por_proveedor(self, request):
+        return Response(analitica.ventas_por_proveedor(*self._rango()))
@@ -0,0 +1,106 @@
+# dicaprios_backend/visual_searcher/admission.py
+"""
+Control de admisión de la búsqueda visual asíncrona.
+
+Cada búsqueda ocupa un hueco mientras decodifica, infiere y busca. Con `max_active`
+búsquedas en curso, las siguientes esperan en una cola de como máximo `max_queue`
+peticiones y `queue_timeout` segundos; si la cola está llena o la espera se agota, la
+vista responde 503 con Retry-After en vez de acumular trabajo. Así la cola de
+inferencia no crece sin límite en una ráfaga y el resto de la API (catálogo, ventas)
+conserva su latencia.
+
+No depende de un bucle de eventos concreto: el estado se protege con un threading.Lock
+y el hueco liberado se entrega al bucle de la petición en espera con
+call_soon_threadsafe. Así funciona igual con varios bucles (tests, async_to_sync).
+"""
+import asyncio
+import threading
+from collections import deque
+
+
+class AdmissionController:
+    """Limita las búsquedas en curso y las que esperan turno."""
+
+    def __init__(self, max_active, max_queue, queue_timeout=None):
+        self.max_active = max(1, max_active)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout # Segundos (None: sin límite)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque() # (bucle, future) de las peticiones en cola, por orden de llegada
+        # Estadísticas para el endpoint de salud
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self):
+        """
+        Espera un hueco. Devuelve True si la petición puede continuar (y debe llamar a
+        `release` al terminar) o False si la cola está llena o se agotó la espera.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active < self.max_active and not self._waiters:
+                self._active += 1
+                self.admitted += 1
+                return True
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                return False
+            waiter = loop.create_future()
+            self._waiters.append((loop, waiter))
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._discard(loop, waiter)
+                self.timed_out += 1
+            return False
+        except BaseException:
+            # Petición cancelada (p. ej. el cliente cerró la conexión) mientras esperaba
+            with self._lock:
+                self._discard(loop, waiter)
+            if waiter.done() and not waiter.cancelled():
+                self.release() # Ya se le había entregado el hueco
+            raise
+        with self._lock:
+            self.admitted += 1
+        return True
+
+    def release(self):
+        """Libera el hueco de una petición admitida: pasa a la primera en cola, si la hay."""
+        with self._lock:
+            if not self._waiters:
+                self._active -= 1
+                return
+            loop, waiter = self._waiters.popleft()
+        # El hueco pasa directamente a la petición en espera (_active no cambia)
+        try:
+            loop.call_soon_threadsafe(self._grant, waiter)
+        except RuntimeError: # Bucle cerrado: la petición ya no existe
+            self.release()
+
+    def _grant(self, waiter):
+        if waiter.done(): # Se agotó su espera justo antes: el hueco pasa a la siguiente
+            self.release()
+        else:
+            waiter.set_result(True)
+
+    def _discard(self, loop, waiter):
+        try:
+            self._waiters.remove((loop, waiter))
+        except ValueError:
+            pass # release() ya la había sacado de la cola
+
+    def stats(self):
+        with self._lock:
+            return {
+                "active": self._active,
+                "queued": len(self._waiters),
+                "max_active": self.max_active,
+                "max_queue": self.max_queue,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+            }
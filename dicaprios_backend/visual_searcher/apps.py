@@ -1,6 +1,31 @@
+import os
+import sys
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+def _should_warm_up():
+    """
+    Solo se calienta el modelo en procesos que atienden peticiones: no en comandos de
+    manage.py (migrate, test, generate_image_embeddings...) ni en el proceso vigilante
+    del autorecargador de runserver.
+    """
+    if not getattr(settings, 'VISUAL_SEARCH_EAGER_WARMUP', True):
+        return False
+    if os.path.basename(sys.argv[0]) == 'manage.py' and len(sys.argv) > 1:
+        if sys.argv[1] != 'runserver':
+            return False
+        return os.environ.get('RUN_MAIN') == 'true' or '--noreload' in sys.argv
+    return True
 
 
 class VisualSearcherConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'visual_searcher'
+
+    def ready(self):
+        if _should_warm_up():
+            # Carga el modelo y el índice en segundo plano para que la primera búsqueda no espere
+            from .views import start_warm_up
+            start_warm_up()
@@ -0,0 +1,129 @@
+# dicaprios_backend/visual_searcher/backends.py
+"""
+Motores de inferencia del extractor de características ResNet50.
+
+- 'keras': ResNet50 de tensorflow.keras (referencia, siempre disponible si TensorFlow lo está).
+- 'onnx': modelo exportado a ONNX y ejecutado con ONNX Runtime en CPU.
+- 'tflite': modelo exportado a TensorFlow Lite (tflite_runtime o tf.lite).
+
+Todos reciben un lote ya preprocesado con `preprocess_resnet50` (N, 224, 224, 3)
+float32 y devuelven (N, 2048). Los modelos ONNX/TFLite se generan con el comando
+`export_visual_model`, que comprueba que sus embeddings no se alejan de los de
+Keras más de una tolerancia de coseno; así el índice existente sigue siendo válido.
+
+Si el motor configurado no está instalado o su modelo no se ha exportado, se usa
+Keras como respaldo.
+"""
+import logging
+import os
+
+from django.conf import settings
+
+from .preprocessing import IMG_WIDTH, IMG_HEIGHT
+
+logger = logging.getLogger(__name__)
+
+BACKEND_KERAS = 'keras'
+BACKEND_ONNX = 'onnx'
+BACKEND_TFLITE = 'tflite'
+INFERENCE_BACKENDS = (BACKEND_KERAS, BACKEND_ONNX, BACKEND_TFLITE)
+
+MODELS_DIR = os.path.join(settings.MEDIA_ROOT, 'ia_models')
+MODEL_FILES = {
+    BACKEND_ONNX: 'resnet50_features{suffix}.onnx',
+    BACKEND_TFLITE: 'resnet50_features{suffix}.tflite',
+}
+QUANTIZED_SUFFIX = '_int8'
+
+
+def model_path(backend, quantized=False):
+    """Ruta del modelo exportado para `backend`."""
+    return os.path.join(MODELS_DIR, MODEL_FILES[backend].format(suffix=QUANTIZED_SUFFIX if quantized else ''))
+
+
+def build_keras_resnet50():
+    """ResNet50 sin la capa de clasificación y con pooling medio global (vector de 2048)."""
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+    from tensorflow.keras.applications.resnet50 import ResNet50
+    return ResNet50(weights='imagenet', include_top=False, pooling='avg', input_shape=(IMG_WIDTH, IMG_HEIGHT, 3))
+
+
+class KerasEmbedder:
+    name = BACKEND_KERAS
+
+    def __init__(self, num_threads=None):
+        if num_threads:
+            import tensorflow as tf
+            try:
+                tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+                tf.config.threading.set_inter_op_parallelism_threads(1)
+            except RuntimeError:
+                pass # TensorFlow ya estaba inicializado en este proceso
+        self.model = build_keras_resnet50()
+
+    def predict_batch(self, batch):
+        return self.model.predict_on_batch(batch)
+
+
+class OnnxEmbedder:
+    name = BACKEND_ONNX
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict_batch(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class TFLiteEmbedder:
+    name = BACKEND_TFLITE
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def predict_batch(self, batch):
+        # El intérprete tiene tamaño de lote fijo: se redimensiona solo cuando cambia
+        if batch.shape[0] != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch.shape[0]
+        self.interpreter.set_tensor(self.input_index, batch)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index).copy()
+
+
+def build_embedder(backend=BACKEND_KERAS, quantized=False, num_threads=None):
+    """
+    Crea el motor de inferencia indicado. Si no está instalado o falta el modelo
+    exportado, avisa y usa Keras. Lanza ImportError si tampoco hay TensorFlow.
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Motor de inferencia desconocido: {backend}. Opciones: {', '.join(INFERENCE_BACKENDS)}.")
+    if backend != BACKEND_KERAS:
+        path = model_path(backend, quantized)
+        if not os.path.exists(path):
+            logger.warning("Modelo %s no encontrado en %s. Ejecuta 'export_visual_model'. Se usará Keras.", backend, path)
+        else:
+            try:
+                if backend == BACKEND_ONNX:
+                    return OnnxEmbedder(path, num_threads)
+                return TFLiteEmbedder(path, num_threads)
+            except ImportError as e:
+                logger.warning("El motor %s no está instalado (%s). Se usará Keras.", backend, e)
+    return KerasEmbedder(num_threads)
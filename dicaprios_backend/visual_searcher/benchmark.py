@@ -0,0 +1,294 @@
+# dicaprios_backend/visual_searcher/benchmark.py
+"""
+Utilidades de benchmark del buscador visual (ver el comando 'benchmark_visual_search').
+
+- Catálogos sintéticos de embeddings agrupados en clústeres (como productos parecidos
+  entre sí) y consultas que son copias con ruido de filas del catálogo.
+- Vecinos exactos por bloques (verdad de referencia para el recall@K).
+- Medición de cada configuración de índice: tiempo de construcción, memoria, latencia
+  p50/p95/p99 de una consulta y recall@K frente a la búsqueda exacta.
+- Recorrido completo de una petición a VisualSearchAPIView con un modelo sustituto,
+  desglosando el tiempo por etapa.
+"""
+import io
+import os
+import platform
+import time
+import tracemalloc
+from unittest import mock
+
+import numpy as np
+from PIL import Image
+
+from .vector_index import (
+    normalize_embeddings, quantize_embeddings, StoredEmbeddings, FlatIndex, IVFIndex, INDEX_IVF,
+)
+
+GENERATION_CHUNK_SIZE = 65536 # Filas generadas o comparadas por bloque (limita la memoria temporal)
+ROWS_PER_CLUSTER = 20 # Filas parecidas por clúster; con menos, los K vecinos se reparten entre clústeres y el recall de IVF baja
+CLUSTER_SPREAD = 1.0 # Ruido de cada fila respecto a su centro (norma relativa)
+QUERY_NOISE = 0.3 # Ruido de la consulta respecto a su fila de origen (similitud ≈ 0.96)
+
+
+def _unit_noise(rng, shape):
+    """Ruido gaussiano con norma ≈ 1 por fila."""
+    return rng.standard_normal(shape, dtype=np.float32) / np.sqrt(np.float32(shape[-1]))
+
+
+def synthetic_catalog(n, dim=2048, seed=0, rows_per_cluster=ROWS_PER_CLUSTER):
+    """Matriz (n, dim) float32 normalizada, con ≈ n / rows_per_cluster clústeres."""
+    rng = np.random.default_rng(seed)
+    centers = normalize_embeddings(rng.standard_normal((max(1, n // rows_per_cluster), dim), dtype=np.float32))
+    embeddings = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, GENERATION_CHUNK_SIZE):
+        end = min(start + GENERATION_CHUNK_SIZE, n)
+        block = centers[rng.integers(0, centers.shape[0], end - start)]
+        block += CLUSTER_SPREAD * _unit_noise(rng, block.shape)
+        embeddings[start:end] = normalize_embeddings(block)
+    return embeddings
+
+
+def synthetic_queries(embeddings, n_queries, seed=1):
+    """Consultas: filas del catálogo con ruido (una foto del producto, no la imagen indexada)."""
+    rng = np.random.default_rng(seed)
+    sources = rng.integers(0, embeddings.shape[0], n_queries)
+    queries = np.asarray(embeddings[sources], dtype=np.float32)
+    return normalize_embeddings(queries + QUERY_NOISE * _unit_noise(rng, queries.shape))
+
+
+def exact_neighbours(embeddings, queries, k):
+    """Filas de los k vecinos exactos de cada consulta, calculadas por bloques de filas."""
+    best_scores = best_rows = None
+    for start in range(0, embeddings.shape[0], GENERATION_CHUNK_SIZE):
+        scores = queries @ np.asarray(embeddings[start:start + GENERATION_CHUNK_SIZE], dtype=np.float32).T
+        block_k = min(k, scores.shape[1])
+        rows = np.argpartition(-scores, block_k - 1, axis=1)[:, :block_k]
+        scores = np.take_along_axis(scores, rows, axis=1)
+        rows += start
+        if best_scores is not None:
+            scores = np.concatenate((best_scores, scores), axis=1)
+            rows = np.concatenate((best_rows, rows), axis=1)
+        keep = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        best_scores = np.take_along_axis(scores, keep, axis=1)
+        best_rows = np.take_along_axis(rows, keep, axis=1)
+    return best_rows
+
+
+def recall_at_k(found, truth):
+    """Fracción media de los vecinos exactos que aparecen en los resultados."""
+    k = truth.shape[1]
+    return float(np.mean([len(set(f[:k]) & set(t)) / k for f, t in zip(found, truth)]))
+
+
+def latency_summary(timings_ms):
+    timings = np.asarray(timings_ms, dtype=np.float64)
+    p50, p95, p99 = np.percentile(timings, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 4),
+        "p95": round(float(p95), 4),
+        "p99": round(float(p99), 4),
+        "mean": round(float(timings.mean()), 4),
+    }
+
+
+def _nbytes(*arrays):
+    return int(sum(array.nbytes for array in arrays if array is not None))
+
+
+def build_index(embeddings, index_type, storage_dtype='float32', nprobe=None, rescore_factor=0, nlist=None):
+    """Construye el índice como lo haría 'generate_image_embeddings' + LoadedSearchIndex."""
+    if storage_dtype == 'float32':
+        matrix = StoredEmbeddings(embeddings)
+    else:
+        data, scales = quantize_embeddings(embeddings, storage_dtype)
+        matrix = StoredEmbeddings(data, scales, exact=embeddings if rescore_factor else None)
+    if index_type == INDEX_IVF:
+        trained = IVFIndex.build(embeddings, nlist=nlist)
+        kwargs = {'nprobe': nprobe} if nprobe else {}
+        return IVFIndex(matrix, trained.centroids, trained.assignments, rescore_factor=rescore_factor, **kwargs)
+    return FlatIndex(matrix, rescore_factor=rescore_factor)
+
+
+def index_memory_bytes(index):
+    """Memoria que ocupa el índice en un proceso (matriz recorrida, copia exacta y listas IVF)."""
+    matrix = index.matrix
+    total = _nbytes(matrix.data, matrix.scales)
+    if index.rescore_factor and matrix.exact is not None:
+        total += _nbytes(matrix.exact)
+    if isinstance(index, IVFIndex):
+        total += _nbytes(index.centroids, index.assignments, index.list_rows, index.list_offsets)
+    return total
+
+
+def benchmark_index(embeddings, queries, truth, index_type, storage_dtype='float32', nprobe=None,
+                    rescore_factor=0, nlist=None, k=10):
+    """Construye un índice y mide construcción, memoria, latencia y recall@k."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = build_index(embeddings, index_type, storage_dtype, nprobe, rescore_factor, nlist)
+    build_seconds = time.perf_counter() - start
+    _, peak_build_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    index.search(queries[0], k=k) # Calentamiento (cachés del procesador y páginas)
+    timings, found = [], []
+    for query in queries:
+        start = time.perf_counter()
+        _, rows = index.search(query, k=k)
+        timings.append((time.perf_counter() - start) * 1000)
+        found.append(rows)
+
+    result = {
+        "rows": int(embeddings.shape[0]),
+        "dim": int(embeddings.shape[1]),
+        "index": index_type,
+        "storage": storage_dtype,
+        "rescore_factor": rescore_factor,
+        "k": k,
+        "build_seconds": round(build_seconds, 4),
+        "index_bytes": index_memory_bytes(index),
+        "peak_build_bytes": int(peak_build_bytes),
+        "latency_ms": latency_summary(timings),
+        "qps": round(len(timings) / (sum(timings) / 1000), 1),
+        "recall_at_k": round(recall_at_k(found, truth), 4),
+    }
+    if isinstance(index, IVFIndex):
+        result.update({"nlist": index.nlist, "nprobe": index.nprobe})
+    return result
+
+
+# --- Recorrido completo de la petición con un modelo sustituto ---
+
+class StubEmbedder:
+    """
+    Sustituye a ResNet50: devuelve, en orden, los embeddings de consulta indicados.
+    Solo cuenta el tiempo de la llamada, así que el desglose mide el resto de la petición.
+    """
+    name = 'stub'
+
+    def __init__(self, query_embeddings):
+        self.query_embeddings = query_embeddings
+        self.calls = 0
+
+    def predict_batch(self, batch):
+        rows = [self.query_embeddings[(self.calls + i) % len(self.query_embeddings)] for i in range(batch.shape[0])]
+        self.calls += batch.shape[0]
+        return np.stack(rows)
+
+
+class _SyntheticSearchIndex:
+    """Equivalente a views.LoadedSearchIndex sobre un índice en memoria, sin filtros de filas."""
+
+    def __init__(self, index, product_ids):
+        from .filters import ProductRowFilters
+        self.version = -1
+        self.index = index
+        self.product_ids = product_ids
+        self.row_filters = ProductRowFilters(product_ids)
+        self.row_filters.built_at = float('inf') # Nunca caducan: no se consultan atributos de la BD
+
+
+def synthetic_jpeg(width=640, height=480, seed=0):
+    """Foto JPEG sintética para las peticiones."""
+    rng = np.random.default_rng(seed)
+    pixels = rng.integers(0, 256, (height // 8, width // 8, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).resize((width, height), Image.BILINEAR).save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+class _StageTimer:
+    """Envuelve funciones y acumula su tiempo por etapa."""
+
+    def __init__(self):
+        self.totals = {}
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.totals[stage] = self.totals.get(stage, 0.0) + (time.perf_counter() - start) * 1000
+        return timed
+
+
+def benchmark_request_path(index, product_ids, query_embeddings, requests=100, k=10, image=None, user=None, profiler=None):
+    """
+    Envía `requests` peticiones a VisualSearchAPIView (en el mismo proceso, sin red) con el
+    modelo sustituido por StubEmbedder y el índice indicado. Devuelve la latencia total y
+    el tiempo medio por etapa: decodificación, preprocesado, inferencia, búsqueda y resto
+    (consulta de productos, serialización y DRF).
+    """
+    from django.contrib.auth.models import User
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from rest_framework.test import APIRequestFactory, force_authenticate
+    from . import views
+
+    user = user or User(username='benchmark') # Sin guardar: basta para IsAuthenticated
+
+    image = image or synthetic_jpeg()
+    stub = StubEmbedder(query_embeddings)
+    stages = _StageTimer()
+    stub.predict_batch = stages.wrap('inference', stub.predict_batch)
+    search_index = _SyntheticSearchIndex(index, product_ids)
+    index.search = stages.wrap('search', index.search)
+    factory = APIRequestFactory()
+    view = views.VisualSearchAPIView.as_view()
+
+    patched = {
+        'IA_COMPONENTS_LOADED': True,
+        'RESNET_MODEL_INSTANCE': stub,
+        'INFERENCE_SERVICE': None, # Inferencia directa: la agrupación dinámica solo añade espera con una petición a la vez
+        'EMBEDDING_CACHE': None, # Cada petición recorre el camino completo
+        'SEARCH_INDEX': search_index,
+        '_index_checked_at': float('inf'), # No cargar la versión del disco durante el benchmark
+        'load_image_array': stages.wrap('decode', views.load_image_array),
+        'preprocess_resnet50': stages.wrap('preprocess', views.preprocess_resnet50),
+    }
+    timings, status_codes = [], {}
+    try:
+        with mock.patch.multiple(views, **patched):
+            for i in range(requests + 1):
+                request = factory.post(
+                    '/api/visual-search/', {'image': SimpleUploadedFile('consulta.jpg', image, 'image/jpeg'), 'k': k},
+                    format='multipart', HTTP_HOST='localhost', # Permitido por ALLOWED_HOSTS con DEBUG
+                )
+                force_authenticate(request, user=user)
+                if i == 0:
+                    view(request) # Calentamiento
+                    stages.totals.clear()
+                    continue
+                if profiler is not None:
+                    profiler.enable()
+                start = time.perf_counter()
+                response = view(request)
+                timings.append((time.perf_counter() - start) * 1000)
+                if profiler is not None:
+                    profiler.disable()
+                status_codes[response.status_code] = status_codes.get(response.status_code, 0) + 1
+    finally:
+        del index.search # Quitar el envoltorio de la instancia
+
+    stage_ms = {stage: round(total / requests, 4) for stage, total in stages.totals.items()}
+    mean_ms = float(np.mean(timings))
+    stage_ms['other'] = round(max(0.0, mean_ms - sum(stage_ms.values())), 4)
+    return {
+        "requests": requests,
+        "k": k,
+        "rows": int(index.ntotal),
+        "index": index.index_type,
+        "latency_ms": latency_summary(timings),
+        "stage_mean_ms": stage_ms,
+        "status_codes": {str(code): count for code, count in sorted(status_codes.items())},
+    }
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor() or None,
+        "cpu_count": os.cpu_count(),
+    }
@@ -0,0 +1,93 @@
+# dicaprios_backend/visual_searcher/embedding_cache.py
+"""
+Caché de embeddings de imágenes de consulta.
+
+La clave es el hash SHA-256 de los bytes subidos, el motor de inferencia y la versión del índice activa:
+si el mismo archivo se vuelve a subir (reintentos del frontend, fotos repetidas)
+se reutiliza su embedding sin volver a ejecutar ResNet50, y al publicarse una
+versión nueva del índice las entradas anteriores dejan de usarse y caducan solas.
+
+Usa el framework de caché de Django (alias VISUAL_SEARCH_CACHE_ALIAS). Con
+LocMemCache cada proceso tiene su propia caché LRU limitada por MAX_ENTRIES; con
+Redis o Memcached la comparten todos los workers. El tamaño y la caducidad se
+configuran en CACHES (MAX_ENTRIES / TIMEOUT).
+
+Los aciertos y fallos se cuentan en memoria en cada proceso: contarlos en la propia
+caché costaría dos viajes más al backend por consulta.
+"""
+import hashlib
+import logging
+import threading
+import numpy as np
+
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'visual_search:embedding'
+
+
+def image_digest(file_obj):
+    """SHA-256 del contenido del archivo subido. Deja el archivo al principio."""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    for chunk in file_obj.chunks():
+        digest.update(chunk)
+    file_obj.seek(0)
+    return digest.hexdigest()
+
+
+class QueryEmbeddingCache:
+    """Embeddings float32 de consultas indexados por (versión del índice, hash de la imagen)."""
+
+    def __init__(self, alias='default', timeout=None):
+        self.alias = alias
+        self.timeout = timeout # None: el TIMEOUT del alias en CACHES
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _key(self, index_version, digest, model_name):
+        return f'{KEY_PREFIX}:{model_name}:v{index_version}:{digest}'
+
+    def get(self, index_version, digest, model_name=''):
+        """Devuelve el embedding guardado o None. Cuenta aciertos y fallos."""
+        try:
+            data = self.cache.get(self._key(index_version, digest, model_name))
+        except Exception as e:
+            # La caché es solo una optimización: si el backend falla se calcula el embedding
+            logger.warning("Caché de embeddings no disponible: %s", e)
+            return None
+        with self._lock:
+            if data is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if data is None:
+            return None
+        return np.frombuffer(data, dtype=np.float32)
+
+    def set(self, index_version, digest, embedding, model_name=''):
+        try:
+            kwargs = {} if self.timeout is None else {'timeout': self.timeout}
+            self.cache.set(
+                self._key(index_version, digest, model_name), np.asarray(embedding, dtype=np.float32).tobytes(), **kwargs
+            )
+        except Exception as e:
+            logger.warning("No se pudo guardar el embedding en caché: %s", e)
+
+    def stats(self):
+        """Aciertos, fallos y tasa de acierto acumulados en este proceso."""
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "backend": self.cache.__class__.__name__,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / total, 4) if total else None,
+        }
@@ -0,0 +1,94 @@
+# dicaprios_backend/visual_searcher/filters.py
+"""
+Máscaras booleanas precalculadas sobre las filas de la matriz de embeddings.
+
+Permiten filtrar la búsqueda visual por categoría, proveedor, talla o stock
+dentro del propio índice (una entrada por fila), sin post-filtrar en Python.
+"""
+import time
+import numpy as np
+
+from productos.models import Producto
+
+
+class ProductRowFilters:
+    """
+    Máscaras por valor de atributo, alineadas con el array de IDs de productos.
+    `build()` rellena el objeto atributo a atributo: una vez publicado no se reconstruye,
+    se sustituye por uno nuevo (ver views._refresh_row_filters).
+    """
+
+    def __init__(self, product_ids, live_mask=None):
+        self.product_ids = product_ids
+        self.live_mask = live_mask # Filas vigentes del índice (sin tombstones)
+        self.built_at = 0.0
+        self.categoria_masks = {}
+        self.proveedor_masks = {}
+        self.talla_masks = {}
+        self.in_stock_mask = None
+        self.known_mask = None
+        self.all_known = True
+
+    def build(self):
+        """Lee los atributos de todos los productos indexados con una sola consulta."""
+        n = self.product_ids.shape[0]
+        # Si un producto tiene varias filas (imagen actualizada), la última es la vigente
+        row_of_id = {int(product_id): row for row, product_id in enumerate(self.product_ids.tolist())}
+        categorias = np.full(n, -1, dtype=np.int64)
+        proveedores = np.full(n, -1, dtype=np.int64)
+        tallas = np.full(n, '', dtype=object)
+        stock = np.zeros(n, dtype=np.int64)
+        known = np.zeros(n, dtype=bool)  # Filas cuyo producto sigue existiendo en la BD
+
+        # Se recorre la tabla completa en vez de un id__in con miles de parámetros
+        rows = Producto.objects.values_list('id', 'categoria_id', 'proveedor_id', 'talla', 'stock')
+        for product_id, categoria_id, proveedor_id, talla, stock_actual in rows.iterator(chunk_size=2000):
+            row = row_of_id.get(product_id)
+            if row is None:
+                continue # Producto sin embedding
+            categorias[row] = categoria_id if categoria_id is not None else -1
+            proveedores[row] = proveedor_id if proveedor_id is not None else -1
+            tallas[row] = (talla or '').strip().lower()
+            stock[row] = stock_actual
+            known[row] = True
+        if self.live_mask is not None:
+            known &= self.live_mask
+
+        self.categoria_masks = {int(v): categorias == v for v in np.unique(categorias) if v != -1}
+        self.proveedor_masks = {int(v): proveedores == v for v in np.unique(proveedores) if v != -1}
+        self.talla_masks = {v: tallas == v for v in set(tallas) if v}
+        self.in_stock_mask = stock > 0
+        self.known_mask = known
+        self.all_known = bool(known.all())
+        self.built_at = time.monotonic()
+        return self
+
+    def is_stale(self, max_age_seconds):
+        return time.monotonic() - self.built_at > max_age_seconds
+
+    def mask(self, categoria_id=None, proveedor_id=None, talla=None, in_stock=False):
+        """
+        Combina (AND) las máscaras de los filtros indicados.
+        Devuelve None si no se pidió ningún filtro.
+        """
+        masks = []
+        if categoria_id is not None:
+            masks.append(self.categoria_masks.get(categoria_id))
+        if proveedor_id is not None:
+            masks.append(self.proveedor_masks.get(proveedor_id))
+        if talla:
+            masks.append(self.talla_masks.get(talla.strip().lower()))
+        if in_stock:
+            masks.append(self.in_stock_mask)
+        if not self.all_known:
+            # Excluir filas eliminadas del índice o de productos borrados después de generar los embeddings
+            masks.append(self.known_mask)
+        if not masks:
+            return None
+        if any(m is None for m in masks):
+            # Valor sin productos indexados: ninguna fila es elegible
+            return np.zeros(self.product_ids.shape[0], dtype=bool)
+        combined = masks[0].copy()
+        for m in masks[1:]:
+            combined &= m
+        return combined
@@ -0,0 +1,96 @@
+# dicaprios_backend/visual_searcher/inference.py
+"""
+Servicio de inferencia con agrupación dinámica de peticiones (dynamic batching).
+
+Un único hilo en segundo plano es el dueño del modelo. Las peticiones dejan su
+imagen preprocesada en una cola; el hilo espera como máximo `max_wait_ms` para
+reunir hasta `max_batch_size` imágenes, ejecuta una sola predicción para todo el
+lote y entrega a cada petición su propio vector.
+
+Solo aporta con varias peticiones concurrentes en el mismo proceso (workers con
+hilos, p. ej. `gunicorn --threads 8`, o ASGI); con un único hilo por proceso el
+lote es de tamaño 1 y solo añade la espera de `max_wait_ms` como máximo.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class BatchingInferenceService:
+    """Agrupa imágenes de peticiones concurrentes en lotes para `predict_batch`."""
+
+    def __init__(self, predict_batch, max_batch_size=32, max_wait_ms=5):
+        self.predict_batch = predict_batch # Recibe un array (n, H, W, 3) y devuelve (n, D)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        # Estadísticas sencillas para dimensionar los parámetros
+        self.batches = 0
+        self.items = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='visual-search-inference', daemon=True)
+                self._thread.start()
+
+    def submit(self, image_array):
+        """
+        Encola una copia de la imagen preprocesada (H, W, 3) y devuelve un Future con su
+        embedding. Se copia porque quien llama suele reutilizar su buffer (uno por hilo)
+        en la siguiente petición, quizá antes de que el hilo de inferencia lo lea.
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((np.array(image_array, dtype=np.float32, copy=True), future))
+        return future
+
+    def embed(self, image_array, timeout=None):
+        """Versión bloqueante de `submit`: devuelve el embedding (D,) de la imagen."""
+        future = self.submit(image_array)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            future.cancel() # Si sigue en la cola, el hilo de inferencia la descarta
+            raise
+
+    def _collect_batch(self):
+        """Bloquea hasta la primera petición y reúne más hasta llenar el lote o agotar la espera."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Descartar las peticiones canceladas mientras esperaban en la cola
+            batch = [(image, future) for image, future in self._collect_batch() if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            images = [image for image, _ in batch]
+            futures = [future for _, future in batch]
+            try:
+                embeddings = np.asarray(self.predict_batch(np.stack(images)))
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.items += len(futures)
+            for future, embedding in zip(futures, embeddings.reshape(len(futures), -1)):
+                future.set_result(embedding)
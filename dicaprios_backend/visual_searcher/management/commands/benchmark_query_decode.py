@@ -0,0 +1,103 @@
+import io
+import os
+import statistics
+import tempfile
+import time
+import numpy as np
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+
+from visual_searcher.preprocessing import load_image_array, query_batch_buffer, IMG_WIDTH, IMG_HEIGHT
+
+try:
+    from tensorflow.keras.preprocessing import image as keras_image
+except ImportError:
+    keras_image = None
+
+
+def _decode_with_temp_file(upload):
+    """Ruta anterior: copia la subida a un archivo temporal y la vuelve a leer desde disco."""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
+        for chunk in upload.chunks():
+            tmp_file.write(chunk)
+        tmp_file_path = tmp_file.name
+    try:
+        if keras_image is not None:
+            img_array = keras_image.img_to_array(keras_image.load_img(tmp_file_path, target_size=(IMG_WIDTH, IMG_HEIGHT)))
+        else:
+            # Equivalente a load_img sin Keras: decodificación completa + redimensionado 'nearest'
+            with Image.open(tmp_file_path) as img:
+                img = img.convert('RGB').resize((IMG_WIDTH, IMG_HEIGHT), Image.NEAREST)
+                img_array = np.asarray(img, dtype=np.float32)
+        return np.expand_dims(img_array, axis=0)
+    finally:
+        os.remove(tmp_file_path)
+
+
+def _decode_in_memory(upload):
+    """Ruta actual: decodificación en memoria con modo draft y buffer reutilizado."""
+    upload.seek(0)
+    batch = query_batch_buffer()
+    batch[0] = load_image_array(upload)
+    return batch
+
+
+class Command(BaseCommand):
+    help = 'Compara la latencia de decodificación de imágenes de consulta: archivo temporal vs. en memoria.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--images', default=os.path.join(settings.MEDIA_ROOT, 'productos_imagenes'),
+            help='Directorio con imágenes de prueba.'
+        )
+        parser.add_argument('--repeat', type=int, default=20, help='Repeticiones por imagen.')
+        parser.add_argument(
+            '--photo-size', default='4032x3024',
+            help="Además, prueba una foto JPEG sintética de este tamaño (tipo cámara de móvil). '' para omitirla."
+        )
+
+    def _samples(self, options):
+        directory = options['images']
+        if not os.path.isdir(directory):
+            raise CommandError(f"No existe el directorio de imágenes: {directory}")
+        samples = []
+        for name in sorted(os.listdir(directory)):
+            with open(os.path.join(directory, name), 'rb') as f:
+                samples.append((name, f.read()))
+        if options['photo_size'] and samples:
+            width, height = (int(v) for v in options['photo_size'].lower().split('x'))
+            with Image.open(io.BytesIO(samples[0][1])) as img:
+                photo = img.convert('RGB').resize((width, height))
+            buffer = io.BytesIO()
+            photo.save(buffer, format='JPEG', quality=90)
+            samples.append((f'foto_sintetica_{width}x{height}.jpg', buffer.getvalue()))
+        if not samples:
+            raise CommandError(f"No se encontraron imágenes en {directory}")
+        return samples
+
+    def _measure(self, decode, data, repeat):
+        timings = []
+        for _ in range(repeat):
+            upload = SimpleUploadedFile('consulta.jpg', data) # InMemoryUploadedFile, como en una petición real
+            start = time.perf_counter()
+            decode(upload)
+            timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        samples = self._samples(options)
+        self.stdout.write(f"{'imagen':<50} {'antes (ms)':>12} {'después (ms)':>14} {'mejora':>8}")
+        before_total = after_total = 0.0
+        for name, data in samples:
+            before = self._measure(_decode_with_temp_file, data, options['repeat'])
+            after = self._measure(_decode_in_memory, data, options['repeat'])
+            before_total += before
+            after_total += after
+            self.stdout.write(f"{name[:50]:<50} {before:>12.2f} {after:>14.2f} {before / after:>7.1f}x")
+        self.stdout.write(self.style.SUCCESS(
+            f"Media por petición: antes {before_total / len(samples):.2f} ms, después {after_total / len(samples):.2f} ms "
+            f"(mediana de {options['repeat']} repeticiones, sin contar la inferencia)."
+        ))
@@ -0,0 +1,167 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+
+import numpy as np
+
+from django.core.management.base import BaseCommand, CommandError
+
+from productos.models import Producto
+from visual_searcher.benchmark import (
+    synthetic_catalog, synthetic_queries, exact_neighbours, benchmark_index, benchmark_request_path,
+    build_index, environment, ROWS_PER_CLUSTER,
+)
+from visual_searcher.vector_index import INDEX_TYPES, STORAGE_DTYPES, DEFAULT_NPROBE, DEFAULT_RESCORE_FACTOR, INDEX_FLAT
+
+DEFAULT_SIZES = '1000,10000,100000'
+DEFAULT_MAX_REGRESSION = 0.20 # Empeoramiento relativo permitido de la latencia p95 frente a la referencia
+DEFAULT_MAX_RECALL_DROP = 0.01 # Caída absoluta permitida del recall@K
+
+
+def _csv(value, cast=str):
+    return [cast(item.strip()) for item in value.split(',') if item.strip()]
+
+
+def _config_key(result):
+    return (result['rows'], result['dim'], result['index'], result['storage'], result.get('nprobe'), result['rescore_factor'], result['k'])
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark del buscador visual con catálogos sintéticos: tiempo de construcción, memoria, '
+        'latencia p50/p95/p99 y recall@K frente a la búsqueda exacta, más el recorrido completo de la '
+        'petición con un modelo sustituto. Escribe un informe JSON y puede compararlo con una referencia.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default=DEFAULT_SIZES, help='Tamaños del catálogo separados por comas (p. ej. 1000,1000000).')
+        parser.add_argument('--dim', type=int, default=2048, help='Dimensión de los embeddings (2048 en ResNet50).')
+        parser.add_argument('--queries', type=int, default=200, help='Consultas por configuración.')
+        parser.add_argument('--k', type=int, default=10, help='Resultados por consulta (recall@K).')
+        parser.add_argument('--index', default=','.join(INDEX_TYPES), help=f"Tipos de índice: {', '.join(INDEX_TYPES)}.")
+        parser.add_argument('--storage', default='float32,int8', help=f"Tipos de almacenamiento: {', '.join(STORAGE_DTYPES)}.")
+        parser.add_argument('--nprobe', default=str(DEFAULT_NPROBE), help='Valores de nprobe para IVF, separados por comas.')
+        parser.add_argument(
+            '--rescore-factor', type=int, default=DEFAULT_RESCORE_FACTOR,
+            help='Re-puntuación en float32 para almacenamiento cuantizado (0 = sin re-puntuar).'
+        )
+        parser.add_argument(
+            '--cluster-size', type=int, default=ROWS_PER_CLUSTER,
+            help='Filas por clúster del catálogo sintético (valores menores que k hacen el recall más exigente).'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--requests', type=int, default=100,
+            help='Peticiones a VisualSearchAPIView con modelo sustituto sobre el catálogo más pequeño (0 = omitir).'
+        )
+        parser.add_argument('--profile', action='store_true', help='Muestra las funciones más costosas del recorrido de la petición.')
+        parser.add_argument('--output', help='Ruta del informe JSON.')
+        parser.add_argument('--baseline', help='Informe JSON de referencia: falla si la latencia p95 o el recall empeoran.')
+        parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                            help='Aumento relativo máximo de la latencia p95 frente a la referencia (0.2 = 20%%).')
+        parser.add_argument('--max-recall-drop', type=float, default=DEFAULT_MAX_RECALL_DROP,
+                            help='Caída absoluta máxima del recall@K frente a la referencia.')
+
+    def _configs(self, options):
+        indexes, storages = _csv(options['index']), _csv(options['storage'])
+        unknown = set(indexes) - set(INDEX_TYPES) | set(storages) - set(STORAGE_DTYPES)
+        if unknown:
+            raise CommandError(f"Valores no soportados: {', '.join(sorted(unknown))}.")
+        for index_type in indexes:
+            for storage in storages:
+                rescore = options['rescore_factor'] if storage != 'float32' else 0
+                nprobes = _csv(options['nprobe'], int) if index_type != INDEX_FLAT else [None]
+                for nprobe in nprobes:
+                    yield index_type, storage, nprobe, rescore
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(_csv(options['sizes'], int))
+        except ValueError:
+            raise CommandError("--sizes debe ser una lista de enteros separados por comas.")
+        if not sizes or min(sizes) < options['k']:
+            raise CommandError(f"Cada tamaño debe ser al menos k ({options['k']}).")
+        configs = list(self._configs(options))
+
+        report = {
+            "generated_at": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            "environment": environment(),
+            "options": {name: options[name] for name in ('sizes', 'dim', 'queries', 'k', 'index', 'storage', 'nprobe', 'rescore_factor', 'cluster_size', 'seed', 'requests')},
+            "results": [],
+            "request_path": None,
+        }
+        header = f"{'filas':>9} {'índice':<6} {'almac.':<7} {'nprobe':>6} {'constr. (s)':>11} {'MB':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'recall':>7}"
+        self.stdout.write(header)
+        for size in sizes:
+            gigabytes = size * options['dim'] * 4 / 2**30
+            if gigabytes > 4:
+                self.stderr.write(f"Aviso: el catálogo de {size} filas ocupa {gigabytes:.1f} GB en float32; reduce --dim si no cabe en memoria.")
+            embeddings = synthetic_catalog(size, options['dim'], seed=options['seed'], rows_per_cluster=options['cluster_size'])
+            queries = synthetic_queries(embeddings, options['queries'], seed=options['seed'] + 1)
+            truth = exact_neighbours(embeddings, queries, options['k'])
+            for index_type, storage, nprobe, rescore in configs:
+                result = benchmark_index(embeddings, queries, truth, index_type, storage, nprobe, rescore, k=options['k'])
+                report['results'].append(result)
+                latency = result['latency_ms']
+                self.stdout.write(
+                    f"{size:>9} {index_type:<6} {storage:<7} {str(result.get('nprobe', '-')):>6} "
+                    f"{result['build_seconds']:>11.3f} {result['index_bytes'] / 2**20:>8.1f} "
+                    f"{latency['p50']:>8.3f} {latency['p95']:>8.3f} {latency['p99']:>8.3f} {result['recall_at_k']:>7.3f}"
+                )
+            if size == sizes[0] and options['requests'] > 0:
+                report['request_path'] = self._request_path(embeddings, queries, options)
+            del embeddings, queries, truth
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Informe guardado en {options['output']}")
+        if options['baseline']:
+            self._check_baseline(report, options)
+        self.stdout.write(self.style.SUCCESS("Benchmark completado."))
+
+    def _request_path(self, embeddings, queries, options):
+        # Las filas apuntan a productos reales (si los hay) para incluir la consulta a la BD y la serialización
+        existing = np.asarray(Producto.objects.order_by('id').values_list('id', flat=True)[:embeddings.shape[0]], dtype=np.int64)
+        product_ids = np.resize(existing, embeddings.shape[0]) if existing.size else np.arange(1, embeddings.shape[0] + 1)
+        index = build_index(embeddings, INDEX_FLAT)
+        profiler = cProfile.Profile() if options['profile'] else None
+        result = benchmark_request_path(index, product_ids, queries, requests=options['requests'], k=options['k'], profiler=profiler)
+        result['db_products'] = int(existing.size)
+        latency = result['latency_ms']
+        self.stdout.write(
+            f"\nPetición completa ({result['requests']} peticiones, {result['rows']} filas, modelo sustituto): "
+            f"p50 {latency['p50']:.2f} ms, p95 {latency['p95']:.2f} ms, p99 {latency['p99']:.2f} ms"
+        )
+        self.stdout.write("Tiempo medio por etapa: " + ", ".join(f"{stage} {ms:.2f} ms" for stage, ms in result['stage_mean_ms'].items()))
+        if profiler is not None:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+            self.stdout.write(stream.getvalue())
+        return result
+
+    def _check_baseline(self, report, options):
+        try:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"No se pudo leer el informe de referencia {options['baseline']}: {e}")
+        previous = {_config_key(result): result for result in baseline.get('results', [])}
+        regressions = []
+        compared = 0
+        for result in report['results']:
+            reference = previous.get(_config_key(result))
+            if reference is None:
+                continue
+            compared += 1
+            name = f"{result['rows']} filas {result['index']}/{result['storage']}" + (f" nprobe={result['nprobe']}" if result.get('nprobe') else '')
+            p95, reference_p95 = result['latency_ms']['p95'], reference['latency_ms']['p95']
+            if p95 > reference_p95 * (1 + options['max_regression']):
+                regressions.append(f"{name}: p95 {reference_p95:.3f} → {p95:.3f} ms")
+            if result['recall_at_k'] < reference['recall_at_k'] - options['max_recall_drop']:
+                regressions.append(f"{name}: recall@{result['k']} {reference['recall_at_k']:.3f} → {result['recall_at_k']:.3f}")
+        self.stdout.write(f"Comparadas {compared} configuraciones con {options['baseline']}.")
+        if regressions:
+            raise CommandError("Regresiones respecto a la referencia:\n" + "\n".join(regressions))
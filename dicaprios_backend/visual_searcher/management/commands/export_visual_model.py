@@ -0,0 +1,141 @@
+import os
+import time
+import numpy as np
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from visual_searcher.backends import (
+    build_keras_resnet50, model_path, OnnxEmbedder, TFLiteEmbedder, MODELS_DIR, BACKEND_ONNX, BACKEND_TFLITE,
+)
+from visual_searcher.preprocessing import load_image_array, preprocess_resnet50, IMG_WIDTH, IMG_HEIGHT
+from visual_searcher.vector_index import normalize_embeddings
+
+DEFAULT_TOLERANCE = 0.01 # Distancia coseno máxima permitida (1 - similitud) respecto a Keras
+
+
+def _export_onnx(model, path, quantize, opset):
+    try:
+        import tensorflow as tf
+        import tf2onnx
+    except ImportError as e:
+        raise CommandError(f"Para exportar a ONNX hace falta tf2onnx ({e}). Ejecuta: pip install tf2onnx onnxruntime")
+    spec = (tf.TensorSpec((None, IMG_HEIGHT, IMG_WIDTH, 3), tf.float32, name='input'),)
+    if not quantize:
+        tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=path)
+        return
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+    float_path = path + '.float.onnx'
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=opset, output_path=float_path)
+    try:
+        # Pesos en int8, activaciones cuantizadas dinámicamente en cada inferencia
+        quantize_dynamic(float_path, path, weight_type=QuantType.QInt8)
+    finally:
+        os.remove(float_path)
+
+
+def _export_tflite(model, path, quantize):
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT] # Cuantización de rango dinámico (pesos int8)
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+
+
+class Command(BaseCommand):
+    help = (
+        'Exporta el extractor ResNet50 a ONNX o TFLite (opcionalmente cuantizado a int8) y comprueba '
+        'que sus embeddings coinciden con los de Keras dentro de una tolerancia de coseno.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backend', choices=(BACKEND_ONNX, BACKEND_TFLITE), required=True)
+        parser.add_argument('--quantize', action='store_true', help='Cuantiza los pesos a int8.')
+        parser.add_argument('--opset', type=int, default=13, help='Versión de opset ONNX.')
+        parser.add_argument(
+            '--threads', type=int, default=getattr(settings, 'VISUAL_SEARCH_INFERENCE_THREADS', None),
+            help='Hilos de inferencia usados en la verificación.'
+        )
+        parser.add_argument(
+            '--images', default=os.path.join(settings.MEDIA_ROOT, 'productos_imagenes'),
+            help='Directorio con imágenes para la verificación.'
+        )
+        parser.add_argument('--check-images', type=int, default=32, help='Número de imágenes a comparar.')
+        parser.add_argument(
+            '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+            help='Distancia coseno máxima (1 - similitud) permitida frente a Keras en cualquier imagen.'
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Instala el modelo aunque supere la tolerancia (habrá que regenerar el índice con ese motor).'
+        )
+
+    def _check_batch(self, directory, limit):
+        if not os.path.isdir(directory):
+            raise CommandError(f"No existe el directorio de imágenes: {directory}")
+        arrays = []
+        for name in sorted(os.listdir(directory)):
+            if len(arrays) >= limit:
+                break
+            try:
+                arrays.append(load_image_array(os.path.join(directory, name)))
+            except Exception as e:
+                self.stderr.write(f"Imagen omitida en la verificación {name}: {e}")
+        if not arrays:
+            raise CommandError(f"No hay imágenes válidas en {directory} para verificar el modelo exportado.")
+        return preprocess_resnet50(np.stack(arrays).astype(np.float32))
+
+    def _timed_embeddings(self, predict_batch, batch):
+        predict_batch(batch[:1]) # Calentamiento
+        start = time.perf_counter()
+        predict_batch(batch[:1])
+        latency_ms = (time.perf_counter() - start) * 1000
+        embeddings = np.concatenate([np.asarray(predict_batch(batch[i:i + 8])) for i in range(0, len(batch), 8)])
+        return normalize_embeddings(embeddings.reshape(len(batch), -1)), latency_ms
+
+    def handle(self, *args, **options):
+        backend, quantize = options['backend'], options['quantize']
+        try:
+            keras_model = build_keras_resnet50()
+        except ImportError as e:
+            raise CommandError(f"La exportación necesita TensorFlow ({e}). Ejecuta: pip install tensorflow")
+
+        os.makedirs(MODELS_DIR, exist_ok=True)
+        final_path = model_path(backend, quantize)
+        tmp_path = final_path + '.tmp'
+        self.stdout.write(f"Exportando ResNet50 a {backend}{' (int8)' if quantize else ''}...")
+        try:
+            if backend == BACKEND_ONNX:
+                _export_onnx(keras_model, tmp_path, quantize, options['opset'])
+                exported = OnnxEmbedder(tmp_path, options['threads'])
+            else:
+                _export_tflite(keras_model, tmp_path, quantize)
+                exported = TFLiteEmbedder(tmp_path, options['threads'])
+
+            # Verificación: los embeddings exportados deben coincidir con los que ya están en el índice
+            batch = self._check_batch(options['images'], max(1, options['check_images']))
+            reference, keras_ms = self._timed_embeddings(keras_model.predict_on_batch, batch)
+            candidate, exported_ms = self._timed_embeddings(exported.predict_batch, batch)
+            cosine = np.sum(reference * candidate, axis=1)
+            worst = float(1.0 - cosine.min())
+            self.stdout.write(
+                f"Similitud coseno con Keras en {len(batch)} imágenes: media {cosine.mean():.5f}, mínima {cosine.min():.5f}."
+            )
+            self.stdout.write(f"Latencia con 1 imagen: Keras {keras_ms:.1f} ms, {backend} {exported_ms:.1f} ms.")
+
+            if worst > options['tolerance'] and not options['force']:
+                raise CommandError(
+                    f"La distancia coseno máxima ({worst:.5f}) supera la tolerancia ({options['tolerance']}). "
+                    "El modelo no se instala; usa --force y regenera el índice con este motor si aun así quieres usarlo."
+                )
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        os.replace(tmp_path, final_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Modelo guardado en {final_path}. Actívalo con VISUAL_SEARCH_INFERENCE_BACKEND = '{backend}'"
+            f"{' y VISUAL_SEARCH_INFERENCE_QUANTIZED = True' if quantize else ''} en settings.py."
+        ))
@@ -0,0 +1,76 @@
+# dicaprios_backend/visual_searcher/preprocessing.py
+"""
+Decodificación y redimensionado de imágenes para ResNet50, sin depender de Keras.
+
+Sigue el esquema de `keras_image.load_img(path, target_size=(224, 224))` (conversión
+a RGB y redimensionado 'nearest'), pero no da los mismos píxeles: en JPEG se usa el
+modo draft, que decodifica a una escala reducida (1/2, 1/4 o 1/8) cuando la foto es
+mucho mayor que 224x224, y el redimensionado parte de esa imagen ya reducida. Los
+embeddings no son comparables con los de un índice generado con `load_img` (la
+versión 0, product_embeddings.npy): hay que regenerarlo con generate_image_embeddings,
+que usa esta misma función para el catálogo y las consultas.
+
+Las imágenes se leen directamente del archivo o buffer recibido (sin archivos
+temporales).
+"""
+import threading
+import numpy as np
+from PIL import Image
+
+IMG_WIDTH, IMG_HEIGHT = 224, 224 # Tamaño de entrada para ResNet50
+
+# Límite de píxeles de una imagen de consulta: evita picos de latencia y memoria
+# con imágenes enormes o "bombas de descompresión".
+DEFAULT_MAX_QUERY_PIXELS = 40_000_000
+
+# Medias de ImageNet por canal (BGR) usadas por keras.applications.resnet50.preprocess_input
+RESNET50_MEAN_BGR = np.array([103.939, 116.779, 123.68], dtype=np.float32)
+
+_buffers = threading.local()
+
+
+class ImageTooLargeError(ValueError):
+    """La imagen supera el número máximo de píxeles permitido."""
+
+
+def load_image_array(source, max_pixels=None):
+    """
+    Abre `source` (ruta o archivo binario) y devuelve un array uint8 de forma
+    (IMG_HEIGHT, IMG_WIDTH, 3) listo para copiarse a un lote.
+    Si `max_pixels` se indica, rechaza la imagen antes de decodificarla.
+    """
+    with Image.open(source) as img:
+        width, height = img.size # Solo se ha leído la cabecera
+        if max_pixels is not None and width * height > max_pixels:
+            raise ImageTooLargeError(
+                f"La imagen ({width}x{height}) supera el máximo de {max_pixels} píxeles."
+            )
+        if img.format == 'JPEG':
+            img.draft('RGB', (IMG_WIDTH, IMG_HEIGHT))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        if img.size != (IMG_WIDTH, IMG_HEIGHT):
+            img = img.resize((IMG_WIDTH, IMG_HEIGHT), Image.NEAREST)
+        return np.asarray(img, dtype=np.uint8)
+
+
+def preprocess_resnet50(batch):
+    """
+    Equivalente en numpy de `resnet50.preprocess_input` (modo 'caffe'): pasa de RGB a BGR
+    y resta la media de ImageNet. Modifica `batch` (float32) en sitio y lo devuelve,
+    sin necesidad de importar TensorFlow.
+    """
+    batch[...] = batch[..., ::-1]
+    batch -= RESNET50_MEAN_BGR
+    return batch
+
+
+def query_batch_buffer():
+    """
+    Buffer float32 (1, IMG_HEIGHT, IMG_WIDTH, 3) reutilizado por cada hilo para
+    preprocesar la imagen de consulta sin reservar memoria en cada petición.
+    """
+    buffer = getattr(_buffers, 'query', None)
+    if buffer is None:
+        buffer = _buffers.query = np.empty((1, IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+    return buffer
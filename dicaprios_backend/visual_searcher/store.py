@@ -0,0 +1,256 @@
+# dicaprios_backend/visual_searcher/store.py
+"""
+Almacenamiento versionado del índice de búsqueda visual.
+
+Cada versión vive en su propio directorio (ia_embeddings/v000001/, ...) con:
+- meta.json: formato, tipo de almacenamiento y dimensiones.
+- embeddings.npy: matriz (N, D) float32 de embeddings normalizados.
+- embeddings_float16.npy / embeddings_int8.npy (+ scales_int8.npy): copia cuantizada
+  usada para recorrer el índice si el tipo de almacenamiento no es float32.
+- product_ids.npy: ID de producto de cada fila.
+- tombstones.npy: filas marcadas como eliminadas (producto borrado o imagen cambiada).
+- manifest.json: firma de la imagen indexada de cada producto (para actualizaciones incrementales).
+- index_ivf.npz: índice IVF opcional.
+
+El archivo ia_embeddings/CURRENT apunta a la versión activa y se reemplaza de forma
+atómica (os.replace), así que los procesos que lo leen ven la versión anterior o la
+nueva completa, nunca una mezcla. Si CURRENT no existe se usan los archivos
+antiguos (product_embeddings.npy / product_ids.npy) como versión 0.
+
+Las escrituras (write_version y la lectura de la versión base en las actualizaciones
+incrementales) se serializan con `writer_lock()`, un bloqueo exclusivo sobre
+ia_embeddings/LOCK: dos ejecuciones de generate_image_embeddings a la vez no pueden
+calcular el mismo número de versión ni partir de la misma base.
+
+Los arrays se guardan en formato .npy (datos alineados a 64 bytes) y se abren con
+mmap_mode='r': todos los procesos del servidor comparten las mismas páginas en la
+caché del sistema operativo en lugar de tener cada uno su copia privada.
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import contextmanager
+import numpy as np
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+from django.conf import settings
+
+from .vector_index import StoredEmbeddings, quantize_embeddings, normalize_embeddings
+
+EMBEDDINGS_DIR = os.path.join(settings.MEDIA_ROOT, 'ia_embeddings')
+CURRENT_FILE = os.path.join(EMBEDDINGS_DIR, 'CURRENT')
+LOCK_NAME = 'LOCK'
+
+# Formato anterior (una sola versión, sin manifiesto ni tombstones)
+LEGACY_EMBEDDINGS_FILE = os.path.join(EMBEDDINGS_DIR, 'product_embeddings.npy')
+LEGACY_PRODUCT_IDS_FILE = os.path.join(EMBEDDINGS_DIR, 'product_ids.npy')
+LEGACY_IVF_INDEX_FILE = os.path.join(EMBEDDINGS_DIR, 'product_index_ivf.npz')
+
+FORMAT_VERSION = 1
+META_NAME = 'meta.json'
+EMBEDDINGS_NAME = 'embeddings.npy'
+QUANTIZED_NAME = 'embeddings_{dtype}.npy'
+SCALES_NAME = 'scales_int8.npy'
+PRODUCT_IDS_NAME = 'product_ids.npy'
+TOMBSTONES_NAME = 'tombstones.npy'
+MANIFEST_NAME = 'manifest.json'
+IVF_INDEX_NAME = 'index_ivf.npz'
+
+KEEP_VERSIONS = 3 # Versiones antiguas que se conservan para procesos que aún las usan
+
+
+class IndexVersion:
+    """Datos de una versión del índice tal como están en disco."""
+
+    def __init__(self, version, embeddings, product_ids, tombstones, manifest, ivf_path,
+                 quantized=None, scales=None, storage_dtype='float32'):
+        self.version = version
+        self.embeddings = embeddings # float32 normalizado
+        self.storage_dtype = storage_dtype # Tipo con el que se escribió ('float32', 'float16' o 'int8')
+        self.quantized = quantized # Copia float16/int8 (None si se almacena en float32)
+        self.scales = scales
+        self.product_ids = product_ids
+        self.tombstones = tombstones
+        self.manifest = manifest
+        self.ivf_path = ivf_path
+
+    @property
+    def live_mask(self):
+        return ~self.tombstones
+
+    @property
+    def live_count(self):
+        return int(self.live_mask.sum())
+
+    def stored_embeddings(self, rescore=True):
+        """
+        Matriz a recorrer en las búsquedas: la cuantizada si existe, con la float32
+        como copia exacta para re-puntuar (si `rescore`).
+        """
+        if self.quantized is None:
+            return StoredEmbeddings(self.embeddings)
+        return StoredEmbeddings(self.quantized, self.scales, exact=self.embeddings if rescore else None)
+
+
+_writer_lock = threading.RLock()
+_writer_depth = 0
+
+
+@contextmanager
+def writer_lock():
+    """
+    Bloqueo exclusivo entre procesos sobre ia_embeddings/ para leer-modificar-escribir
+    versiones. Es reentrante dentro del mismo proceso (write_version lo vuelve a tomar).
+    """
+    global _writer_depth
+    with _writer_lock:
+        if _writer_depth:
+            _writer_depth += 1
+            try:
+                yield
+            finally:
+                _writer_depth -= 1
+            return
+        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+        with open(os.path.join(EMBEDDINGS_DIR, LOCK_NAME), 'a+b') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            else:
+                lock_file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError: # LK_LOCK se rinde tras 10 intentos: seguir esperando
+                        continue
+            _writer_depth = 1
+            try:
+                yield
+            finally:
+                _writer_depth = 0
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                else:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _version_dir(version):
+    return os.path.join(EMBEDDINGS_DIR, f'v{version:06d}')
+
+
+def current_version():
+    """Número de la versión activa, 0 si solo existe el formato antiguo, None si no hay índice."""
+    try:
+        with open(CURRENT_FILE) as f:
+            return int(f.read().strip())
+    except FileNotFoundError:
+        if os.path.exists(LEGACY_EMBEDDINGS_FILE) and os.path.exists(LEGACY_PRODUCT_IDS_FILE):
+            return 0
+        return None
+
+
+def read_version(version=None, mmap=True):
+    """
+    Abre la versión indicada (por defecto la activa). Devuelve None si no hay índice.
+    Con `mmap` los arrays se mapean en memoria en modo solo lectura.
+    """
+    if version is None:
+        version = current_version()
+    if version is None:
+        return None
+    mmap_mode = 'r' if mmap else None
+
+    if version == 0:
+        # Formato antiguo: embeddings sin normalizar, hay que cargarlos en memoria
+        embeddings = normalize_embeddings(np.load(LEGACY_EMBEDDINGS_FILE))
+        product_ids = np.load(LEGACY_PRODUCT_IDS_FILE)
+        tombstones = np.zeros(product_ids.shape[0], dtype=bool)
+        return IndexVersion(0, embeddings, product_ids, tombstones, {}, LEGACY_IVF_INDEX_FILE)
+
+    path = _version_dir(version)
+    with open(os.path.join(path, META_NAME)) as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT_VERSION:
+        raise ValueError(f"Formato de índice no soportado en {path}: {meta.get('format')}.")
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_NAME), mmap_mode=mmap_mode)
+    product_ids = np.load(os.path.join(path, PRODUCT_IDS_NAME), mmap_mode=mmap_mode)
+    tombstones = np.load(os.path.join(path, TOMBSTONES_NAME))
+    quantized = scales = None
+    if meta['dtype'] != 'float32':
+        quantized = np.load(os.path.join(path, QUANTIZED_NAME.format(dtype=meta['dtype'])), mmap_mode=mmap_mode)
+        if meta['dtype'] == 'int8':
+            scales = np.load(os.path.join(path, SCALES_NAME), mmap_mode=mmap_mode)
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    return IndexVersion(
+        version, embeddings, product_ids, tombstones, manifest, os.path.join(path, IVF_INDEX_NAME),
+        quantized=quantized, scales=scales, storage_dtype=meta['dtype'],
+    )
+
+
+def write_version(embeddings, product_ids, tombstones, manifest, ivf_index=None, storage_dtype='float32'):
+    """
+    Escribe una nueva versión completa y la activa actualizando CURRENT de forma atómica.
+    `storage_dtype` ('float32', 'float16' o 'int8') añade una copia cuantizada para las búsquedas.
+    Devuelve el número de la nueva versión.
+    """
+    with writer_lock():
+        os.makedirs(EMBEDDINGS_DIR, exist_ok=True)
+        # Directorio temporal propio: otro escritor nunca lo comparte ni lo borra
+        tmp_path = tempfile.mkdtemp(prefix='.tmp-', dir=EMBEDDINGS_DIR)
+        os.chmod(tmp_path, 0o755) # mkdtemp lo crea con 0o700; los procesos del servidor deben poder leerlo
+        try:
+            _write_files(tmp_path, embeddings, product_ids, tombstones, manifest, ivf_index, storage_dtype)
+            version = (current_version() or 0) + 1
+            os.rename(tmp_path, _version_dir(version))
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+        tmp_current = CURRENT_FILE + '.tmp'
+        with open(tmp_current, 'w') as f:
+            f.write(str(version))
+        os.replace(tmp_current, CURRENT_FILE)
+
+        _prune_versions(version)
+    return version
+
+
+def _write_files(tmp_path, embeddings, product_ids, tombstones, manifest, ivf_index, storage_dtype):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    np.save(os.path.join(tmp_path, EMBEDDINGS_NAME), embeddings)
+    if storage_dtype != 'float32':
+        quantized, scales = quantize_embeddings(embeddings, storage_dtype)
+        np.save(os.path.join(tmp_path, QUANTIZED_NAME.format(dtype=storage_dtype)), quantized)
+        if scales is not None:
+            np.save(os.path.join(tmp_path, SCALES_NAME), scales)
+    np.save(os.path.join(tmp_path, PRODUCT_IDS_NAME), np.asarray(product_ids, dtype=np.int64))
+    np.save(os.path.join(tmp_path, TOMBSTONES_NAME), np.asarray(tombstones, dtype=bool))
+    with open(os.path.join(tmp_path, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f)
+    if ivf_index is not None:
+        ivf_index.save(os.path.join(tmp_path, IVF_INDEX_NAME))
+    with open(os.path.join(tmp_path, META_NAME), 'w') as f:
+        json.dump({
+            "format": FORMAT_VERSION,
+            "dtype": storage_dtype,
+            "rows": int(embeddings.shape[0]),
+            "dim": int(embeddings.shape[1]) if embeddings.ndim == 2 else 0,
+        }, f)
+
+
+def _prune_versions(active_version):
+    """Elimina los directorios de versiones más antiguos que las últimas KEEP_VERSIONS."""
+    for name in os.listdir(EMBEDDINGS_DIR):
+        if not (name.startswith('v') and name[1:].isdigit()):
+            continue
+        if int(name[1:]) <= active_version - KEEP_VERSIONS:
+            shutil.rmtree(os.path.join(EMBEDDINGS_DIR, name), ignore_errors=True)
@@ -1,3 +1,977 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.cache import caches
+from django.core.management.base import CommandError
+from django.test import AsyncClient, TestCase, override_settings
+from PIL import Image
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from productos.models import Categoria, Producto, Proveedor
+from . import backends, store, views
+from .admission import AdmissionController
+from .embedding_cache import QueryEmbeddingCache, image_digest
+from .benchmark import (
+    synthetic_catalog, synthetic_queries, exact_neighbours, recall_at_k, benchmark_index,
+    benchmark_request_path, build_index, synthetic_jpeg, StubEmbedder, _SyntheticSearchIndex,
+)
+from .filters import ProductRowFilters
+from .inference import BatchingInferenceService
+from .preprocessing import load_image_array, preprocess_resnet50, ImageTooLargeError, IMG_HEIGHT, IMG_WIDTH
+from .vector_index import (
+    INDEX_FLAT, INDEX_IVF, IVFIndex, FlatIndex, StoredEmbeddings, load_index, normalize_embeddings, quantize_embeddings,
+    top_k,
+)
+
+
+class BenchmarkTests(TestCase):
+    """Utilidades de benchmark del buscador visual (catálogos pequeños para que sea rápido)."""
+
+    def setUp(self):
+        self.embeddings = synthetic_catalog(600, dim=32, seed=0)
+        self.queries = synthetic_queries(self.embeddings, 20)
+        self.truth = exact_neighbours(self.embeddings, self.queries, 5)
+
+    def test_catalogo_sintetico_normalizado_y_reproducible(self):
+        np.testing.assert_allclose(np.linalg.norm(self.embeddings, axis=1), 1.0, rtol=1e-5)
+        np.testing.assert_array_equal(self.embeddings, synthetic_catalog(600, dim=32, seed=0))
+
+    def test_vecinos_exactos_por_bloques(self):
+        with mock.patch('visual_searcher.benchmark.GENERATION_CHUNK_SIZE', 128): # Bloques menores que el catálogo
+            por_bloques = exact_neighbours(self.embeddings, self.queries, 5)
+        esperado = np.argsort(-(self.queries @ self.embeddings.T), axis=1, kind='stable')[:, :5]
+        np.testing.assert_array_equal(por_bloques, esperado)
+
+    def test_recall(self):
+        self.assertEqual(recall_at_k(self.truth, self.truth), 1.0)
+        self.assertEqual(recall_at_k(self.truth[:, ::-1], self.truth), 1.0) # El orden no importa
+        self.assertEqual(recall_at_k(np.full_like(self.truth, -1), self.truth), 0.0)
+
+    def test_benchmark_index(self):
+        flat = benchmark_index(self.embeddings, self.queries, self.truth, INDEX_FLAT, k=5)
+        self.assertEqual(flat['recall_at_k'], 1.0)
+        self.assertEqual(flat['index_bytes'], self.embeddings.nbytes)
+        self.assertLessEqual(flat['latency_ms']['p50'], flat['latency_ms']['p99'])
+
+        # Con nprobe = nlist, IVF recorre todas las listas y es exacto
+        ivf = benchmark_index(self.embeddings, self.queries, self.truth, INDEX_IVF, nprobe=24, nlist=24, k=5)
+        self.assertEqual(ivf['recall_at_k'], 1.0)
+        self.assertEqual(ivf['nlist'], 24)
+
+        int8 = benchmark_index(self.embeddings, self.queries, self.truth, INDEX_FLAT, 'int8', rescore_factor=4, k=5)
+        self.assertGreaterEqual(int8['recall_at_k'], 0.95)
+
+    def test_recorrido_de_la_peticion_con_modelo_sustituto(self):
+        productos = [
+            Producto.objects.create(nombre_producto=f'Producto {i}', precio=10, color='Rojo', stock=1) for i in range(3)
+        ]
+        product_ids = np.resize(np.array([p.id for p in productos]), self.embeddings.shape[0])
+        result = benchmark_request_path(build_index(self.embeddings, INDEX_FLAT), product_ids, self.queries, requests=5, k=3)
+        self.assertEqual(result['status_codes'], {'200': 5})
+        self.assertEqual(set(result['stage_mean_ms']), {'decode', 'preprocess', 'inference', 'search', 'other'})
+
+
+class BenchmarkCommandTests(TestCase):
+    opciones = ['--sizes', '300', '--dim', '16', '--queries', '10', '--k', '5', '--nprobe', '17', '--requests', '3']
+
+    def test_informe_json_y_comparacion_con_referencia(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, 'informe.json')
+            call_command('benchmark_visual_search', *self.opciones, '--output', output, stdout=io.StringIO())
+            with open(output) as f:
+                report = json.load(f)
+            self.assertEqual(len(report['results']), 4) # flat/ivf x float32/int8
+            self.assertEqual(report['request_path']['requests'], 3)
+            for result in report['results']:
+                self.assertEqual(set(result['latency_ms']), {'p50', 'p95', 'p99', 'mean'})
+                self.assertIn('recall_at_k', result)
+
+            # Referencia imposible de igualar: latencias casi nulas
+            for result in report['results']:
+                result['latency_ms']['p95'] = 1e-9
+            baseline = os.path.join(tmp, 'referencia.json')
+            with open(baseline, 'w') as f:
+                json.dump(report, f)
+            with self.assertRaisesMessage(CommandError, 'Regresiones'):
+                call_command('benchmark_visual_search', *self.opciones, '--baseline', baseline, stdout=io.StringIO())
+
+    def test_opciones_invalidas(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_visual_search', '--sizes', '3', stdout=io.StringIO())
+        with self.assertRaises(CommandError):
+            call_command('benchmark_visual_search', '--sizes', '300', '--index', 'hnsw', stdout=io.StringIO())
+
+
+class VectorIndexTests(TestCase):
+    """Índices vectoriales y almacenamiento cuantizado (visual_searcher/vector_index.py)."""
+
+    def setUp(self):
+        self.embeddings = synthetic_catalog(3000, dim=64, seed=0)
+        self.queries = synthetic_queries(self.embeddings, 20, seed=1)
+
+    def test_top_k_descarta_filas_excluidas(self):
+        scores = np.array([0.2, -np.inf, 0.9, 0.5, -np.inf, 0.1], dtype=np.float32)
+        self.assertEqual(top_k(scores, 3).tolist(), [2, 3, 0])
+        self.assertEqual(top_k(scores, 10).tolist(), [2, 3, 0, 5]) # k mayor que las filas elegibles
+        self.assertEqual(top_k(np.full(4, -np.inf, dtype=np.float32), 2).size, 0)
+        self.assertEqual(top_k(scores, 0).size, 0)
+
+        mask = np.zeros(self.embeddings.shape[0], dtype=bool)
+        mask[[7, 70, 700]] = True
+        for index in (FlatIndex(self.embeddings), build_index(self.embeddings, INDEX_IVF, nprobe=64)):
+            scores, rows = index.search(self.queries[0], k=10, mask=mask)
+            self.assertLessEqual(set(rows.tolist()), {7, 70, 700})
+            self.assertTrue(np.isfinite(scores).all())
+
+    def test_recall_del_ivf_frente_a_flat(self):
+        truth = exact_neighbours(self.embeddings, self.queries, 10)
+        flat = FlatIndex(self.embeddings)
+        self.assertEqual(recall_at_k([flat.search(q, k=10)[1] for q in self.queries], truth), 1.0)
+        ivf = build_index(self.embeddings, INDEX_IVF, nprobe=8) # 8 de ≈ 54 listas
+        self.assertLess(ivf.nprobe, ivf.nlist)
+        self.assertGreaterEqual(recall_at_k([ivf.search(q, k=10)[1] for q in self.queries], truth), 0.95)
+
+    def test_load_index_vuelve_a_flat(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ivf_path = os.path.join(tmp, 'product_index_ivf.npz')
+            IVFIndex.build(self.embeddings, nlist=16).save(ivf_path)
+            self.assertIsInstance(load_index(self.embeddings, INDEX_IVF, ivf_path, nprobe=4), IVFIndex)
+            self.assertIsInstance(load_index(self.embeddings, INDEX_FLAT, ivf_path), FlatIndex)
+            with self.assertLogs('visual_searcher.vector_index', 'WARNING') as logs:
+                index = load_index(self.embeddings[:-5], INDEX_IVF, ivf_path) # Filas que no corresponden
+            self.assertIsInstance(index, FlatIndex)
+            self.assertIn('no corresponde', logs.output[0])
+            with self.assertLogs('visual_searcher.vector_index', 'WARNING'):
+                index = load_index(self.embeddings, INDEX_IVF, os.path.join(tmp, 'no_existe.npz'))
+            self.assertIsInstance(index, FlatIndex)
+        with self.assertRaises(ValueError):
+            load_index(self.embeddings, 'hnsw')
+
+    def test_puntuaciones_cuantizadas_por_bloques(self):
+        exact = self.embeddings @ self.queries[0]
+        rows = np.arange(5, 2900, 7)
+        for dtype, tolerance in (('float16', 2e-3), ('int8', 2e-2)):
+            data, scales = quantize_embeddings(self.embeddings, dtype)
+            matrix = StoredEmbeddings(data, scales, chunk_size=256) # Varios bloques, el último incompleto
+            scores = matrix.dot(self.queries[0])
+            self.assertEqual(scores.dtype, np.float32)
+            np.testing.assert_allclose(scores, exact, atol=tolerance, err_msg=dtype)
+            np.testing.assert_allclose(matrix.dot(self.queries[0], rows), exact[rows], atol=tolerance, err_msg=dtype)
+
+    def test_re_puntuacion_recupera_el_orden_exacto(self):
+        reference = FlatIndex(self.embeddings)
+        for index_type in (INDEX_FLAT, INDEX_IVF):
+            index = build_index(self.embeddings, index_type, 'int8', nprobe=64, rescore_factor=4, nlist=16)
+            for query in self.queries:
+                exact_scores, exact_rows = reference.search(query, k=10)
+                scores, rows = index.search(query, k=10)
+                np.testing.assert_array_equal(rows, exact_rows, err_msg=index_type)
+                np.testing.assert_allclose(scores, exact_scores, rtol=1e-6, err_msg=index_type)
+
+
+class LoadImageArrayTests(TestCase):
+    """Decodificación de las imágenes de consulta y del catálogo."""
+
+    def _png(self, mode, size=(300, 200)):
+        buffer = io.BytesIO()
+        Image.new(mode, size, 128 if mode in ('L', 'P') else (200, 100, 50, 255)[:len(mode)]).save(buffer, format='PNG')
+        buffer.seek(0)
+        return buffer
+
+    def test_forma_tipo_y_conversion_a_rgb(self):
+        for mode in ('L', 'P', 'RGBA', 'RGB'):
+            array = load_image_array(self._png(mode))
+            self.assertEqual(array.shape, (IMG_HEIGHT, IMG_WIDTH, 3), mode)
+            self.assertEqual(array.dtype, np.uint8, mode)
+        np.testing.assert_array_equal(load_image_array(self._png('RGBA'))[0, 0], [200, 100, 50])
+        np.testing.assert_array_equal(load_image_array(self._png('L'))[0, 0], [128, 128, 128])
+
+    def test_jpeg_grande_con_modo_draft(self):
+        array = load_image_array(io.BytesIO(synthetic_jpeg(2000, 1500)))
+        self.assertEqual((array.shape, array.dtype), ((IMG_HEIGHT, IMG_WIDTH, 3), np.uint8))
+
+    def test_rechaza_imagenes_con_demasiados_pixeles(self):
+        load_image_array(self._png('RGB'), max_pixels=300 * 200)
+        with self.assertRaises(ImageTooLargeError):
+            load_image_array(self._png('RGB'), max_pixels=300 * 200 - 1)
+
+
+class QueryEmbeddingCacheTests(TestCase):
+    """Caché de embeddings de consulta (visual_searcher/embedding_cache.py)."""
+
+    def setUp(self):
+        caches['visual_search'].clear()
+        self.cache = QueryEmbeddingCache('visual_search')
+        self.embedding = np.arange(8, dtype=np.float32)
+
+    def test_hash_de_la_imagen(self):
+        data = synthetic_jpeg(64, 64)
+        upload = SimpleUploadedFile('consulta.jpg', data, 'image/jpeg')
+        upload.read(10)
+        self.assertEqual(image_digest(upload), hashlib.sha256(data).hexdigest())
+        self.assertEqual(upload.tell(), 0)
+
+    def test_clave_por_modelo_version_e_imagen(self):
+        self.cache.set(3, 'abc', self.embedding, 'onnx')
+        np.testing.assert_array_equal(self.cache.get(3, 'abc', 'onnx'), self.embedding)
+        self.assertIsNone(self.cache.get(3, 'abc', 'keras')) # Otro motor de inferencia
+        self.assertIsNone(self.cache.get(4, 'abc', 'onnx')) # Otra versión del índice
+        self.assertIsNone(self.cache.get(3, 'abd', 'onnx')) # Otra imagen
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (1, 3, 0.25))
+
+    def test_un_solo_viaje_al_backend_por_consulta(self):
+        backend = mock.Mock(wraps=caches['visual_search'])
+        with mock.patch.object(QueryEmbeddingCache, 'cache', new_callable=mock.PropertyMock, return_value=backend):
+            self.cache.get(1, 'abc')
+            self.cache.set(1, 'abc', self.embedding)
+            self.cache.get(1, 'abc')
+        self.assertEqual([call[0] for call in backend.method_calls], ['get', 'set', 'get'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_backend_caido(self):
+        backend = mock.Mock(**{'get.side_effect': ConnectionError('redis caído'), 'set.side_effect': ConnectionError})
+        with mock.patch.object(QueryEmbeddingCache, 'cache', new_callable=mock.PropertyMock, return_value=backend):
+            with self.assertLogs('visual_searcher.embedding_cache', 'WARNING'):
+                self.assertIsNone(self.cache.get(1, 'abc'))
+                self.cache.set(1, 'abc', self.embedding)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))
+
+
+class AdmissionControllerTests(TestCase):
+    """Control de admisión de la búsqueda visual asíncrona."""
+
+    async def test_cola_y_rechazo(self):
+        admission = AdmissionController(max_active=1, max_queue=1, queue_timeout=5)
+        self.assertTrue(await admission.acquire())
+        waiting = asyncio.ensure_future(admission.acquire())
+        await asyncio.sleep(0)
+        self.assertEqual(admission.stats()['queued'], 1)
+        self.assertFalse(await admission.acquire()) # Cola llena
+
+        admission.release() # El hueco pasa a la petición en cola
+        self.assertTrue(await waiting)
+        admission.release()
+        self.assertEqual(admission.stats(), {
+            "active": 0, "queued": 0, "max_active": 1, "max_queue": 1, "admitted": 2, "rejected": 1, "timed_out": 0,
+        })
+
+    async def test_espera_agotada(self):
+        admission = AdmissionController(max_active=1, max_queue=4, queue_timeout=0.01)
+        self.assertTrue(await admission.acquire())
+        self.assertFalse(await admission.acquire())
+        admission.release()
+        stats = admission.stats()
+        self.assertEqual((stats['active'], stats['queued'], stats['timed_out']), (0, 0, 1))
+        self.assertTrue(await admission.acquire()) # El hueco no se perdió
+
+
+class AsyncVisualSearchTests(TestCase):
+    """AsyncVisualSearchView con el modelo sustituido por StubEmbedder y un índice en memoria."""
+    url = '/api/visual-search/search-async/'
+
+    def setUp(self):
+        self.productos = [
+            Producto.objects.create(nombre_producto=f'Producto {i}', precio=10, color='Rojo', stock=1) for i in range(3)
+        ]
+        self.embeddings = synthetic_catalog(3, dim=16, seed=0)
+        user = User.objects.create_user(username='buscador', password='clave')
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+        stub = StubEmbedder(self.embeddings[1:2]) # La consulta coincide con el segundo producto
+        self.service = BatchingInferenceService(stub.predict_batch, max_wait_ms=0)
+        self.patched = {
+            'IA_COMPONENTS_LOADED': True,
+            'RESNET_MODEL_INSTANCE': stub,
+            'INFERENCE_SERVICE': self.service,
+            'EMBEDDING_CACHE': None,
+            'SEARCH_INDEX': _SyntheticSearchIndex(
+                build_index(self.embeddings, INDEX_FLAT), np.array([p.id for p in self.productos]),
+            ),
+            '_index_checked_at': float('inf'),
+            'ADMISSION': AdmissionController(max_active=1, max_queue=0),
+        }
+
+    def _data(self, **extra):
+        return {'image': SimpleUploadedFile('consulta.jpg', synthetic_jpeg(320, 240), 'image/jpeg'), 'k': 3, **extra}
+
+    async def test_busqueda(self):
+        with mock.patch.multiple(views, **self.patched):
+            response = await AsyncClient().post(self.url, self._data(), headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertTrue(body['match_found'])
+        self.assertEqual(body['product']['id'], self.productos[1].id)
+        self.assertAlmostEqual(body['similarity_score'], 1.0, places=5)
+        self.assertEqual(self.service.items, 1) # Pasó por el servicio de agrupación dinámica
+        self.assertEqual(self.patched['ADMISSION'].stats()['active'], 0)
+
+    async def test_errores_de_la_peticion(self):
+        with mock.patch.multiple(views, **self.patched):
+            client = AsyncClient()
+            self.assertEqual((await client.post(self.url, self._data())).status_code, 401)
+            response = await client.post(self.url, self._data(k=0), headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+            response = await client.post(self.url, {'k': 3}, headers=self.headers)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.patched['ADMISSION'].stats()['active'], 0)
+
+    async def test_consulta_repetida_sale_de_la_cache(self):
+        caches['visual_search'].clear()
+        cache = QueryEmbeddingCache('visual_search')
+        image = synthetic_jpeg(320, 240)
+        with mock.patch.multiple(views, **dict(self.patched, EMBEDDING_CACHE=cache)):
+            for _ in range(2):
+                data = dict(self._data(), image=SimpleUploadedFile('consulta.jpg', image, 'image/jpeg'))
+                response = await AsyncClient().post(self.url, data, headers=self.headers)
+                self.assertEqual(response.json()['product']['id'], self.productos[1].id)
+        self.assertEqual(self.service.items, 1) # La segunda consulta no pasó por el modelo
+        self.assertEqual((cache.stats()['hits'], cache.stats()['misses']), (1, 1))
+
+    async def test_imagen_demasiado_grande_responde_413(self):
+        with mock.patch.multiple(views, MAX_QUERY_PIXELS=100 * 100, **self.patched):
+            response = await AsyncClient().post(self.url, self._data(), headers=self.headers)
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(self.service.items, 0)
+
+    def test_imagen_demasiado_grande_responde_413_en_la_vista_sincrona(self):
+        with mock.patch.multiple(views, MAX_QUERY_PIXELS=100 * 100, **self.patched):
+            response = self.client.post('/api/visual-search/search/', self._data(), headers=self.headers)
+        self.assertEqual(response.status_code, 413)
+
+    async def test_saturado_responde_503_con_retry_after(self):
+        admission = self.patched['ADMISSION']
+        self.assertTrue(await admission.acquire()) # Ocupa el único hueco; la cola es de 0
+        with mock.patch.multiple(views, **self.patched):
+            response = await AsyncClient().post(self.url, self._data(), headers=self.headers)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], str(views.ADMISSION_RETRY_AFTER_SECONDS))
+        self.assertEqual(admission.stats()['rejected'], 1)
+
+
+class IAComponentsLoadTests(TestCase):
+    """Errores de carga de los componentes de IA y calentamiento en segundo plano."""
+
+    def setUp(self):
+        patcher = mock.patch.multiple(
+            views, IA_COMPONENTS_LOADED=False, RESNET_MODEL_INSTANCE=None, INFERENCE_SERVICE=None, SEARCH_INDEX=None,
+            EMBEDDING_CACHE=None, IA_LOAD_ERROR=None, IA_LOAD_ERROR_CODE=None, _load_attempts=0, _next_retry_at=None,
+            _warm_up_thread=None,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_el_detalle_del_error_solo_va_al_log(self):
+        with mock.patch.object(views, 'build_embedder', side_effect=ImportError('No module named tensorflow (/opt/venv)')):
+            with self.assertLogs('visual_searcher.views', 'ERROR') as logs:
+                self.assertFalse(views._load_ia_components())
+        self.assertIn('/opt/venv', logs.output[0])
+
+        client = AsyncClient()
+        response = await client.get('/api/visual-search/health/')
+        self.assertEqual(response.json()['status'], 'error')
+        self.assertEqual(response.json()['error'], 'missing_dependencies')
+        user = await User.objects.acreate(username='buscador')
+        headers = {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+        image = SimpleUploadedFile('consulta.jpg', synthetic_jpeg(64, 64), 'image/jpeg')
+        response = await client.post('/api/visual-search/search-async/', {'image': image}, headers=headers)
+        self.assertEqual(response.status_code, 503)
+        for response in (response, await client.get('/api/visual-search/health/')):
+            self.assertNotIn(b'tensorflow', response.content)
+            self.assertNotIn(b'/opt/venv', response.content)
+
+    def test_hilo_de_calentamiento_heredado_sin_vida(self):
+        # Tras un fork solo sobrevive el hilo que lo hizo: el hilo heredado ya no está vivo
+        stale = threading.Thread(target=lambda: None)
+        stale.start()
+        stale.join()
+        with mock.patch.object(views, '_load_ia_components', return_value=True) as load:
+            views._warm_up_thread = stale
+            views.start_warm_up()
+            started = views._warm_up_thread
+            self.assertIsNot(started, stale)
+            if started is not None:
+                started.join(5)
+        load.assert_called_once()
+
+    def test_reinicio_tras_fork(self):
+        views._warm_up_thread = threading.Thread(target=lambda: None)
+        with mock.patch.multiple(views, _cpu_executor=mock.Mock()):
+            views._reset_after_fork()
+            self.assertIsNone(views._cpu_executor)
+        self.assertIsNone(views._warm_up_thread)
+        self.assertTrue(views._load_lock.acquire(blocking=False))
+        views._load_lock.release()
+
+
+class ProductRowFiltersTests(TestCase):
+    """Máscaras de filtros construidas desde las filas de Producto y búsqueda filtrada."""
+
+    def setUp(self):
+        self.categorias = [Categoria.objects.create(nombre_categoria=f'Categoría {i}') for i in range(2)]
+        self.proveedores = [Proveedor.objects.create(nombre_proveedor=f'Proveedor {i}') for i in range(2)]
+        tallas = ['M', ' m ', 'L', None]
+        self.productos = [
+            Producto.objects.create(
+                nombre_producto=f'Producto {i}', precio=10, color='Rojo', stock=i % 3, talla=tallas[i % 4],
+                categoria=self.categorias[i % 2] if i % 5 else None, proveedor=self.proveedores[i % 2],
+            )
+            for i in range(20)
+        ]
+        # Una fila de un producto ya borrado y una fila sustituida por un tombstone
+        self.product_ids = np.array([p.id for p in self.productos] + [999999])
+        self.live_mask = np.ones(self.product_ids.shape[0], dtype=bool)
+        self.live_mask[3] = False
+        self.filters = ProductRowFilters(self.product_ids, live_mask=self.live_mask).build()
+
+    def _esperado(self, predicate):
+        return np.array([
+            row < len(self.productos) and self.live_mask[row] and predicate(self.productos[row])
+            for row in range(self.product_ids.shape[0])
+        ])
+
+    def test_mascaras_desde_los_productos(self):
+        categoria, proveedor = self.categorias[1], self.proveedores[0]
+        casos = [
+            ({'categoria_id': categoria.id}, lambda p: p.categoria_id == categoria.id),
+            ({'proveedor_id': proveedor.id}, lambda p: p.proveedor_id == proveedor.id),
+            ({'talla': 'M'}, lambda p: (p.talla or '').strip().lower() == 'm'),
+            ({'in_stock': True}, lambda p: p.stock > 0),
+            (
+                {'categoria_id': categoria.id, 'talla': 'l', 'in_stock': True},
+                lambda p: p.categoria_id == categoria.id and p.talla == 'L' and p.stock > 0,
+            ),
+            ({}, lambda p: True), # Sin filtros solo se excluyen las filas no vigentes
+        ]
+        for kwargs, predicate in casos:
+            np.testing.assert_array_equal(self.filters.mask(**kwargs), self._esperado(predicate), err_msg=str(kwargs))
+        self.assertFalse(self.filters.mask(categoria_id=123456).any()) # Valor sin productos indexados
+
+    def test_busqueda_filtrada(self):
+        embeddings = synthetic_catalog(self.product_ids.shape[0], dim=16, seed=1)
+        query = synthetic_queries(embeddings, 1, seed=2)[0]
+        search_index = _SyntheticSearchIndex(build_index(embeddings, INDEX_FLAT), self.product_ids)
+        params = {'categoria_id': self.categorias[0].id, 'proveedor_id': None, 'talla': None, 'in_stock': True}
+        eligible = self._esperado(lambda p: p.categoria_id == self.categorias[0].id and p.stock > 0)
+        expected_order = [row for row in np.argsort(-(embeddings @ query), kind='stable') if eligible[row]]
+
+        for k in (1, 3, 20):
+            scores, rows = views._search(search_index, query, dict(params, k=k), self.filters)
+            self.assertLessEqual(rows.size, k)
+            self.assertEqual(rows.size, min(k, int(eligible.sum())))
+            self.assertTrue(eligible[rows].all())
+            self.assertEqual(rows.tolist(), expected_order[:k])
+            self.assertTrue(np.isfinite(scores).all())
+
+        # IVF aproximado: puede devolver menos filas, pero nunca filas que no cumplan los filtros
+        search_index = _SyntheticSearchIndex(build_index(embeddings, INDEX_IVF, nprobe=1, nlist=4), self.product_ids)
+        for k in (1, 3, 20):
+            scores, rows = views._search(search_index, query, dict(params, k=k), self.filters)
+            self.assertLessEqual(rows.size, k)
+            self.assertTrue(eligible[rows].all())
+
+
+def _bmp(seed, width=32, height=32):
+    """Imagen BMP de ruido: sin compresión, el tamaño del archivo solo depende de las dimensiones."""
+    pixels = np.random.default_rng(seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='BMP')
+    return buffer.getvalue()
+
+
+class _ProjectionEmbedder:
+    """Sustituye a ResNet50 en generate_image_embeddings: proyección aleatoria fija de la imagen reducida."""
+    name = 'stub'
+
+    def __init__(self):
+        self.projection = np.random.default_rng(0).standard_normal((14 * 14 * 3, 2048)).astype(np.float32)
+        self.images = 0
+
+    def predict_batch(self, batch):
+        self.images += batch.shape[0]
+        return batch[:, ::16, ::16, :].reshape(batch.shape[0], -1) @ self.projection
+
+
+class TempEmbeddingsDirMixin:
+    """MEDIA_ROOT y el directorio del índice en un directorio temporal."""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.media_root = tmp.name
+        embeddings_dir = os.path.join(tmp.name, 'ia_embeddings')
+        media = override_settings(MEDIA_ROOT=tmp.name)
+        media.enable()
+        self.addCleanup(media.disable)
+        patcher = mock.patch.multiple(
+            store,
+            EMBEDDINGS_DIR=embeddings_dir,
+            CURRENT_FILE=os.path.join(embeddings_dir, 'CURRENT'),
+            LEGACY_EMBEDDINGS_FILE=os.path.join(embeddings_dir, 'product_embeddings.npy'),
+            LEGACY_PRODUCT_IDS_FILE=os.path.join(embeddings_dir, 'product_ids.npy'),
+            LEGACY_IVF_INDEX_FILE=os.path.join(embeddings_dir, 'product_index_ivf.npz'),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class EmbeddingStoreTests(TempEmbeddingsDirMixin, TestCase):
+    """Versiones del índice en disco (visual_searcher/store.py)."""
+
+    def _write(self, n=6, seed=0, **kwargs):
+        embeddings = synthetic_catalog(n, dim=16, seed=seed)
+        product_ids = np.arange(100, 100 + n)
+        tombstones = np.zeros(n, dtype=bool)
+        tombstones[1] = True
+        manifest = {str(i): {"imagen": f"{i}.jpg", "mtime": 1.0, "size": 10, "sha256": "x"} for i in product_ids.tolist()}
+        version = store.write_version(embeddings, product_ids, tombstones, manifest, **kwargs)
+        return version, embeddings, product_ids, tombstones, manifest
+
+    def test_escritura_y_lectura(self):
+        self.assertIsNone(store.current_version())
+        version, embeddings, product_ids, tombstones, manifest = self._write()
+        self.assertEqual(version, 1)
+        self.assertEqual(store.current_version(), 1)
+
+        loaded = store.read_version()
+        self.assertEqual(loaded.version, 1)
+        np.testing.assert_array_equal(loaded.embeddings, embeddings)
+        np.testing.assert_array_equal(loaded.product_ids, product_ids)
+        np.testing.assert_array_equal(loaded.tombstones, tombstones)
+        self.assertEqual(loaded.manifest, manifest)
+        self.assertEqual(loaded.live_count, 5)
+        self.assertIsNone(loaded.quantized)
+
+        # Se conservan las últimas KEEP_VERSIONS versiones y no quedan directorios temporales
+        for _ in range(store.KEEP_VERSIONS + 1):
+            version = self._write()[0]
+        self.assertEqual(version, store.KEEP_VERSIONS + 2)
+        names = sorted(name for name in os.listdir(store.EMBEDDINGS_DIR) if name not in ('CURRENT', store.LOCK_NAME))
+        self.assertEqual(names, [f'v{v:06d}' for v in range(version - store.KEEP_VERSIONS + 1, version + 1)])
+
+    def test_copias_cuantizadas_mapeadas_en_memoria(self):
+        for dtype in ('float16', 'int8'):
+            version, embeddings = self._write(storage_dtype=dtype)[:2]
+            loaded = store.read_version(version, mmap=True)
+            self.assertEqual(loaded.quantized.dtype, np.dtype(dtype))
+            arrays = [loaded.embeddings, loaded.product_ids, loaded.quantized]
+            if dtype == 'int8':
+                arrays.append(loaded.scales)
+            for array in arrays:
+                self.assertIsInstance(array, np.memmap)
+            matrix = loaded.stored_embeddings()
+            np.testing.assert_allclose(matrix.dot(embeddings[0]), embeddings @ embeddings[0], atol=2e-2)
+
+            loaded = store.read_version(version, mmap=False)
+            self.assertNotIsInstance(loaded.quantized, np.memmap)
+            self.assertNotIsInstance(loaded.embeddings, np.memmap)
+
+    def test_escrituras_concurrentes_obtienen_versiones_distintas(self):
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            versions = list(executor.map(lambda seed: self._write(seed=seed)[0], range(4)))
+        self.assertEqual(sorted(versions), [1, 2, 3, 4])
+        self.assertEqual(store.current_version(), 4)
+
+    def test_cambio_de_version_sin_reiniciar(self):
+        self._write(seed=0)
+        with mock.patch.multiple(views, SEARCH_INDEX=None, INDEX_TYPE=INDEX_FLAT, _index_checked_at=0.0):
+            views._refresh_search_index()
+            self.assertEqual(views.SEARCH_INDEX.version, 1)
+
+            self._write(seed=1)
+            views._refresh_search_index() # Dentro del intervalo de comprobación: sigue la versión cargada
+            self.assertEqual(views.SEARCH_INDEX.version, 1)
+
+            with mock.patch.object(views, '_index_checked_at', 0.0):
+                views._refresh_search_index()
+            self.assertEqual(views.SEARCH_INDEX.version, 2)
+            self.assertEqual(views.SEARCH_INDEX.index.ntotal, 6)
+            self.assertFalse(views.SEARCH_INDEX.row_filters.known_mask[1]) # Tombstone
+
+    def test_mascaras_caducadas_se_recalculan_en_segundo_plano(self):
+        self._write(seed=0)
+        with mock.patch.multiple(views, SEARCH_INDEX=None, INDEX_TYPE=INDEX_FLAT, _filters_refreshing=False), \
+                mock.patch.object(views, '_row_filters_worker') as worker:
+            views._refresh_search_index(force=True)
+            search_index = views.SEARCH_INDEX
+            worker.assert_not_called() # Recién cargadas
+
+            search_index.row_filters.built_at = 0.0 # Caducadas
+            views._refresh_search_index(force=True)
+            views._refresh_search_index(force=True) # El primer recálculo sigue en curso: no se lanza otro
+            worker.assert_called_once_with(search_index)
+
+            old = search_index.row_filters
+            views._refresh_row_filters(search_index)
+            self.assertIsNot(search_index.row_filters, old) # Se sustituye, no se modifica en sitio
+            self.assertEqual(old.built_at, 0.0)
+            self.assertFalse(search_index.row_filters.is_stale(views.FILTERS_MAX_AGE_SECONDS))
+            np.testing.assert_array_equal(search_index.row_filters.known_mask, old.known_mask)
+
+        # Si el recálculo falla se conserva el anterior y se permite reintentarlo
+        with mock.patch.multiple(views, _filters_refreshing=True, _refresh_row_filters=mock.Mock(side_effect=RuntimeError)), \
+                mock.patch.object(views.connections, 'close_all') as close_all, \
+                self.assertLogs('visual_searcher.views', 'ERROR'):
+            views._row_filters_worker(search_index)
+            self.assertFalse(views._filters_refreshing)
+        close_all.assert_called_once()
+
+
+class IncrementalEmbeddingsTests(TempEmbeddingsDirMixin, TestCase):
+    """generate_image_embeddings --incremental con el modelo sustituido."""
+
+    def setUp(self):
+        super().setUp()
+        self.embedder = _ProjectionEmbedder()
+        patcher = mock.patch.multiple(
+            'productos.management.commands.generate_image_embeddings',
+            build_embedder=mock.Mock(return_value=self.embedder),
+            tqdm=lambda iterable, **kwargs: iterable, # Sin barra de progreso en la salida de los tests
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _producto(self, seed, **kwargs):
+        return Producto.objects.create(
+            nombre_producto=f'Producto {seed}', precio=10, color='Rojo', stock=1,
+            imagen=SimpleUploadedFile(f'p{seed}.bmp', _bmp(seed, **kwargs), 'image/bmp'),
+        )
+
+    def _generate(self, *args):
+        self.embedder.images = 0
+        call_command('generate_image_embeddings', '--workers', '2', '--batch-size', '4', '--dtype', 'float32',
+                     *args, stdout=io.StringIO(), stderr=io.StringIO())
+        return store.read_version()
+
+    def _rewrite(self, producto, data, mtime_offset=10):
+        path = producto.imagen.path
+        stat = os.stat(path)
+        if data is not None:
+            with open(path, 'wb') as f:
+                f.write(data)
+        os.utime(path, (stat.st_atime, stat.st_mtime + mtime_offset))
+
+    def test_lotes_y_precarga_igual_que_una_a_una(self):
+        productos = [self._producto(seed, width=24 + 4 * seed) for seed in range(11)]
+        self._rewrite(productos[5], b'no es una imagen')
+        esperado = {}
+        for producto in productos:
+            try:
+                array = load_image_array(producto.imagen.path)
+            except Exception:
+                continue
+            batch = preprocess_resnet50(array[None].astype(np.float32))
+            esperado[producto.id] = normalize_embeddings(self.embedder.predict_batch(batch))[0]
+
+        batch_sizes = []
+        predict_batch = self.embedder.predict_batch
+        with mock.patch.object(self.embedder, 'predict_batch', side_effect=lambda b: batch_sizes.append(len(b)) or predict_batch(b)):
+            loaded = self._generate('--index', 'flat') # Lotes de 4, 2 hilos y precarga de 8 imágenes
+        self.assertEqual(batch_sizes, [4, 4, 2])
+        self.assertEqual(sorted(loaded.product_ids.tolist()), sorted(esperado))
+        for row, product_id in enumerate(loaded.product_ids.tolist()):
+            np.testing.assert_allclose(loaded.embeddings[row], esperado[product_id], rtol=1e-5, atol=1e-6)
+
+    def test_diferencias_del_manifiesto_y_tombstones(self):
+        productos = [self._producto(seed) for seed in range(14)]
+        base = self._generate('--index', 'flat')
+        self.assertEqual((base.version, base.embeddings.shape[0], self.embedder.images), (1, 14, 14))
+
+        self._rewrite(productos[0], _bmp(100, width=40)) # Otro tamaño
+        self._rewrite(productos[1], None) # Solo cambia la fecha: mismo contenido
+        self._rewrite(productos[2], _bmp(102)) # Mismo tamaño, otro contenido
+        self._rewrite(productos[4], b'no es una imagen' * 100) # Cambia y no se puede decodificar
+        deleted_id = productos[3].id
+        productos[3].delete()
+        nuevo = self._producto(200)
+
+        version = self._generate('--incremental', '--index', 'flat')
+        self.assertEqual(version.version, 2)
+        self.assertEqual(self.embedder.images, 3) # productos 0 y 2 y el nuevo; el 1 no se recalcula
+        self.assertEqual(version.embeddings.shape[0], 17) # 4/17 eliminadas: por debajo del umbral, sin compactar
+        np.testing.assert_array_equal(version.embeddings[:14], base.embeddings)
+
+        product_ids = version.product_ids.tolist()
+        live_ids = {product_ids[row] for row in np.flatnonzero(version.live_mask)}
+        expected = {p.id for p in productos if p.id not in (None, productos[4].id)} | {nuevo.id} # delete() deja id = None
+        self.assertEqual(live_ids, expected)
+        tombstoned = [product_ids[row] for row in np.flatnonzero(version.tombstones)]
+        self.assertCountEqual(tombstoned, [productos[0].id, productos[2].id, deleted_id, productos[4].id])
+
+        self.assertNotIn(str(deleted_id), version.manifest)
+        self.assertNotIn(str(productos[4].id), version.manifest) # Se reintentará en la próxima ejecución
+        self.assertEqual(version.manifest[str(productos[1].id)]['mtime'], os.stat(productos[1].imagen.path).st_mtime)
+        self.assertEqual(version.manifest[str(productos[1].id)]['sha256'], base.manifest[str(productos[1].id)]['sha256'])
+
+        # Las filas eliminadas no aparecen en la búsqueda, ni siquiera con su propio embedding como consulta
+        filters = ProductRowFilters(version.product_ids, live_mask=version.live_mask).build()
+        index = load_index(version.embeddings, INDEX_FLAT)
+        for row in np.flatnonzero(version.tombstones):
+            scores, rows = index.search(version.embeddings[row], k=17, mask=filters.mask())
+            self.assertEqual(rows.size, 13)
+            self.assertFalse(version.tombstones[rows].any())
+
+        # Sin cambios, no se escribe una versión nueva
+        self.assertEqual(self._generate('--incremental', '--index', 'flat').version, 2)
+
+    def test_ivf_extendido_y_compactado(self):
+        productos = [self._producto(seed) for seed in range(8)]
+        base = self._generate('--index', 'ivf', '--nlist', '2')
+        with np.load(base.ivf_path) as data:
+            centroids, base_assignments = data['centroids'], data['assignments']
+
+        for producto in productos[:3]:
+            producto.delete()
+        nuevo = self._producto(300)
+        version = self._generate('--incremental', '--index', 'ivf')
+
+        # 3/9 filas eliminadas > COMPACT_TOMBSTONE_RATIO: solo quedan las vigentes
+        self.assertEqual(version.embeddings.shape[0], 6)
+        self.assertFalse(version.tombstones.any())
+        self.assertEqual(version.product_ids.tolist(), [p.id for p in productos[3:]] + [nuevo.id])
+        ivf = IVFIndex.load(version.ivf_path, version.embeddings)
+        np.testing.assert_array_equal(ivf.centroids, centroids) # Mismos centroides: no se reentrena
+        np.testing.assert_array_equal(ivf.assignments[:5], base_assignments[3:])
+        self.assertEqual(ivf.assignments[5], int(np.argmax(centroids @ version.embeddings[5])))
+
+    @override_settings(VISUAL_SEARCH_STORAGE_DTYPE='float16')
+    def test_incremental_conserva_el_tipo_de_almacenamiento(self):
+        self._producto(0)
+        base = self._generate('--index', 'flat', '--dtype', 'int8') # El último --dtype prevalece
+        self.assertEqual(base.storage_dtype, 'int8')
+        self._producto(1)
+        call_command('generate_image_embeddings', '--incremental', '--index', 'flat', '--workers', '1',
+                     stdout=io.StringIO(), stderr=io.StringIO())
+        version = store.read_version()
+        self.assertEqual((version.version, version.storage_dtype), (2, 'int8'))
+        self.assertEqual(version.quantized.dtype, np.int8)
+
+        self._producto(2)
+        version = self._generate('--incremental', '--index', 'flat') # --dtype explícito: float32
+        self.assertEqual((version.version, version.storage_dtype), (3, 'float32'))
+        self.assertIsNone(version.quantized)
+
+    def test_ivf_que_no_corresponde_se_reconstruye(self):
+        [self._producto(seed) for seed in range(6)]
+        base = self._generate('--index', 'ivf', '--nlist', '2')
+        IVFIndex.build(base.embeddings[:4], nlist=2).save(base.ivf_path) # Filas que no corresponden
+        self._producto(300)
+        version = self._generate('--incremental', '--index', 'ivf', '--nlist', '2')
+        self.assertEqual(version.version, base.version + 1)
+        self.assertEqual(IVFIndex.load(version.ivf_path, version.embeddings).assignments.shape[0], 7)
+
+
+class BatchingInferenceServiceTests(TestCase):
+    """Agrupación dinámica de consultas (visual_searcher/inference.py)."""
+
+    def setUp(self):
+        self.batch_sizes = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def _predict(self, batch):
+        self.release.wait(5)
+        self.batch_sizes.append(batch.shape[0])
+        return batch.reshape(batch.shape[0], -1)[:, :4] * 2 # Cada fila depende solo de su imagen
+
+    def _image(self, value):
+        return np.full((4, 4, 3), value, dtype=np.float32)
+
+    def test_agrupa_peticiones_concurrentes(self):
+        service = BatchingInferenceService(self._predict, max_batch_size=32, max_wait_ms=200)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda i: service.embed(self._image(i), timeout=5), range(8)))
+        for i, embedding in enumerate(results):
+            np.testing.assert_array_equal(embedding, np.full(4, 2 * i, dtype=np.float32))
+        self.assertEqual(service.items, 8)
+        self.assertLess(service.batches, 8)
+
+    def test_tamano_maximo_del_lote(self):
+        service = BatchingInferenceService(self._predict, max_batch_size=2, max_wait_ms=100)
+        futures = [service.submit(self._image(i)) for i in range(5)]
+        for i, future in enumerate(futures):
+            np.testing.assert_array_equal(future.result(timeout=5), np.full(4, 2 * i, dtype=np.float32))
+        self.assertTrue(all(size <= 2 for size in self.batch_sizes))
+        self.assertEqual(sum(self.batch_sizes), 5)
+
+    def test_espera_agotada_y_buffer_reutilizado(self):
+        service = BatchingInferenceService(self._predict, max_batch_size=1, max_wait_ms=0)
+        self.release.clear() # El hilo de inferencia se queda ocupado con la primera imagen
+        first = service.submit(self._image(1))
+        with self.assertRaises(TimeoutError):
+            service.embed(self._image(2), timeout=0.05)
+
+        buffer = self._image(3) # Como query_batch_buffer(): el llamador lo reutiliza enseguida
+        pending = service.submit(buffer)
+        buffer[...] = 99
+        self.release.set()
+        np.testing.assert_array_equal(first.result(timeout=5), np.full(4, 2, dtype=np.float32))
+        np.testing.assert_array_equal(pending.result(timeout=5), np.full(4, 6, dtype=np.float32))
+        self.assertEqual(self.batch_sizes, [1, 1]) # La petición que agotó su espera se descartó
+
+    def test_error_del_modelo_llega_a_todas_las_peticiones(self):
+        calls = []
+
+        def predict(batch):
+            calls.append(batch.shape[0])
+            if len(calls) == 1:
+                raise RuntimeError('fallo del modelo')
+            return batch.reshape(batch.shape[0], -1)[:, :4]
+
+        service = BatchingInferenceService(predict, max_batch_size=8, max_wait_ms=200)
+        futures = [service.submit(self._image(i)) for i in range(3)]
+        for future in futures:
+            with self.assertRaisesMessage(RuntimeError, 'fallo del modelo'):
+                future.result(timeout=5)
+        self.assertEqual(calls, [3])
+        # El hilo de inferencia sigue atendiendo peticiones después del error
+        np.testing.assert_array_equal(service.embed(self._image(5), timeout=5), np.full(4, 5, dtype=np.float32))
+
+
+class _StubKerasModel:
+    """Sustituye al ResNet50 de Keras: solo necesita predict_on_batch."""
+
+    def __init__(self):
+        self.predict_on_batch = _ProjectionEmbedder().predict_batch
+
+
+class InferenceBackendTests(TestCase):
+    """Selección del motor de inferencia en build_embedder, sin TensorFlow ni ONNX Runtime."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        for patcher in (
+            mock.patch.object(backends, 'MODELS_DIR', tmp.name),
+            mock.patch.object(backends, 'build_keras_resnet50', side_effect=_StubKerasModel),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _export(self, backend, quantized=False):
+        with open(backends.model_path(backend, quantized), 'wb') as f:
+            f.write(b'modelo')
+
+    def test_keras(self):
+        embedder = backends.build_embedder(backends.BACKEND_KERAS)
+        self.assertIsInstance(embedder, backends.KerasEmbedder)
+        self.assertEqual(embedder.predict_batch(np.zeros((2, 224, 224, 3), dtype=np.float32)).shape, (2, 2048))
+        with self.assertRaises(ValueError):
+            backends.build_embedder('torch')
+
+    def test_onnx_exportado(self):
+        self._export(backends.BACKEND_ONNX, quantized=True)
+        session = mock.Mock()
+        session.get_inputs.return_value = [mock.Mock()]
+        ort = mock.Mock(**{'InferenceSession.return_value': session})
+        with mock.patch.dict(sys.modules, {'onnxruntime': ort}):
+            embedder = backends.build_embedder(backends.BACKEND_ONNX, quantized=True, num_threads=2)
+        self.assertIsInstance(embedder, backends.OnnxEmbedder)
+        self.assertEqual(ort.InferenceSession.call_args[0][0], backends.model_path(backends.BACKEND_ONNX, True))
+        self.assertEqual(ort.SessionOptions.return_value.intra_op_num_threads, 2)
+
+    def test_modelo_sin_exportar_usa_keras(self):
+        self._export(backends.BACKEND_ONNX) # Solo existe el modelo sin cuantizar
+        for backend, quantized in ((backends.BACKEND_ONNX, True), (backends.BACKEND_TFLITE, False)):
+            with self.assertLogs('visual_searcher.backends', 'WARNING') as logs:
+                embedder = backends.build_embedder(backend, quantized)
+            self.assertIsInstance(embedder, backends.KerasEmbedder)
+            self.assertIn('export_visual_model', logs.output[0])
+
+    def test_motor_no_instalado_usa_keras(self):
+        self._export(backends.BACKEND_ONNX)
+        self._export(backends.BACKEND_TFLITE)
+        missing = {'onnxruntime': None, 'tflite_runtime': None, 'tflite_runtime.interpreter': None, 'tensorflow': None}
+        with mock.patch.dict(sys.modules, missing):
+            for backend in (backends.BACKEND_ONNX, backends.BACKEND_TFLITE):
+                with self.assertLogs('visual_searcher.backends', 'WARNING') as logs:
+                    embedder = backends.build_embedder(backend)
+                self.assertIsInstance(embedder, backends.KerasEmbedder)
+                self.assertIn('no está instalado', logs.output[0])
+
+    def test_sin_tensorflow(self):
+        with mock.patch.object(backends, 'build_keras_resnet50', side_effect=ImportError('tensorflow')):
+            with self.assertRaises(ImportError), self.assertLogs('visual_searcher.backends', 'WARNING'):
+                backends.build_embedder(backends.BACKEND_ONNX) # Sin modelo exportado: respaldo de Keras
+
+
+class ExportVisualModelTests(TestCase):
+    """Comprobación de tolerancia de export_visual_model con modelos sustitutos."""
+
+    def setUp(self):
+        from .management.commands import export_visual_model
+        self.command = export_visual_model
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.models_dir = os.path.join(tmp.name, 'ia_models')
+        self.images_dir = os.path.join(tmp.name, 'imagenes')
+        os.makedirs(self.images_dir)
+        for seed in range(4):
+            with open(os.path.join(self.images_dir, f'{seed}.bmp'), 'wb') as f:
+                f.write(_bmp(seed, 300, 200))
+        with open(os.path.join(self.images_dir, 'roto.jpg'), 'wb') as f:
+            f.write(b'no es una imagen')
+        self.noise = 0.0
+
+        def export(model, path, quantize, opset):
+            with open(path, 'wb') as f:
+                f.write(b'modelo')
+
+        test = self
+
+        class ExportedStub:
+            def __init__(self, path, num_threads=None):
+                self.reference = _ProjectionEmbedder()
+
+            def predict_batch(self, batch):
+                embeddings = self.reference.predict_batch(batch)
+                rng = np.random.default_rng(0)
+                return embeddings + test.noise * np.abs(embeddings).mean() * rng.standard_normal(embeddings.shape)
+
+        for patcher in (
+            mock.patch.object(backends, 'MODELS_DIR', self.models_dir),
+            mock.patch.multiple(
+                export_visual_model, MODELS_DIR=self.models_dir, build_keras_resnet50=_StubKerasModel,
+                _export_onnx=export, OnnxEmbedder=ExportedStub,
+            ),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def _run(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('export_visual_model', '--backend', 'onnx', '--images', self.images_dir, *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_dentro_de_la_tolerancia_se_instala(self):
+        self.noise = 0.01
+        out, err = self._run('--quantize')
+        self.assertIn('roto.jpg', err)
+        self.assertIn('4 imágenes', out)
+        self.assertEqual(os.listdir(self.models_dir), [os.path.basename(backends.model_path('onnx', True))])
+
+    def test_fuera_de_la_tolerancia_no_se_instala(self):
+        self.noise = 0.5
+        with self.assertRaisesMessage(CommandError, 'supera la tolerancia'):
+            self._run()
+        self.assertEqual(os.listdir(self.models_dir), []) # Tampoco queda el archivo temporal
+
+        self._run('--tolerance', '0.5') # Con una tolerancia mayor sí se acepta
+        self.assertTrue(os.path.exists(backends.model_path('onnx')))
+
+    def test_force_instala_aunque_supere_la_tolerancia(self):
+        self.noise = 0.5
+        self._run('--force')
+        self.assertTrue(os.path.exists(backends.model_path('onnx')))
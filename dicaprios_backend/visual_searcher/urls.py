@@ -1,9 +1,11 @@
 # dicaprios_backend/visual_searcher/urls.py
 
 from django.urls import path
-from .views import VisualSearchAPIView # Importa la vista que creaste
+from .views import VisualSearchAPIView, AsyncVisualSearchView, VisualSearchHealthAPIView # Importa la vista que creaste
 
 urlpatterns = [
     path('search/', VisualSearchAPIView.as_view(), name='visual_image_search'),
+    path('search-async/', AsyncVisualSearchView.as_view(), name='visual_image_search_async'), # Pensada para ASGI
+    path('health/', VisualSearchHealthAPIView.as_view(), name='visual_search_health'),
     # Puedes añadir más URLs específicas para esta app aquí en el futuro si es necesario
-]
\ No newline at end of file
+]
@@ -0,0 +1,284 @@
+# dicaprios_backend/visual_searcher/vector_index.py
+"""
+Capa de índices vectoriales para el buscador visual.
+
+Todos los índices trabajan sobre embeddings normalizados (norma L2 = 1), de
+modo que la similitud coseno se reduce a un producto punto.
+
+- FlatIndex: búsqueda exacta sobre toda la matriz (línea base).
+- IVFIndex: índice aproximado de archivo invertido (k-means esférico).
+  Solo se recorren las `nprobe` listas cuyos centroides están más cerca de la
+  consulta; subir `nprobe` mejora el recall a costa de latencia.
+
+Los embeddings pueden estar cuantizados (float16 o int8 con escala por fila) y
+mapeados en memoria; en ese caso los candidatos se re-puntúan opcionalmente con
+la copia float32.
+"""
+import logging
+import os
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_FLAT = 'flat'
+INDEX_IVF = 'ivf'
+INDEX_TYPES = (INDEX_FLAT, INDEX_IVF)
+
+DEFAULT_NPROBE = 8
+
+STORAGE_DTYPES = ('float32', 'float16', 'int8')
+DEFAULT_RESCORE_FACTOR = 4 # Candidatos por resultado que se re-puntúan en float32
+
+
+def normalize_embeddings(embeddings):
+    """Devuelve una copia float32 de `embeddings` con cada fila de norma L2 = 1."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0  # Evitar división por cero en vectores nulos
+    return embeddings / norms
+
+
+def top_k(scores, k):
+    """
+    Posiciones de los `k` mayores valores de `scores`, ordenadas de mayor a menor.
+    Usa argpartition (O(N)) y solo ordena los k seleccionados.
+    Las posiciones con puntuación -inf (excluidas por una máscara) se descartan.
+    """
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    ordered = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return ordered[np.isfinite(scores[ordered])]
+
+
+def quantize_embeddings(embeddings, dtype):
+    """
+    Convierte embeddings normalizados al tipo de almacenamiento indicado.
+    Devuelve (datos, escalas); las escalas por fila solo existen para int8.
+    """
+    if dtype not in STORAGE_DTYPES:
+        raise ValueError(f"Tipo de almacenamiento desconocido: {dtype}. Opciones: {', '.join(STORAGE_DTYPES)}.")
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype != 'int8':
+        return embeddings.astype(dtype), None
+    scales = np.abs(embeddings).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    data = np.rint(embeddings / scales[:, None]).astype(np.int8)
+    return data, scales.astype(np.float32)
+
+
+class StoredEmbeddings:
+    """
+    Matriz de embeddings tal como se almacena (float32, float16 o int8 con escala por fila),
+    normalmente abierta con mmap_mode='r' para compartir la caché de páginas entre procesos.
+    `exact` es la copia float32 opcional usada para re-puntuar candidatos.
+    """
+
+    def __init__(self, data, scales=None, exact=None, chunk_size=1024):
+        self.data = data
+        self.scales = scales
+        self.exact = exact
+        self.chunk_size = chunk_size
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def dot(self, query, rows=None):
+        """
+        Producto punto de `query` con todas las filas (o solo con `rows`).
+        Los tipos cuantizados se convierten por bloques en un buffer float32 reutilizado,
+        sin crear una copia float32 de la matriz completa.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        if self.data.dtype == np.float32 and self.scales is None:
+            return (self.data if rows is None else self.data[rows]) @ query
+        n = self.data.shape[0] if rows is None else rows.shape[0]
+        scores = np.empty(n, dtype=np.float32)
+        buffer = np.empty((min(self.chunk_size, n), self.data.shape[1]), dtype=np.float32)
+        for start in range(0, n, self.chunk_size):
+            end = min(start + self.chunk_size, n)
+            block_rows = slice(start, end) if rows is None else rows[start:end]
+            block = buffer[:end - start]
+            np.copyto(block, self.data[block_rows], casting='unsafe')
+            np.matmul(block, query, out=scores[start:end])
+            if self.scales is not None:
+                scores[start:end] *= self.scales[block_rows]
+        return scores
+
+    def exact_dot(self, query, rows):
+        """Puntuaciones float32 exactas para `rows` (si no hay copia exacta, las almacenadas)."""
+        if self.exact is None:
+            return self.dot(query, rows)
+        return self.exact[rows] @ np.asarray(query, dtype=np.float32)
+
+
+def as_stored_embeddings(embeddings):
+    if isinstance(embeddings, StoredEmbeddings):
+        return embeddings
+    return StoredEmbeddings(embeddings)
+
+
+class _BaseIndex:
+    """Re-puntuación común: se piden k * rescore_factor candidatos y se ordenan con float32."""
+    rescore_factor = 0
+
+    @property
+    def ntotal(self):
+        return self.matrix.shape[0]
+
+    def search(self, query, k=1, mask=None, **kwargs):
+        """
+        Devuelve (scores, filas) de los `k` embeddings más similares a `query`.
+        `mask` es un array booleano opcional (una entrada por fila) con las filas elegibles.
+        """
+        if not self.rescore_factor or self.matrix.exact is None:
+            return self._search(query, k, mask, **kwargs)
+        _, candidates = self._search(query, k * self.rescore_factor, mask, **kwargs)
+        candidates = np.sort(candidates) # Lectura secuencial sobre el archivo mapeado
+        scores = self.matrix.exact_dot(query, candidates)
+        best = top_k(scores, k)
+        return scores[best], candidates[best]
+
+
+class FlatIndex(_BaseIndex):
+    """Búsqueda exacta por producto punto sobre todos los embeddings."""
+    index_type = INDEX_FLAT
+
+    def __init__(self, embeddings, rescore_factor=0):
+        self.embeddings = embeddings
+        self.matrix = as_stored_embeddings(embeddings)
+        self.rescore_factor = rescore_factor
+
+    def _search(self, query, k, mask):
+        scores = self.matrix.dot(query)
+        if mask is not None:
+            scores = np.where(mask, scores, -np.inf)
+        rows = top_k(scores, k)
+        return scores[rows], rows
+
+
+class IVFIndex(_BaseIndex):
+    """Índice aproximado de archivo invertido sobre embeddings normalizados."""
+    index_type = INDEX_IVF
+
+    def __init__(self, embeddings, centroids, assignments, nprobe=DEFAULT_NPROBE, rescore_factor=0):
+        self.embeddings = embeddings
+        self.matrix = as_stored_embeddings(embeddings)
+        self.rescore_factor = rescore_factor
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.assignments = np.asarray(assignments, dtype=np.int32)
+        self.nprobe = nprobe
+        # Listas invertidas: filas agrupadas por centroide y offsets de cada lista
+        self.list_rows = np.argsort(self.assignments, kind='stable')
+        counts = np.bincount(self.assignments, minlength=self.nlist)
+        self.list_offsets = np.concatenate(([0], np.cumsum(counts)))
+
+    @property
+    def nlist(self):
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, embeddings, nlist=None, n_iter=10, max_train_size=100_000, seed=0, nprobe=DEFAULT_NPROBE):
+        """
+        Entrena los centroides con k-means esférico sobre una muestra y asigna
+        cada embedding a su centroide más cercano.
+        Por defecto nlist ≈ sqrt(N), lo que mantiene cada lista en ≈ sqrt(N) filas.
+        """
+        n = embeddings.shape[0]
+        if n == 0:
+            raise ValueError("No se puede construir un índice IVF sin embeddings.")
+        if nlist is None:
+            nlist = int(np.sqrt(n))
+        nlist = max(1, min(nlist, n))
+
+        rng = np.random.default_rng(seed)
+        if n > max_train_size:
+            train = embeddings[rng.choice(n, max_train_size, replace=False)]
+        else:
+            train = embeddings
+        centroids = train[rng.choice(train.shape[0], nlist, replace=False)].astype(np.float32)
+
+        for _ in range(n_iter):
+            train_assignments = _assign(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, train_assignments, train)
+            counts = np.bincount(train_assignments, minlength=nlist)
+            empty = counts == 0
+            if empty.any():
+                # Reinicializar centroides vacíos con puntos aleatorios de la muestra
+                sums[empty] = train[rng.choice(train.shape[0], int(empty.sum()))]
+            centroids = normalize_embeddings(sums)
+
+        return cls(embeddings, centroids, _assign(embeddings, centroids), nprobe=nprobe)
+
+    def _search(self, query, k, mask, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        probes = top_k(self.centroids @ query, nprobe)
+        rows = np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes
+        ])
+        if mask is not None:
+            rows = rows[mask[rows]]
+        scores = self.matrix.dot(query, rows)
+        best = top_k(scores, k)
+        return scores[best], rows[best]
+
+    def extend(self, embeddings):
+        """
+        Nuevo índice con los mismos centroides sobre `embeddings`, cuyas primeras filas son
+        las ya indexadas. Las filas añadidas se asignan a su centroide más cercano.
+        """
+        n_indexed = self.assignments.shape[0]
+        assignments = np.concatenate((self.assignments, _assign(embeddings[n_indexed:], self.centroids)))
+        return IVFIndex(embeddings, self.centroids, assignments, nprobe=self.nprobe)
+
+    def subset(self, rows):
+        """Nuevo índice que conserva solo las filas indicadas (compactación)."""
+        return IVFIndex(self.embeddings[rows], self.centroids, self.assignments[rows], nprobe=self.nprobe)
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, assignments=self.assignments)
+
+    @classmethod
+    def load(cls, path, embeddings, nprobe=DEFAULT_NPROBE, rescore_factor=0):
+        with np.load(path) as data:
+            centroids = data['centroids']
+            assignments = data['assignments']
+        if assignments.shape[0] != embeddings.shape[0]:
+            raise ValueError(
+                f"El índice IVF ({assignments.shape[0]} filas) no corresponde a los embeddings "
+                f"({embeddings.shape[0]} filas). Regenera el índice con 'generate_image_embeddings'."
+            )
+        return cls(embeddings, centroids, assignments, nprobe=nprobe, rescore_factor=rescore_factor)
+
+
+def _assign(embeddings, centroids, chunk_size=8192):
+    """Centroide más cercano (mayor producto punto) para cada fila, por bloques."""
+    assignments = np.empty(embeddings.shape[0], dtype=np.int32)
+    for start in range(0, embeddings.shape[0], chunk_size):
+        block = embeddings[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def load_index(embeddings, index_type=INDEX_FLAT, ivf_path=None, nprobe=DEFAULT_NPROBE, rescore_factor=0):
+    """
+    Crea el índice configurado sobre `embeddings` (ya normalizados; array o StoredEmbeddings).
+    Si el archivo IVF no existe o no corresponde a los embeddings, se usa FlatIndex.
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Tipo de índice desconocido: {index_type}. Opciones: {', '.join(INDEX_TYPES)}.")
+    if index_type == INDEX_IVF:
+        if ivf_path and os.path.exists(ivf_path):
+            try:
+                return IVFIndex.load(ivf_path, embeddings, nprobe=nprobe, rescore_factor=rescore_factor)
+            except ValueError as e:
+                logger.warning("%s Se usará búsqueda exacta.", e)
+        else:
+            logger.warning("Índice IVF no encontrado en %s. Se usará búsqueda exacta.", ivf_path)
+    return FlatIndex(embeddings, rescore_factor=rescore_factor)
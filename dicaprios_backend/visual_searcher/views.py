@@ -1,135 +1,518 @@
 from django.shortcuts import render
 
 # Create your views here.
+import asyncio
+import contextvars
+import functools
+import logging
 import os
 import numpy as np
-import tempfile # Para manejar archivos temporales de forma segura
+from concurrent.futures import ThreadPoolExecutor
 
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.db import connections
+from django.http import JsonResponse
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework.views import APIView
+from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.parsers import MultiPartParser, FormParser
-from rest_framework import status
+from rest_framework import exceptions, status
+from rest_framework.permissions import AllowAny
+from rest_framework.settings import api_settings
 
 # Importaciones de modelos y serializadores de la app 'productos'
 from productos.models import Producto # Asegúrate que el nombre de tu modelo Producto es correcto
 from productos.serializers import ProductoSerializer # Y que tu serializador es correcto
 
-# Intentar importar TensorFlow y sus componentes.
-try:
-    
-    os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
-    import tensorflow as tf
-    from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
-    from tensorflow.keras.preprocessing import image as keras_image
-    # Model no es estrictamente necesario aquí si ResNet50(pooling='avg') ya da el vector
-except ImportError:
-    # Este error debería haberse manejado en la instalación, pero es bueno tener un fallback.
-    # En un entorno de producción, el servidor podría no iniciar si esto falla.
-    tf = None 
-    ResNet50 = None
-    preprocess_input = None
-    keras_image = None
-    # print("ADVERTENCIA: TensorFlow no está instalado. El Buscador Visual no funcionará.")
-
-# Intentar importar scikit-learn para cosine_similarity
-try:
-    from sklearn.metrics.pairwise import cosine_similarity
-except ImportError:
-    cosine_similarity = None
-    # print("ADVERTENCIA: scikit-learn no está instalado. El Buscador Visual no funcionará.")
-
-
-# --- Configuración de IA y Carga Perezosa ---
-IMG_WIDTH, IMG_HEIGHT = 224, 224 # Tamaño de entrada para ResNet50
-
-# Rutas a los archivos de embeddings (igual que en generate_image_embeddings.py)
-EMBEDDINGS_DIR = os.path.join(settings.MEDIA_ROOT, 'ia_embeddings')
-EMBEDDINGS_FILE = os.path.join(EMBEDDINGS_DIR, 'product_embeddings.npy')
-PRODUCT_IDS_FILE = os.path.join(EMBEDDINGS_DIR, 'product_ids.npy')
+import threading
+import time
+
+from .vector_index import normalize_embeddings, load_index, INDEX_FLAT, DEFAULT_NPROBE, DEFAULT_RESCORE_FACTOR
+from .filters import ProductRowFilters
+from .inference import BatchingInferenceService
+from .embedding_cache import QueryEmbeddingCache, image_digest
+from .admission import AdmissionController
+from .preprocessing import load_image_array, query_batch_buffer, preprocess_resnet50, ImageTooLargeError, IMG_HEIGHT, IMG_WIDTH, DEFAULT_MAX_QUERY_PIXELS
+from .backends import build_embedder, BACKEND_KERAS
+from . import store
+from Dicaprios.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+
+# --- Configuración de IA y Carga al Arranque ---
+# Máximo de píxeles aceptado en una imagen de consulta (protección ante bombas de descompresión)
+MAX_QUERY_PIXELS = getattr(settings, 'VISUAL_SEARCH_MAX_QUERY_PIXELS', DEFAULT_MAX_QUERY_PIXELS)
+
+# Tipo de índice ('flat' exacto o 'ivf' aproximado) y listas a recorrer en IVF.
+# Subir VISUAL_SEARCH_NPROBE mejora el recall a costa de latencia.
+INDEX_TYPE = getattr(settings, 'VISUAL_SEARCH_INDEX', INDEX_FLAT)
+INDEX_NPROBE = getattr(settings, 'VISUAL_SEARCH_NPROBE', DEFAULT_NPROBE)
+# Con embeddings cuantizados (float16/int8), candidatos por resultado que se re-puntúan en float32 (0 = sin re-puntuar)
+INDEX_RESCORE_FACTOR = getattr(settings, 'VISUAL_SEARCH_RESCORE_FACTOR', DEFAULT_RESCORE_FACTOR)
+
+
+class LoadedSearchIndex:
+    """Una versión del índice cargada en memoria. Se reemplaza entera al cambiar de versión."""
+
+    def __init__(self, index_version):
+        self.version = index_version.version
+        self.product_ids = index_version.product_ids
+        # Embeddings ya normalizados y mapeados en memoria (compartidos entre procesos)
+        self.embeddings = index_version.stored_embeddings(rescore=INDEX_RESCORE_FACTOR > 0)
+        self.index = load_index(
+            self.embeddings, INDEX_TYPE, index_version.ivf_path, INDEX_NPROBE, rescore_factor=INDEX_RESCORE_FACTOR
+        )
+        self.row_filters = ProductRowFilters(self.product_ids, live_mask=index_version.live_mask).build()
+
+
+# Motor de inferencia ('keras', 'onnx' o 'tflite'; ver backends.py y el comando 'export_visual_model')
+INFERENCE_BACKEND = getattr(settings, 'VISUAL_SEARCH_INFERENCE_BACKEND', BACKEND_KERAS)
+INFERENCE_QUANTIZED = getattr(settings, 'VISUAL_SEARCH_INFERENCE_QUANTIZED', False)
+INFERENCE_THREADS = getattr(settings, 'VISUAL_SEARCH_INFERENCE_THREADS', None) # None: lo decide el motor
+
+# Agrupación dinámica de consultas concurrentes en un solo lote de inferencia
+DYNAMIC_BATCHING = getattr(settings, 'VISUAL_SEARCH_DYNAMIC_BATCHING', True)
+INFERENCE_MAX_BATCH_SIZE = getattr(settings, 'VISUAL_SEARCH_MAX_BATCH_SIZE', 32)
+INFERENCE_MAX_WAIT_MS = getattr(settings, 'VISUAL_SEARCH_MAX_BATCH_WAIT_MS', 5)
+INFERENCE_TIMEOUT_SECONDS = 30 # Tiempo máximo que una petición espera su embedding
+
+# Caché de embeddings de consulta por hash de la imagen (alias de CACHES; None la desactiva)
+EMBEDDING_CACHE_ALIAS = getattr(settings, 'VISUAL_SEARCH_CACHE_ALIAS', None)
+EMBEDDING_CACHE = QueryEmbeddingCache(EMBEDDING_CACHE_ALIAS) if EMBEDDING_CACHE_ALIAS else None
+
+# Vista asíncrona (ASGI): hilos para decodificar, preprocesar y buscar, y control de admisión.
+# Con VISUAL_SEARCH_MAX_CONCURRENT búsquedas en curso, las siguientes esperan turno;
+# si ya hay VISUAL_SEARCH_MAX_QUEUE esperando, o la espera supera el límite, se responde 503.
+ASYNC_WORKERS = getattr(settings, 'VISUAL_SEARCH_ASYNC_WORKERS', min(4, os.cpu_count() or 1))
+ADMISSION = AdmissionController(
+    max_active=getattr(settings, 'VISUAL_SEARCH_MAX_CONCURRENT', 2 * ASYNC_WORKERS),
+    max_queue=getattr(settings, 'VISUAL_SEARCH_MAX_QUEUE', 32),
+    queue_timeout=getattr(settings, 'VISUAL_SEARCH_QUEUE_TIMEOUT_SECONDS', 5),
+)
+ADMISSION_RETRY_AFTER_SECONDS = 1
+
 
 # Variables globales para almacenar los componentes de IA cargados
-RESNET_MODEL_INSTANCE = None
-ALL_PRODUCT_EMBEDDINGS = None
-ALL_PRODUCT_IDS = None
-IA_COMPONENTS_LOADED = False
-IA_LOAD_ERROR = None # Para almacenar cualquier error durante la carga
+RESNET_MODEL_INSTANCE = None # Motor de inferencia de ResNet50 (Keras, ONNX o TFLite)
+INFERENCE_SERVICE = None # BatchingInferenceService (None si la agrupación está desactivada)
+SEARCH_INDEX = None # LoadedSearchIndex activo (None si aún no se ha generado ningún índice)
+IA_COMPONENTS_LOADED = False # True cuando el modelo está cargado y ya ejecutó una inferencia de prueba
+IA_LOAD_ERROR = None # Último error de carga (se reintenta con espera exponencial); solo para el log
+IA_LOAD_ERROR_CODE = None # Código del último error de carga, el único dato que se expone en las respuestas
+
+LOAD_RETRY_BASE_SECONDS = 5 # Espera tras el primer fallo de carga; se duplica en cada intento
+LOAD_RETRY_MAX_SECONDS = 300
+
+_load_lock = threading.Lock()
+_warm_up_thread = None
+_load_attempts = 0
+_next_retry_at = None # None: sin reintento pendiente (cargado o error permanente)
 
 SIMILARITY_THRESHOLD = 0.65 # Umbral de similitud (ajustar según pruebas)
+MAX_RESULTS = 50 # Máximo de resultados (k) por búsqueda
+FILTERS_MAX_AGE_SECONDS = 60 # Cada cuánto se recalculan (en segundo plano) las máscaras de filtros (stock, categoría...)
+INDEX_CHECK_INTERVAL_SECONDS = 5 # Cada cuánto se comprueba si hay una versión nueva del índice
+
+_index_lock = threading.Lock()
+_index_checked_at = 0.0
+_filters_refreshing = False # True mientras un hilo recalcula las máscaras de filtros
+
+_executor_lock = threading.Lock()
+_cpu_executor = None
+
+
+def _refresh_search_index(force=False):
+    """
+    Carga la versión activa del índice si es distinta de la que está en memoria.
+    El cambio es atómico: las peticiones en curso siguen usando la versión anterior.
+    Si las máscaras de filtros caducaron, las recalcula en segundo plano.
+    """
+    global SEARCH_INDEX, _index_checked_at, _filters_refreshing
+
+    now = time.monotonic()
+    if not force and now - _index_checked_at < INDEX_CHECK_INTERVAL_SECONDS:
+        return
+    with _index_lock:
+        if not force and now - _index_checked_at < INDEX_CHECK_INTERVAL_SECONDS:
+            return # Otro hilo acaba de comprobarlo
+        _index_checked_at = now
+        version = store.current_version()
+        if version is not None and (SEARCH_INDEX is None or SEARCH_INDEX.version != version):
+            _load_search_index(version)
+
+        search_index = SEARCH_INDEX
+        stale = search_index is not None and search_index.row_filters.is_stale(FILTERS_MAX_AGE_SECONDS)
+        if stale and not _filters_refreshing:
+            _filters_refreshing = True # Un solo recálculo a la vez
+            threading.Thread(
+                target=_row_filters_worker, args=(search_index,), name='visual-search-filters', daemon=True
+            ).start()
+
+
+def _load_search_index(version):
+    """Carga `version` y la publica en SEARCH_INDEX. Se llama con _index_lock tomado."""
+    global SEARCH_INDEX
+    try:
+        loaded = LoadedSearchIndex(store.read_version(version))
+    except Exception:
+        logger.exception("Error al cargar la versión %s del índice de búsqueda visual", version)
+        return
+    SEARCH_INDEX = loaded
+    if loaded.version == 0:
+        logger.warning(
+            "El índice antiguo (versión 0) se generó con otro preprocesado de imágenes y sus resultados "
+            "no son fiables. Regenéralo con 'generate_image_embeddings'."
+        )
+    logger.info(
+        "Índice de búsqueda visual v%s cargado (%s filas, índice '%s').",
+        loaded.version, loaded.index.ntotal, loaded.index.index_type,
+    )
+
+
+def _refresh_row_filters(search_index):
+    """
+    Recalcula las máscaras de filtros (una lectura completa de Producto) en un objeto nuevo
+    y lo publica con una sola asignación: una búsqueda en curso sigue combinando las
+    máscaras de una misma lectura.
+    """
+    current = search_index.row_filters
+    search_index.row_filters = ProductRowFilters(current.product_ids, live_mask=current.live_mask).build()
+
+
+def _row_filters_worker(search_index):
+    global _filters_refreshing
+    try:
+        _refresh_row_filters(search_index)
+    except Exception:
+        # Se sigue usando la versión anterior; la siguiente comprobación lo reintenta
+        logger.exception("Error al recalcular las máscaras de filtros de la búsqueda visual")
+    finally:
+        _filters_refreshing = False
+        connections.close_all() # Conexiones abiertas por este hilo
+
 
 def _load_ia_components():
     """
-    Carga perezosamente el modelo ResNet50 y los embeddings de productos.
-    Se llama una vez por proceso de Django.
+    Carga el modelo ResNet50, ejecuta una inferencia de prueba (la primera llamada
+    construye el grafo de TensorFlow) y carga el índice de embeddings.
+    Devuelve True si todo quedó listo. Si falla, programa el siguiente reintento
+    con espera exponencial; si faltan dependencias, el error es permanente.
     """
-    global RESNET_MODEL_INSTANCE, ALL_PRODUCT_EMBEDDINGS, ALL_PRODUCT_IDS, IA_COMPONENTS_LOADED, IA_LOAD_ERROR
+    global RESNET_MODEL_INSTANCE, INFERENCE_SERVICE, IA_COMPONENTS_LOADED, IA_LOAD_ERROR, IA_LOAD_ERROR_CODE
+    global _load_attempts, _next_retry_at
 
     if IA_COMPONENTS_LOADED:
-        return IA_LOAD_ERROR is None # Devuelve True si se cargó sin error, False si hubo error previo
-
-    if tf is None or ResNet50 is None or preprocess_input is None or keras_image is None or cosine_similarity is None:
-        IA_LOAD_ERROR = "Dependencias críticas de IA (TensorFlow, scikit-learn) no están disponibles."
-        IA_COMPONENTS_LOADED = True # Marcamos como 'cargado' para no reintentar y fallar repetidamente
-        print(f"ERROR AL CARGAR COMPONENTES IA: {IA_LOAD_ERROR}")
-        return False
+        return True
 
+    _load_attempts += 1
     try:
-        # 1. Cargar modelo ResNet50
-        RESNET_MODEL_INSTANCE = ResNet50(weights='imagenet', include_top=False, pooling='avg', input_shape=(IMG_WIDTH, IMG_HEIGHT, 3))
-        print("Modelo ResNet50 cargado para búsqueda visual.")
-
-        # 2. Cargar embeddings y IDs de productos
-        if not os.path.exists(EMBEDDINGS_FILE) or not os.path.exists(PRODUCT_IDS_FILE):
-            IA_LOAD_ERROR = f"Archivos de embeddings ({EMBEDDINGS_FILE}) o IDs ({PRODUCT_IDS_FILE}) no encontrados. Ejecuta el comando 'generate_image_embeddings'."
-            print(f"ERROR AL CARGAR COMPONENTES IA: {IA_LOAD_ERROR}")
-            IA_COMPONENTS_LOADED = True 
-            return False
-
-        ALL_PRODUCT_EMBEDDINGS = np.load(EMBEDDINGS_FILE)
-        ALL_PRODUCT_IDS = np.load(PRODUCT_IDS_FILE)
-        print(f"Embeddings de productos ({ALL_PRODUCT_EMBEDDINGS.shape[0]}) cargados para búsqueda visual.")
-        
+        # 1. Cargar modelo ResNet50 con el motor configurado
+        if RESNET_MODEL_INSTANCE is None:
+            try:
+                RESNET_MODEL_INSTANCE = build_embedder(INFERENCE_BACKEND, INFERENCE_QUANTIZED, INFERENCE_THREADS)
+            except ImportError as e:
+                IA_LOAD_ERROR = f"Dependencias críticas de IA no están disponibles: {e}"
+                IA_LOAD_ERROR_CODE = 'missing_dependencies'
+                _next_retry_at = None # Reintentar no lo va a solucionar
+                logger.error("Error al cargar los componentes de IA: %s", IA_LOAD_ERROR)
+                return False
+            logger.info("Modelo ResNet50 cargado para búsqueda visual (motor '%s').", RESNET_MODEL_INSTANCE.name)
+        if DYNAMIC_BATCHING and INFERENCE_SERVICE is None:
+            INFERENCE_SERVICE = BatchingInferenceService(
+                RESNET_MODEL_INSTANCE.predict_batch,
+                max_batch_size=INFERENCE_MAX_BATCH_SIZE,
+                max_wait_ms=INFERENCE_MAX_WAIT_MS,
+            )
+
+        # 2. Inferencia de prueba por el mismo camino que usan las consultas
+        dummy = np.zeros((1, IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+        if INFERENCE_SERVICE is not None:
+            INFERENCE_SERVICE.embed(dummy[0], timeout=INFERENCE_TIMEOUT_SECONDS)
+        else:
+            RESNET_MODEL_INSTANCE.predict_batch(dummy)
+
+        # 3. Cargar embeddings y IDs de productos (las versiones nuevas se detectan en cada búsqueda)
+        _refresh_search_index(force=True)
+        if SEARCH_INDEX is None:
+            logger.warning(
+                "No hay índice de embeddings en %s. Ejecuta el comando 'generate_image_embeddings'.", store.EMBEDDINGS_DIR
+            )
+
         IA_COMPONENTS_LOADED = True
         IA_LOAD_ERROR = None # No hubo error
+        IA_LOAD_ERROR_CODE = None
+        _next_retry_at = None
         return True
     except Exception as e:
         IA_LOAD_ERROR = f"Excepción al cargar componentes de IA: {e}"
-        print(f"ERROR AL CARGAR COMPONENTES IA: {IA_LOAD_ERROR}")
+        IA_LOAD_ERROR_CODE = 'load_failed'
         RESNET_MODEL_INSTANCE = None # Asegurar que no se usen si la carga falló
-        ALL_PRODUCT_EMBEDDINGS = None
-        ALL_PRODUCT_IDS = None
-        IA_COMPONENTS_LOADED = True # Marcamos como 'cargado' para no reintentar y fallar repetidamente
+        INFERENCE_SERVICE = None
+        delay = min(LOAD_RETRY_BASE_SECONDS * 2 ** (_load_attempts - 1), LOAD_RETRY_MAX_SECONDS)
+        _next_retry_at = time.monotonic() + delay
+        logger.exception(
+            "Error al cargar los componentes de IA (intento %s, nuevo intento en %ss)", _load_attempts, delay
+        )
         return False
 
+
+def _warm_up_loop():
+    """Hilo de calentamiento: reintenta la carga hasta lograrlo o hasta un error permanente."""
+    global _warm_up_thread
+    try:
+        while not _load_ia_components() and _next_retry_at is not None:
+            time.sleep(max(0.0, _next_retry_at - time.monotonic()))
+    finally:
+        with _load_lock:
+            _warm_up_thread = None
+
+
+def start_warm_up():
+    """
+    Inicia en segundo plano la carga de los componentes de IA, si no están cargados
+    ni cargándose ya. Se llama desde VisualSearcherConfig.ready() al arrancar el proceso.
+    """
+    global _warm_up_thread
+    with _load_lock:
+        if IA_COMPONENTS_LOADED or (_warm_up_thread is not None and _warm_up_thread.is_alive()):
+            return
+        if IA_LOAD_ERROR and _next_retry_at is None:
+            return # Error permanente (p. ej. TensorFlow no instalado)
+        _warm_up_thread = threading.Thread(target=_warm_up_loop, name='visual-search-warm-up', daemon=True)
+        _warm_up_thread.start()
+
+
+def _reset_after_fork():
+    """
+    En el proceso hijo de un fork (p. ej. gunicorn --preload) solo sobrevive el hilo que
+    hizo el fork: el hilo de calentamiento, el de las máscaras de filtros y el pool de la
+    vista asíncrona heredados ya no existen, y sus candados pueden haberse copiado tomados. Se descartan para que el hijo
+    inicie los suyos.
+    """
+    global _load_lock, _warm_up_thread, _index_lock, _filters_refreshing, _executor_lock, _cpu_executor
+    _load_lock = threading.Lock()
+    _warm_up_thread = None
+    _index_lock = threading.Lock()
+    _filters_refreshing = False
+    _executor_lock = threading.Lock()
+    _cpu_executor = None
+
+
+if hasattr(os, 'register_at_fork'): # No existe en Windows
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def ia_status():
+    """Estado de los componentes de IA para el endpoint de salud."""
+    search_index = SEARCH_INDEX
+    if IA_COMPONENTS_LOADED:
+        state = 'ready' if search_index is not None else 'no_index'
+    elif IA_LOAD_ERROR and _next_retry_at is None:
+        state = 'error'
+    else:
+        state = 'starting'
+    return {
+        "status": state,
+        "model_loaded": IA_COMPONENTS_LOADED,
+        "inference_backend": RESNET_MODEL_INSTANCE.name if RESNET_MODEL_INSTANCE is not None else None,
+        "index_loaded": search_index is not None,
+        "index_version": search_index.version if search_index is not None else None,
+        "index_rows": search_index.index.ntotal if search_index is not None else 0,
+        "load_attempts": _load_attempts,
+        "error": IA_LOAD_ERROR_CODE, # El detalle solo va al log
+        "embedding_cache": EMBEDDING_CACHE.stats() if EMBEDDING_CACHE is not None else None,
+        "admission": ADMISSION.stats(),
+    }
+
+
+def _preprocess_query(image_file_obj, batch):
+    """Decodifica la imagen de consulta en `batch[0]` y la preprocesa. Devuelve `batch`."""
+    # InMemoryUploadedFile y TemporaryUploadedFile se leen tal cual, sin copiarlos a disco
+    image_file_obj.seek(0)
+    with stage('decode'):
+        img_array = load_image_array(image_file_obj, max_pixels=MAX_QUERY_PIXELS)
+    batch[0] = img_array
+    with stage('preprocess'):
+        return preprocess_resnet50(batch)
+
+
 def _get_embedding_for_query(image_file_obj, model):
     """
     Genera un embedding para una imagen de consulta (objeto archivo).
-    Guarda temporalmente el archivo para procesarlo.
+    La imagen se decodifica en memoria directamente desde el archivo subido.
+    Lanza ImageTooLargeError si la imagen supera MAX_QUERY_PIXELS.
     """
-    if model is None or keras_image is None or preprocess_input is None:
-        print("Error: Modelo ResNet50 o componentes de Keras no disponibles para generar embedding.")
+    if model is None:
+        logger.error("Modelo ResNet50 no disponible para generar el embedding de consulta.")
         return None
-        
+
     try:
-        # Crear un archivo temporal para guardar la imagen subida
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp_file:
-            for chunk in image_file_obj.chunks():
-                tmp_file.write(chunk)
-            tmp_file_path = tmp_file.name
-        
-        img = keras_image.load_img(tmp_file_path, target_size=(IMG_WIDTH, IMG_HEIGHT))
-        img_array = keras_image.img_to_array(img)
-        img_array_expanded = np.expand_dims(img_array, axis=0)
-        img_preprocessed = preprocess_input(img_array_expanded)
-        embedding = model.predict(img_preprocessed, verbose=0)
-        return embedding.flatten()
-    except Exception as e:
-        print(f"Error generando embedding para imagen de consulta: {e}")
+        img_preprocessed = _preprocess_query(image_file_obj, query_batch_buffer())
+        with stage('inference'): # Con agrupación dinámica incluye la espera en la cola
+            if INFERENCE_SERVICE is not None:
+                # El hilo de inferencia agrupa esta imagen con las de otras peticiones concurrentes
+                return INFERENCE_SERVICE.embed(img_preprocessed[0], timeout=INFERENCE_TIMEOUT_SECONDS)
+            embedding = model.predict_batch(img_preprocessed)
+        return np.asarray(embedding).flatten()
+    except ImageTooLargeError:
+        raise
+    except Exception:
+        logger.exception("Error generando el embedding de la imagen de consulta")
         return None
-    finally:
-        # Asegurarse de borrar el archivo temporal
-        if 'tmp_file_path' in locals() and os.path.exists(tmp_file_path):
-            os.remove(tmp_file_path)
+
+
+def _cpu_pool():
+    global _cpu_executor
+    if _cpu_executor is None:
+        with _executor_lock:
+            if _cpu_executor is None:
+                _cpu_executor = ThreadPoolExecutor(max_workers=ASYNC_WORKERS, thread_name_prefix='visual-search-cpu')
+    return _cpu_executor
+
+
+async def _run_cpu(func, *args):
+    """
+    Ejecuta `func` en el pool de hilos de la vista asíncrona, con el contexto de la
+    petición (para que `stage()` sume a sus métricas). El tamaño del pool limita cuántas
+    decodificaciones y búsquedas compiten a la vez por la CPU.
+    """
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(_cpu_pool(), functools.partial(context.run, func, *args))
+
+
+async def _aget_embedding_for_query(image_file_obj, model):
+    """
+    Versión asíncrona de `_get_embedding_for_query`: decodifica y preprocesa en el pool
+    de hilos y espera la inferencia sin bloquear el bucle de eventos (en el servicio de
+    agrupación dinámica o, si está desactivado, también en el pool).
+    """
+    if model is None:
+        logger.error("Modelo ResNet50 no disponible para generar el embedding de consulta.")
+        return None
+
+    try:
+        # Buffer propio, no el del hilo: el hilo del pool pasa a otra petición mientras
+        # esta espera la inferencia, que puede ejecutarse en otro hilo del pool
+        batch = np.empty((1, IMG_HEIGHT, IMG_WIDTH, 3), dtype=np.float32)
+        img_preprocessed = await _run_cpu(_preprocess_query, image_file_obj, batch)
+        with stage('inference'): # Con agrupación dinámica incluye la espera en la cola
+            if INFERENCE_SERVICE is not None:
+                future = asyncio.wrap_future(INFERENCE_SERVICE.submit(img_preprocessed[0]))
+                return await asyncio.wait_for(future, INFERENCE_TIMEOUT_SECONDS)
+            embedding = await _run_cpu(model.predict_batch, img_preprocessed)
+        return np.asarray(embedding).flatten()
+    except ImageTooLargeError:
+        raise
+    except Exception:
+        logger.exception("Error generando el embedding de la imagen de consulta")
+        return None
+
+
+def _cached_query_embedding(search_index, image_file):
+    """Devuelve (hash de la imagen, embedding en caché o None)."""
+    with stage('embedding_cache'):
+        digest = image_digest(image_file)
+        return digest, EMBEDDING_CACHE.get(search_index.version, digest, RESNET_MODEL_INSTANCE.name)
+
+
+def _parse_search_params(data):
+    """
+    Lee 'k' y los filtros opcionales de la petición.
+    Devuelve (parámetros, mensaje de error).
+    """
+    params = {}
+    try:
+        k = int(data.get('k') or 1)
+    except (TypeError, ValueError):
+        return None, "El parámetro 'k' debe ser un número entero."
+    if k < 1 or k > MAX_RESULTS:
+        return None, f"El parámetro 'k' debe estar entre 1 y {MAX_RESULTS}."
+    params['k'] = k
+
+    for field in ('categoria_id', 'proveedor_id'):
+        value = data.get(field)
+        if value in (None, ''):
+            params[field] = None
+            continue
+        try:
+            params[field] = int(value)
+        except (TypeError, ValueError):
+            return None, f"El parámetro '{field}' debe ser un número entero."
+
+    params['talla'] = data.get('talla') or None
+    params['in_stock'] = str(data.get('en_stock', '')).lower() in ('1', 'true', 'si', 'sí')
+    return params, None
+
+
+def _search(search_index, query_embedding, params, row_filters):
+    """Busca los k mejores candidatos en el índice, aplicando los filtros como máscara de filas."""
+    with stage('filters'):
+        mask = row_filters.mask(
+            categoria_id=params['categoria_id'],
+            proveedor_id=params['proveedor_id'],
+            talla=params['talla'],
+            in_stock=params['in_stock'],
+        )
+    with stage('similarity'):
+        return search_index.index.search(normalize_embeddings(query_embedding), k=params['k'], mask=mask)
+
+
+def _matches(search_index, scores, rows):
+    """
+    Filas que superan SIMILARITY_THRESHOLD. Devuelve (IDs de producto, puntuaciones,
+    respuesta), con `respuesta` = None si hay coincidencias o la respuesta sin resultados.
+    """
+    if rows.size == 0:
+        return None, None, {
+            "match_found": False,
+            "message": "No se encontró ningún producto que cumpla los filtros indicados.",
+            "results": [],
+        }
+
+    best_similarity_score = float(scores[0])
+    above_threshold = scores >= SIMILARITY_THRESHOLD
+    if not above_threshold.any():
+        return None, None, {
+            "match_found": False,
+            "message": f"No se encontró ningún producto suficientemente similar. Mejor similitud: {best_similarity_score:.2f}",
+            "best_similarity_score": best_similarity_score,
+            "results": [],
+        }
+    matched_ids = [int(product_id) for product_id in search_index.product_ids[rows[above_threshold]]]
+    return matched_ids, scores[above_threshold], None
+
+
+def _results_payload(matched_ids, matched_scores, productos, request):
+    """Respuesta con los productos coincidentes, en orden de similitud. Devuelve (datos, código)."""
+    results = []
+    for product_id, score in zip(matched_ids, matched_scores):
+        producto = productos.get(product_id)
+        if producto is None:
+            # Producto eliminado después de generar los embeddings
+            continue
+        results.append({
+            "product": ProductoSerializer(producto, context={'request': request}).data,
+            "similarity_score": float(score), # Convertir a float nativo de Python
+        })
+
+    if not results:
+        return {
+            "match_found": False,
+            "message": "Producto coincidente encontrado por IA pero no existe en la base de datos.",
+            "results": [],
+        }, status.HTTP_404_NOT_FOUND
+
+    # 'product' y 'similarity_score' corresponden a la mejor coincidencia (compatibilidad con el frontend)
+    return {
+        "match_found": True,
+        "product": results[0]["product"],
+        "similarity_score": results[0]["similarity_score"],
+        "results": results,
+    }, status.HTTP_200_OK
 
 
 class VisualSearchAPIView(APIView):
@@ -137,67 +520,217 @@ class VisualSearchAPIView(APIView):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
-        # Intentar cargar los componentes de IA al instanciar la vista la primera vez o cuando el servidor inicie
-        # y la vista sea importada.
-        # Una mejor práctica para producción sería usar el método ready() de AppConfig.
+        # Normalmente VisualSearcherConfig.ready() ya inició la carga al arrancar el proceso;
+        # si está desactivada o falló, se inicia (o reintenta) aquí en segundo plano.
         if not IA_COMPONENTS_LOADED:
-            _load_ia_components()
+            start_warm_up()
 
     def post(self, request, *args, **kwargs):
-        if IA_LOAD_ERROR: # Si hubo un error al cargar los componentes de IA
-            return Response(
-                {"error": f"El servicio de búsqueda visual no está disponible debido a un error interno: {IA_LOAD_ERROR}"},
+        if not IA_COMPONENTS_LOADED:
+            if IA_LOAD_ERROR and _next_retry_at is None: # Error permanente al cargar los componentes de IA
+                return Response(
+                    {"error": "El servicio de búsqueda visual no está disponible debido a un error interno."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+            response = Response(
+                {"error": "El servicio de búsqueda visual se está iniciando. Inténtalo de nuevo en unos segundos."},
                 status=status.HTTP_503_SERVICE_UNAVAILABLE
             )
-        
-        if RESNET_MODEL_INSTANCE is None or ALL_PRODUCT_EMBEDDINGS is None or ALL_PRODUCT_IDS is None or cosine_similarity is None:
-            # Esto es una doble verificación o si _load_ia_components no se llamó correctamente
+            response['Retry-After'] = str(LOAD_RETRY_BASE_SECONDS)
+            return response
+
+        if RESNET_MODEL_INSTANCE is None:
+            # Doble verificación: no debería ocurrir si la carga terminó correctamente
             return Response(
                 {"error": "Componentes de IA no inicializados correctamente. Contacte al administrador."},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        _refresh_search_index()
+        search_index = SEARCH_INDEX # Referencia local: la versión no cambia durante la petición
+        if search_index is None:
+            return Response(
+                {"error": "El índice de búsqueda visual aún no se ha generado. Ejecuta el comando 'generate_image_embeddings'."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
         image_file = request.data.get('image') # 'image' es el nombre del campo en FormData
 
         if not image_file:
             return Response({"error": "No se proporcionó ninguna imagen."}, status=status.HTTP_400_BAD_REQUEST)
 
-        # 1. Generar embedding para la imagen de consulta
-        query_embedding = _get_embedding_for_query(image_file, RESNET_MODEL_INSTANCE)
+        params, error = _parse_search_params(request.data)
+        if error:
+            return Response({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 1. Generar embedding para la imagen de consulta (o reutilizarlo si ya se subió la misma imagen)
+        query_embedding = digest = None
+        if EMBEDDING_CACHE is not None:
+            digest, query_embedding = _cached_query_embedding(search_index, image_file)
+        if query_embedding is None:
+            try:
+                query_embedding = _get_embedding_for_query(image_file, RESNET_MODEL_INSTANCE)
+            except ImageTooLargeError as e:
+                return Response({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            if query_embedding is not None and digest is not None:
+                EMBEDDING_CACHE.set(search_index.version, digest, query_embedding, RESNET_MODEL_INSTANCE.name)
 
         if query_embedding is None:
             return Response({"error": "No se pudo procesar la imagen subida."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        # 2. Calcular similitudes
-        # query_embedding es (D,), ALL_PRODUCT_EMBEDDINGS es (N, D). Reshape query_embedding a (1, D)
-        similarities = cosine_similarity(query_embedding.reshape(1, -1), ALL_PRODUCT_EMBEDDINGS)
-        
-        # Similarities es un array de forma (1, N), queremos el array de N similitudes
-        product_similarities = similarities[0]
+        # 2. Buscar los k mejores candidatos en el índice, aplicando los filtros como máscara de filas
+        scores, rows = _search(search_index, query_embedding, params, search_index.row_filters)
+        matched_ids, matched_scores, no_match = _matches(search_index, scores, rows)
+        if no_match is not None:
+            return Response(no_match, status=status.HTTP_200_OK)
+
+        # 3. Traer todos los productos coincidentes en una sola consulta
+        productos = Producto.objects.select_related('categoria', 'proveedor').in_bulk(matched_ids)
+        payload, code = _results_payload(matched_ids, matched_scores, productos, request)
+        return Response(payload, status=code)
+
+
+class AsyncVisualSearchView(View):
+    """
+    Búsqueda visual asíncrona para servidores ASGI (uvicorn, daphne). Misma entrada y
+    respuesta que VisualSearchAPIView, sin ocupar un hilo por petición:
+    - El cuerpo de la petición ya llega leído de forma asíncrona por el servidor ASGI;
+      el análisis del formulario multipart, la decodificación, el preprocesado y la
+      búsqueda de similitud se ejecutan en un pool de hilos acotado
+      (VISUAL_SEARCH_ASYNC_WORKERS).
+    - La inferencia se espera sobre el Future del servicio de agrupación dinámica.
+    - Los productos se leen con el ORM asíncrono.
+    - El control de admisión (ver admission.py) limita las búsquedas en curso y en
+      cola; por encima responde 503 con Retry-After.
+
+    Es una vista de Django y no de DRF (APIView no admite manejadores asíncronos): la
+    autenticación y los permisos por defecto de DRF se aplican en `_authorize`.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Se autentica con el token JWT de la cabecera, no con la cookie de sesión: sin CSRF, como APIView
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    def _authorize(self, request):
+        """Aplica DEFAULT_AUTHENTICATION_CLASSES y DEFAULT_PERMISSION_CLASSES. Devuelve una respuesta de error o None."""
+        drf_request = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+        try:
+            drf_request.user # Ejecuta los autenticadores
+            for permission_class in api_settings.DEFAULT_PERMISSION_CLASSES:
+                if not permission_class().has_permission(drf_request, self):
+                    if drf_request.authenticators and not drf_request.successful_authenticator:
+                        raise exceptions.NotAuthenticated()
+                    raise exceptions.PermissionDenied()
+        except exceptions.APIException as e:
+            response = JsonResponse({"detail": str(e.detail)}, status=e.status_code)
+            if isinstance(e, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                # Igual que APIView: 401 con WWW-Authenticate si el autenticador la define, si no 403
+                header = drf_request.authenticators[0].authenticate_header(drf_request) if drf_request.authenticators else None
+                if header:
+                    response['WWW-Authenticate'] = header
+                else:
+                    response.status_code = status.HTTP_403_FORBIDDEN
+            return response
+        return None
 
-        # 3. Encontrar la mejor coincidencia
-        best_match_index = np.argmax(product_similarities)
-        best_similarity_score = product_similarities[best_match_index]
+    async def post(self, request, *args, **kwargs):
+        # El autenticador JWT consulta el usuario en la base de datos
+        error = await sync_to_async(self._authorize)(request)
+        if error is not None:
+            return error
 
-        if best_similarity_score >= SIMILARITY_THRESHOLD:
-            matched_product_id = ALL_PRODUCT_IDS[best_match_index]
+        if not IA_COMPONENTS_LOADED:
+            start_warm_up()
+            if IA_LOAD_ERROR and _next_retry_at is None: # Error permanente al cargar los componentes de IA
+                return JsonResponse(
+                    {"error": "El servicio de búsqueda visual no está disponible debido a un error interno."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE
+                )
+            response = JsonResponse(
+                {"error": "El servicio de búsqueda visual se está iniciando. Inténtalo de nuevo en unos segundos."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = str(LOAD_RETRY_BASE_SECONDS)
+            return response
+
+        if RESNET_MODEL_INSTANCE is None:
+            return JsonResponse(
+                {"error": "Componentes de IA no inicializados correctamente. Contacte al administrador."},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        if not await ADMISSION.acquire():
+            response = JsonResponse(
+                {"error": "El buscador visual está saturado. Inténtalo de nuevo en unos segundos."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+            response['Retry-After'] = str(ADMISSION_RETRY_AFTER_SECONDS)
+            return response
+        try:
+            return await self._search(request)
+        finally:
+            ADMISSION.release()
+
+    async def _search(self, request):
+        await _run_cpu(_refresh_search_index)
+        search_index = SEARCH_INDEX # Referencia local: la versión no cambia durante la petición
+        if search_index is None:
+            return JsonResponse(
+                {"error": "El índice de búsqueda visual aún no se ha generado. Ejecuta el comando 'generate_image_embeddings'."},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
+        # Analizar el multipart lee el archivo subido (en memoria o en un temporal en disco)
+        files = await _run_cpu(lambda: request.FILES)
+        image_file = files.get('image')
+        if not image_file:
+            return JsonResponse({"error": "No se proporcionó ninguna imagen."}, status=status.HTTP_400_BAD_REQUEST)
+
+        params, error = _parse_search_params(request.POST)
+        if error:
+            return JsonResponse({"error": error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # 1. Embedding de la consulta (o el de la caché si ya se subió la misma imagen)
+        query_embedding = digest = None
+        if EMBEDDING_CACHE is not None:
+            digest, query_embedding = await _run_cpu(_cached_query_embedding, search_index, image_file)
+        if query_embedding is None:
             try:
-                producto_encontrado = Producto.objects.get(id=matched_product_id)
-                serializer = ProductoSerializer(producto_encontrado, context={'request': request})
-                return Response({
-                    "match_found": True,
-                    "product": serializer.data,
-                    "similarity_score": float(best_similarity_score) # Convertir a float nativo de Python
-                }, status=status.HTTP_200_OK)
-            except Producto.DoesNotExist:
-                # Esto no debería pasar si los IDs en product_ids.npy son correctos y los productos existen
-                return Response({
-                    "match_found": False, 
-                    "message": "Producto coincidente encontrado por IA pero no existe en la base de datos."
-                }, status=status.HTTP_404_NOT_FOUND)
+                query_embedding = await _aget_embedding_for_query(image_file, RESNET_MODEL_INSTANCE)
+            except ImageTooLargeError as e:
+                return JsonResponse({"error": str(e)}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+            if query_embedding is not None and digest is not None:
+                await _run_cpu(EMBEDDING_CACHE.set, search_index.version, digest, query_embedding, RESNET_MODEL_INSTANCE.name)
+
+        if query_embedding is None:
+            return JsonResponse({"error": "No se pudo procesar la imagen subida."}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        # 2. Búsqueda en el pool de hilos (las máscaras de filtros se recalculan en segundo plano)
+        scores, rows = await _run_cpu(_search, search_index, query_embedding, params, search_index.row_filters)
+        matched_ids, matched_scores, no_match = _matches(search_index, scores, rows)
+        if no_match is not None:
+            return JsonResponse(no_match, status=status.HTTP_200_OK)
+
+        # 3. Productos coincidentes con el ORM asíncrono, en una sola consulta
+        productos = await Producto.objects.select_related('categoria', 'proveedor').ain_bulk(matched_ids)
+        payload, code = await sync_to_async(_results_payload)(matched_ids, matched_scores, productos, request)
+        return JsonResponse(payload, status=code)
+
+
+class VisualSearchHealthAPIView(APIView):
+    """
+    Endpoint de disponibilidad para el balanceador de carga: 200 solo cuando el modelo
+    está calentado y el índice cargado en este proceso; 503 mientras arranca o si falló.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        if IA_COMPONENTS_LOADED:
+            _refresh_search_index()
         else:
-            return Response({
-                "match_found": False,
-                "message": f"No se encontró ningún producto suficientemente similar. Mejor similitud: {best_similarity_score:.2f}",
-                "best_similarity_score": float(best_similarity_score)
-            }, status=status.HTTP_200_OK)
\ No newline at end of file
+            start_warm_up()
+        health = ia_status()
+        code = status.HTTP_200_OK if health["status"] == 'ready' else status.HTTP_503_SERVICE_UNAVAILABLE
+        return Response(health, status=code)
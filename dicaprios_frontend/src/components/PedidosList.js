@@ -12,11 +12,11 @@ import { generarFacturaPDF } from './FacturaPDF'; //  Asegúrate que la ruta sea
 import { useNavigate } from 'react-router-dom';
 
 const API_BASE_URL = 'http://127.0.0.1:8000/api';
+const PAGE_SIZE = 100; // Pedidos por página (paginación por cursor del backend)
 
 const PedidosList = () => {
   const [todosLosPedidos, setTodosLosPedidos] = useState([]); // Todos los pedidos del backend
   const [pedidosFiltrados, setPedidosFiltrados] = useState([]); // Pedidos filtrados para mostrar
-  const [clientes, setClientes] = useState({});
   const [pedidoSeleccionado, setPedidoSeleccionado] = useState(null);
   const [mostrarFormulario, setMostrarFormulario] = useState(false);
   
@@ -27,34 +27,10 @@ const PedidosList = () => {
   const [loadingAccion, setLoadingAccion] = useState(null);
   const [error, setError] = useState(null);
   const [successMessage, setSuccessMessage] = useState('');
+  const [nextUrl, setNextUrl] = useState(null); // URL de la página siguiente (null si no hay más)
+  const [loadingMore, setLoadingMore] = useState(false);
   const navigate = useNavigate();
 
-  const fetchClientesParaPedidos = useCallback(async (pedidosData) => {
-    const clientesMap = { ...clientes };
-    let clientesCargados = false;
-    const token = localStorage.getItem('token');
-    if (!token) return;
-
-    for (const pedido of pedidosData) {
-      if (pedido.cliente && !clientesMap[pedido.cliente]) {
-        try {
-          const clienteResponse = await axios.get(`${API_BASE_URL}/clientes/${pedido.cliente}/`, {
-            headers: { Authorization: `Bearer ${token}` },
-          });
-          clientesMap[pedido.cliente] = clienteResponse.data.nombre_completo || clienteResponse.data.nombre || `ID: ${pedido.cliente}`;
-          clientesCargados = true;
-        } catch (err) {
-          console.error(`Error fetching client ${pedido.cliente}`, err);
-          clientesMap[pedido.cliente] = `ID: ${pedido.cliente}`;
-        }
-      }
-    }
-    if (clientesCargados) {
-      setClientes(clientesMap);
-    }
-  }, [clientes]);
-
-
   const fetchPedidos = useCallback(async () => {
     setLoading(true);
     setError(null);
@@ -66,14 +42,14 @@ const PedidosList = () => {
         setLoading(false);
         return;
       }
-      // Se obtienen TODOS los pedidos
-      const response = await axios.get(`${API_BASE_URL}/pedidos/`, {
+      // Solo los pedidos pendientes, filtrados y paginados en el backend.
+      // Cada pedido ya incluye 'cliente_nombre', sin peticiones adicionales por cliente.
+      const response = await axios.get(`${API_BASE_URL}/pedidos/?estado=Pendiente&page_size=${PAGE_SIZE}`, {
         headers: { Authorization: `Bearer ${token}` }
       });
-      setTodosLosPedidos(response.data); // Guardar todos los pedidos
-      if (response.data && response.data.length > 0) {
-        fetchClientesParaPedidos(response.data);
-      }
+      const pedidos = response.data.results;
+      setTodosLosPedidos(pedidos);
+      setNextUrl(response.data.next);
     } catch (err) {
       console.error('Error al obtener los pedidos', err.response || err);
       setError(err.response?.data?.detail || err.message || 'Error al cargar los pedidos');
@@ -81,7 +57,26 @@ const PedidosList = () => {
     } finally {
       setLoading(false);
     }
-  }, [fetchClientesParaPedidos]);
+  }, []);
+
+  const fetchMasPedidos = async () => {
+    if (!nextUrl) return;
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(nextUrl, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      const pedidos = response.data.results;
+      setTodosLosPedidos(prev => [...prev, ...pedidos]);
+      setNextUrl(response.data.next);
+    } catch (err) {
+      console.error('Error al obtener más pedidos', err.response || err);
+      setError(err.response?.data?.detail || err.message || 'Error al cargar los pedidos');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   // useEffect para filtrar los pedidos cuando 'todosLosPedidos' cambia
   useEffect(() => {
@@ -254,7 +249,7 @@ const PedidosList = () => {
                 pedidosFiltrados.map((pedido) => ( // <--- CAMBIO AQUÍ
                   <TableRow hover key={pedido.id}>
                     <TableCell>{pedido.id}</TableCell>
-                    <TableCell>{clientes[pedido.cliente] || `ID: ${pedido.cliente}`}</TableCell>
+                    <TableCell>{pedido.cliente_nombre || `ID: ${pedido.cliente}`}</TableCell>
                     <TableCell>{new Date(pedido.fecha).toLocaleDateString('es-GT')}</TableCell>
                     <TableCell>{pedido.estado}</TableCell>
                     <TableCell align="right">
@@ -298,6 +293,13 @@ const PedidosList = () => {
               </TableBody>
             </Table>
           </TableContainer>
+          {nextUrl && (
+            <Box sx={{ textAlign: 'center', my: 2 }}>
+              <Button variant="outlined" onClick={fetchMasPedidos} disabled={loadingMore}>
+                {loadingMore ? <CircularProgress size={16} /> : 'Cargar más'}
+              </Button>
+            </Box>
+          )}
           
           <Dialog open={openDialog} onClose={() => setOpenDialog(false)}>
             <DialogTitle>Confirmar Eliminación</DialogTitle>
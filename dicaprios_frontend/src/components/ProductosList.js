@@ -10,6 +10,9 @@ import ProductoForm from './ProductoForm';
 
 // Mover la URL base a una constante para fácil mantenimiento
 const API_BASE_URL = 'http://127.0.0.1:8000/api';
+// Productos por página (paginación por cursor del backend). La tabla no muestra la imagen,
+// así que se omite 'imagen_url' del listado y se pide al abrir el formulario de edición.
+const PAGE_SIZE = 100;
 
 const ProductosList = () => {
   const [productos, setProductos] = useState([]);
@@ -19,6 +22,8 @@ const ProductosList = () => {
   const [productoAEliminar, setProductoAEliminar] = useState(null);
   const [loading, setLoading] = useState(false); // Estado para la carga de la lista
   const [error, setError] = useState(null); // Estado para errores de carga
+  const [nextUrl, setNextUrl] = useState(null); // URL de la página siguiente (null si no hay más)
+  const [loadingMore, setLoadingMore] = useState(false);
 
   // Usar useCallback para fetchProductos para evitar recreaciones innecesarias
   const fetchProductos = useCallback(async () => {
@@ -31,12 +36,13 @@ const ProductosList = () => {
         setLoading(false);
         return;
       }
-      const response = await axios.get(`${API_BASE_URL}/productos/`, {
+      const response = await axios.get(`${API_BASE_URL}/productos/?page_size=${PAGE_SIZE}&omit=imagen_url`, {
         headers: {
           Authorization: `Bearer ${token}`
         }
       });
-      setProductos(response.data);
+      setProductos(response.data.results);
+      setNextUrl(response.data.next);
     } catch (err) {
       console.error('Error al obtener los productos', err.response || err);
       setError(err.response?.data?.detail || err.message || 'Error al cargar los productos');
@@ -45,6 +51,26 @@ const ProductosList = () => {
     }
   }, []); // Sin dependencias, ya que no usa props o estado que cambie fuera de ella
 
+  const fetchMasProductos = async () => {
+    if (!nextUrl) return;
+    setLoadingMore(true);
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(nextUrl, {
+        headers: {
+          Authorization: `Bearer ${token}`
+        }
+      });
+      setProductos(prev => [...prev, ...response.data.results]);
+      setNextUrl(response.data.next);
+    } catch (err) {
+      console.error('Error al obtener más productos', err.response || err);
+      setError(err.response?.data?.detail || err.message || 'Error al cargar los productos');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     if (!mostrarFormulario) { // Solo cargar productos si el formulario no está visible
         fetchProductos();
@@ -73,8 +99,20 @@ const ProductosList = () => {
     }
   };
 
-  const handleEdit = (producto) => {
-    setProductoSeleccionado(producto);
+  const handleEdit = async (producto) => {
+    // El listado no incluye 'imagen_url': se carga el producto completo para el formulario
+    try {
+      const token = localStorage.getItem('token');
+      const response = await axios.get(`${API_BASE_URL}/productos/${producto.id}/`, {
+        headers: {
+          Authorization: `Bearer ${token}`
+        }
+      });
+      setProductoSeleccionado(response.data);
+    } catch (err) {
+      console.error('Error al obtener el producto', err.response || err);
+      setProductoSeleccionado(producto);
+    }
     setMostrarFormulario(true);
   };
 
@@ -184,6 +222,13 @@ const ProductosList = () => {
               </TableBody>
             </Table>
           </TableContainer>
+          {nextUrl && (
+            <Box sx={{ textAlign: 'center', my: 2 }}>
+              <Button variant="outlined" onClick={fetchMasProductos} disabled={loadingMore}>
+                {loadingMore ? <CircularProgress size={16} /> : 'Cargar más'}
+              </Button>
+            </Box>
+          )}
           <Dialog
             open={openDialog}
             onClose={() => setOpenDialog(false)}